@@ -0,0 +1,44 @@
+"""
+Completa el tipo de cambio histórico (expenses.pen_rate) de cada gasto.
+
+Cada gasto guarda al crearse los soles por unidad de su moneda vigentes en su
+fecha; este script lo calcula para los gastos anteriores a esa columna (o para
+todos con --all) desde la tabla exchange_rates, y luego regenera user_balances.
+
+Para cargar historia antigua, pasar un JSON {"YYYY-MM-DD": {"dolares": 3.7,
+"reales": 0.7}, ...} con --rates-file; se guarda en exchange_rates antes de
+completar los gastos. Es idempotente.
+
+Uso: python backfill_expense_rates.py [--rates-file historia.json] [--all]
+"""
+
+import argparse
+
+from database import SessionLocal, Base, engine
+from capital import rebuild_ledger
+from exchange_rates import FileRateProvider, rate_store, backfill_expense_rates
+
+def backfill(rates_file=None, only_missing=True):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        try:
+            if rates_file:
+                history = FileRateProvider(rates_file).fetch()
+                rate_store.save(db, history, "file")
+                print(f"✅ {len(history)} días de tipo de cambio cargados desde {rates_file}.")
+            print("Completando expenses.pen_rate...")
+            updated = backfill_expense_rates(db, only_missing=only_missing)
+            rebuild_ledger(db)
+            db.commit()
+            print(f"✅ {updated} gastos actualizados; user_balances regenerado.")
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Error completando el tipo de cambio de los gastos: {e}")
+            raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rates-file", help="JSON con tipos de cambio históricos por fecha")
+    parser.add_argument("--all", action="store_true", help="recalcular también los gastos que ya tienen tipo")
+    args = parser.parse_args()
+    backfill(args.rates_file, only_missing=not args.all)
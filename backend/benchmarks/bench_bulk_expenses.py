@@ -0,0 +1,106 @@
+"""
+Benchmark: importar 10k gastos en un item compartido.
+
+Compara `POST /api/items/{item_id}/expenses/bulk` (validación y acceso una vez, un lote
+de clasificación, un INSERT de varias filas y un delta de saldos y resumen por pedido,
+en pedidos de BULK_EXPENSES_MAX filas) contra un `POST /api/items/{item_id}/expenses`
+por gasto, medido sobre una muestra y extrapolado. Verifica al final que saldos y
+contadores del resumen coincidan con regenerarlos desde `expenses`.
+
+Uso: python benchmarks/bench_bulk_expenses.py [--expenses 10000] [--sample 500]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import SessionLocal, create_user, report
+
+from capital import rebuild_ledger
+from expense_bulk import BULK_EXPENSES_MAX
+from main import create_expense, create_expenses_bulk
+from models import Item, UserBalance
+from schemas import ExpenseBulkCreate, ExpenseCreate
+from summaries import verify_item_totals
+
+DESCRIPTIONS = ["Uber al trabajo", "Wong supermercado", "Netflix", "Farmacia Inkafarma", "Luz del Sur",
+                "Cine Cineplanet", "Restaurante", "Rappi pedido", "Gasolina Primax", "Transferencia"]
+
+
+def seed(db):
+    owner = create_user(db, "owner@bench.com")
+    partners = [create_user(db, f"socio{k}@bench.com") for k in range(2)]
+    item = Item(name="Importación", item_type="shared", owner_id=owner.id)
+    item.participants.extend(partners)
+    db.add(item)
+    db.commit()
+    return owner, [p.id for p in partners], item.id
+
+
+def payloads(n: int, member_ids, seed_value: int):
+    rng = random.Random(seed_value)
+    start = datetime(2026, 1, 1)
+    return [
+        {
+            "amount": round(rng.uniform(5, 300), 2),
+            "description": f"{rng.choice(DESCRIPTIONS)} {k}",
+            "payment_method": rng.choice(["banco", "efectivo"]),
+            "currency": rng.choice(["soles", "soles", "dolares"]),
+            "paid_by": rng.choice(member_ids),
+            "split_type": "divided",
+            "date": (start + timedelta(minutes=53 * k)).strftime("%Y-%m-%dT%H:%M"),
+        }
+        for k in range(n)
+    ]
+
+
+def ledger_rows(db):
+    return sorted(
+        (r.user_id, r.item_id, r.currency, round(r.share, 4), round(r.owed_to_me, 4), round(r.i_owe, 4))
+        for r in db.query(UserBalance).all()
+        if r.expense_count or r.owed_count or r.owe_count
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expenses", type=int, default=10000)
+    parser.add_argument("--sample", type=int, default=500)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        owner, partner_ids, item_id = seed(db)
+        members = [owner.id, *partner_ids]
+
+        rows = payloads(args.expenses, members, 1)
+        t0 = time.perf_counter()
+        for start in range(0, len(rows), BULK_EXPENSES_MAX):
+            result = create_expenses_bulk(
+                item_id, ExpenseBulkCreate(expenses=rows[start:start + BULK_EXPENSES_MAX]), current_user=owner, db=db
+            )
+            assert not result["errors"]
+        bulk_s = time.perf_counter() - t0
+
+        sample = payloads(args.sample, members, 2)
+        t0 = time.perf_counter()
+        for row in sample:
+            create_expense(item_id, ExpenseCreate(**row), current_user=owner, db=db)
+        single_s = time.perf_counter() - t0
+
+        assert verify_item_totals(db) == []
+        incremental = ledger_rows(db)
+        rebuild_ledger(db)
+        db.commit()
+        assert incremental == ledger_rows(db), "los saldos por lote no coinciden con la regeneración"
+
+        single_rate = args.sample / single_s
+        bulk_rate = args.expenses / bulk_s
+        report(f"Importar {args.expenses} gastos en un item compartido (pedidos de {BULK_EXPENSES_MAX})", [
+            ("un POST por gasto", f"{single_rate:8.0f} gastos/s  (~{args.expenses / single_rate:.1f} s para {args.expenses})"),
+            ("POST /expenses/bulk", f"{bulk_rate:8.0f} gastos/s  ({bulk_s:.2f} s)"),
+            ("speedup", f"{bulk_rate / single_rate:8.1f}x"),
+        ])
+
+
+if __name__ == "__main__":
+    main()
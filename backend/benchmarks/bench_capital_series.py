@@ -0,0 +1,115 @@
+"""
+Benchmark: serie de capital de un usuario con 5 años de historia y 20k gastos.
+
+Compara la serie mensual armada en una pasada (capital_series) contra recalcular el
+capital punto por punto recorriendo todos los gastos en Python, que es lo que costaría
+llamar a /api/capital una vez por mes.
+
+Uso: python benchmarks/bench_capital_series.py [--expenses 20000] [--years 5]
+"""
+import argparse
+import random
+from datetime import date, datetime, timedelta
+
+from common import SessionLocal, create_user, new_id, report, timed
+
+from sqlalchemy import insert
+
+from capital import calculate_user_expense_share, capital_series, rebuild_ledger
+from models import Expense, Item, UserIncome, item_participants
+
+
+def seed(db, expenses: int, years: int):
+    rng = random.Random(7)
+    owner = create_user(db, "owner@bench.com")
+    partner = create_user(db, "partner@bench.com")
+    start = date.today().replace(day=1) - timedelta(days=365 * years)
+
+    items = []
+    for k in range(years * 12):
+        item_id = new_id()
+        items.append({
+            "id": item_id, "name": f"Mes {k}", "item_type": "shared" if k % 2 else "personal",
+            "owner_id": owner.id, "is_archived": False, "is_recurring": True,
+            "created_at": datetime.combine(start, datetime.min.time()) + timedelta(days=30 * k),
+        })
+    db.execute(insert(Item), items)
+    db.execute(insert(item_participants), [
+        {"item_id": i["id"], "user_id": partner.id} for i in items if i["item_type"] == "shared"
+    ])
+
+    rows = []
+    for _ in range(expenses):
+        k = rng.randrange(len(items))
+        spent = datetime.combine(start, datetime.min.time()) + timedelta(days=30 * k + rng.randrange(28))
+        rows.append({
+            "id": new_id(), "item_id": items[k]["id"], "amount": round(rng.uniform(5, 300), 2),
+            "description": "gasto", "payment_method": "banco", "currency": rng.choice(["soles", "soles", "dolares"]),
+            "paid_by": rng.choice([owner.id, partner.id]), "split_type": "divided",
+            "date": spent, "created_at": spent, "is_settled": rng.random() < 0.5,
+        })
+    db.execute(insert(Expense), rows)
+    db.add(UserIncome(user_id=owner.id, income_type="periodic", amount=7000, currency="soles",
+                      date=datetime.combine(start, datetime.min.time()), day_of_month=1))
+    db.add(UserIncome(user_id=owner.id, income_type="one_time", amount=20000, currency="soles",
+                      date=datetime.combine(start, datetime.min.time())))
+    rebuild_ledger(db)
+    db.commit()
+    return owner, start
+
+
+def naive_series(db, user_id, start, end):
+    """Punto por punto, recorriendo todos los gastos del usuario con la regla en Python."""
+    from capital import count_periodic_occurrences, item_participant_count
+
+    items = db.query(Item).all()
+    counts = {item.id: item_participant_count(item, db) for item in items}
+    incomes = db.query(UserIncome).filter(UserIncome.user_id == user_id).all()
+    points, cursor = [], date(start.year, start.month, 1)
+    while cursor <= end:
+        next_month = (cursor.replace(day=28) + timedelta(days=4)).replace(day=1)
+        point = min(next_month - timedelta(days=1), end)
+        totals = {}
+        for income in incomes:
+            if income.income_type == "periodic":
+                n = count_periodic_occurrences(income.date.date(), income.day_of_month, point)
+            else:
+                n = 1 if income.date.date() <= point else 0
+            totals[income.currency] = totals.get(income.currency, 0.0) + income.amount * n
+        for item in items:
+            for expense in item.expenses:
+                if expense.date.date() <= point:
+                    share = calculate_user_expense_share(expense, user_id, item, counts[item.id])
+                    totals[expense.currency] = totals.get(expense.currency, 0.0) - share
+        points.append({c: round(a, 2) for c, a in totals.items()})
+        cursor = next_month
+    return points
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expenses", type=int, default=20000)
+    parser.add_argument("--years", type=int, default=5)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        owner, start = seed(db, args.expenses, args.years)
+        end = date.today()
+
+        fast_ms, fast = timed(lambda: capital_series(owner.id, db, start, end))
+        naive_ms, naive = timed(lambda: naive_series(db, owner.id, start, end), repeat=1)
+        # Misma cifra salvo el orden de suma de los floats (diferencias de centavo al redondear)
+        assert all(
+            abs(point["by_currency"].get(c, 0.0) - amount) <= 0.02
+            for point, expected in zip(fast, naive) for c, amount in expected.items()
+        ), "la serie no coincide con el recálculo punto a punto"
+
+        report(f"Serie de capital: {len(fast)} puntos, {args.expenses} gastos, {args.years} años", [
+            ("capital_series (una pasada)", f"{fast_ms:8.1f} ms"),
+            ("recálculo por punto (Python)", f"{naive_ms:8.1f} ms"),
+            ("speedup", f"{naive_ms / fast_ms:8.1f}x"),
+        ])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: clasificación por reglas de 100k descripciones.
+
+Compara el autómata compilado (classify_expense_with_rules) contra la versión
+anterior, que consultaba la tabla de categorías y partía sus palabras clave en cada
+llamada, y contra el mismo recorrido lineal con las palabras ya cargadas en memoria.
+
+Uso: python benchmarks/bench_classify_rules.py [--descriptions 100000]
+"""
+import argparse
+import random
+
+from common import SessionLocal, report, timed
+
+from classification import classify_expense_with_rules, keyword_matcher, split_keywords
+from main import seed_categories
+from models import Category
+
+WORDS = [
+    "pago", "compra", "lima", "centro", "mensual", "cuota", "tarjeta", "local", "familia",
+    "regalo", "casa", "oficina", "semana", "extra", "varios", "tienda", "pedido", "online",
+]
+
+
+def descriptions(db, n: int):
+    rng = random.Random(11)
+    keywords = [k for (kw,) in db.query(Category.keywords) for k in split_keywords(kw)]
+    rows = []
+    for _ in range(n):
+        words = rng.sample(WORDS, rng.randint(1, 4))
+        if rng.random() < 0.7:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(keywords))
+        rows.append(" ".join(words).upper() if rng.random() < 0.2 else " ".join(words))
+    return rows
+
+
+def legacy_classify(description, db):
+    """La implementación anterior: una consulta y un split por llamada."""
+    text_value = (description or "").strip().lower()
+    if not text_value:
+        return "otros"
+    for category in db.query(Category).order_by(Category.position).all():
+        if not category.keywords:
+            continue
+        keywords = [k.strip() for k in category.keywords.split(",") if k.strip()]
+        if any(keyword in text_value for keyword in keywords):
+            return category.name
+    return "otros"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--descriptions", type=int, default=100000)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        seed_categories(db)
+        texts = descriptions(db, args.descriptions)
+        categories = [
+            (name, split_keywords(keywords))
+            for name, keywords in db.query(Category.name, Category.keywords).order_by(Category.position)
+        ]
+
+        def linear(description):
+            text_value = (description or "").strip().lower()
+            for name, keywords in categories:
+                if any(keyword in text_value for keyword in keywords):
+                    return name
+            return "otros"
+
+        keyword_matcher.invalidate()
+        build_ms, _ = timed(lambda: keyword_matcher.invalidate() or keyword_matcher.get(db))
+        fast_ms, fast = timed(lambda: [classify_expense_with_rules(t, db) for t in texts])
+        linear_ms, linear_result = timed(lambda: [linear(t) for t in texts])
+        legacy_ms, legacy = timed(lambda: [legacy_classify(t, db) for t in texts], repeat=1)
+        assert fast == legacy == linear_result, "el autómata no coincide con el recorrido lineal"
+
+        report(f"Clasificación por reglas: {len(texts)} descripciones, {len(categories)} categorías", [
+            ("compilar autómata", f"{build_ms:8.1f} ms"),
+            ("autómata compilado", f"{fast_ms:8.1f} ms"),
+            ("lineal en memoria", f"{linear_ms:8.1f} ms"),
+            ("anterior (consulta por llamada)", f"{legacy_ms:8.1f} ms"),
+            ("speedup vs anterior", f"{legacy_ms / fast_ms:8.1f}x"),
+        ])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark: paginación del listado de gastos de un item con 50k gastos.
+
+Mide la latencia de una página de `get_expenses` (cursor sobre (date, created_at, id) e
+índice ix_expenses_item_date_created) al principio, a la mitad y al final de la lista,
+contra la misma página pedida con OFFSET, que recorre todas las filas anteriores, y
+contra el listado completo sin paginar.
+
+Uso: python benchmarks/bench_expenses_pagination.py [--expenses 50000] [--page-size 100]
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+from common import SessionLocal, create_user, new_id, report, timed
+
+from sqlalchemy import insert
+
+from main import get_expenses
+from models import Expense, Item
+
+
+def seed(db, n: int):
+    rng = random.Random(3)
+    owner = create_user(db, "owner@bench.com")
+    item_id = new_id()
+    other_id = new_id()
+    db.execute(insert(Item), [
+        {"id": item_id, "name": "Compartido", "item_type": "personal", "owner_id": owner.id,
+         "is_archived": False, "is_recurring": False, "data_version": 0},
+        {"id": other_id, "name": "Otro", "item_type": "personal", "owner_id": owner.id,
+         "is_archived": False, "is_recurring": False, "data_version": 0},
+    ])
+    start = datetime(2020, 1, 1)
+    rows = []
+    for k in range(n + n // 5):
+        # Varios gastos por día y algunos con la misma fecha exacta: el id desempata
+        spent = start + timedelta(hours=rng.randrange(n // 4))
+        rows.append({
+            "id": new_id(), "item_id": item_id if k < n else other_id, "amount": round(rng.uniform(5, 300), 2),
+            "description": f"gasto {k}", "payment_method": "banco", "currency": "soles",
+            "paid_by": owner.id, "split_type": "personal", "date": spent, "created_at": spent,
+        })
+    db.execute(insert(Expense), rows)
+    db.commit()
+    return owner, item_id
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expenses", type=int, default=50000)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        owner, item_id = seed(db, args.expenses)
+        size = args.page_size
+
+        def page(cursor=None):
+            response = get_expenses(item_id, q=None, limit=size, cursor=cursor, current_user=owner, db=db)
+            return json.loads(response.body), response.headers.get("x-next-cursor")
+
+        # Cursores de todas las páginas, recorriendo la lista una vez
+        cursors, cursor, total = [None], None, 0
+        while True:
+            expenses, cursor = page(cursor)
+            total += len(expenses)
+            if not cursor:
+                break
+            cursors.append(cursor)
+
+        def offset_page(index):
+            return (
+                db.query(Expense).filter(Expense.item_id == item_id)
+                .order_by(Expense.date.desc(), Expense.created_at.desc(), Expense.id.desc())
+                .offset(index * size).limit(size).all()
+            )
+
+        rows = []
+        for label, index in [("primera", 0), ("mitad", len(cursors) // 2), ("última", len(cursors) - 1)]:
+            keyset_ms, (keyset, _) = timed(lambda: page(cursors[index]), repeat=20)
+            offset_ms, offset = timed(lambda: offset_page(index), repeat=20)
+            assert [e["id"] for e in keyset] == [e.id for e in offset]
+            rows.append((f"página {label} (cursor)", f"{keyset_ms:8.2f} ms"))
+            rows.append((f"página {label} (OFFSET)", f"{offset_ms:8.2f} ms"))
+        full_ms, full = timed(lambda: get_expenses(item_id, q=None, limit=None, cursor=None, current_user=owner, db=db), repeat=3)
+        assert len(json.loads(full.body)) == total
+        rows.append(("listado completo sin paginar", f"{full_ms:8.1f} ms"))
+
+        report(f"Listado de gastos: {total} gastos en el item, páginas de {size}", rows)
+
+
+if __name__ == "__main__":
+    main()
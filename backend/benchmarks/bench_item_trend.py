@@ -0,0 +1,99 @@
+"""
+Benchmark: tendencia mensual sobre una cadena de items de 10 años.
+
+Compara `item_chain_trend` (la cadena con un WITH RECURSIVE y los montos sumados desde
+`item_category_totals`) contra recorrer la cadena item por item, como haría el cliente
+pidiendo cada mes por separado: una consulta por enlace más un GROUP BY sobre
+`expenses` por item.
+
+Uso: python benchmarks/bench_item_trend.py [--months 120] [--expenses-per-month 200]
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from common import SessionLocal, create_user, new_id, report, timed
+
+from sqlalchemy import func, insert
+
+from models import Expense, Item
+from summaries import item_chain_trend, rebuild_item_totals
+
+CATEGORIES = ["alimentacion", "transporte", "servicios", "salud", "entretenimiento", "otros"]
+
+
+def seed(db, months: int, per_month: int):
+    rng = random.Random(5)
+    owner = create_user(db, "owner@bench.com")
+    start = datetime(2016, 1, 1)
+    ids = [new_id() for _ in range(months)]
+    db.execute(insert(Item), [
+        {
+            "id": item_id, "name": f"Mes {k}", "item_type": "personal", "owner_id": owner.id,
+            "is_archived": False, "is_recurring": True, "data_version": 0,
+            "previous_item_id": ids[k - 1] if k else None,
+            "next_item_id": ids[k + 1] if k + 1 < months else None,
+            "created_at": start + timedelta(days=30 * k),
+        }
+        for k, item_id in enumerate(ids)
+    ])
+    # Otros items sueltos para que la tabla no sea solo la cadena
+    db.execute(insert(Item), [
+        {"id": new_id(), "name": f"Viaje {k}", "item_type": "personal", "owner_id": owner.id,
+         "is_archived": False, "is_recurring": False, "data_version": 0}
+        for k in range(months * 5)
+    ])
+    rows = []
+    for k, item_id in enumerate(ids):
+        for _ in range(per_month):
+            spent = start + timedelta(days=30 * k + rng.randrange(28))
+            rows.append({
+                "id": new_id(), "item_id": item_id, "amount": round(rng.uniform(5, 300), 2),
+                "description": "gasto", "payment_method": "banco",
+                "currency": rng.choice(["soles", "soles", "dolares"]), "paid_by": owner.id,
+                "split_type": "personal", "date": spent, "created_at": spent,
+                "ai_category": rng.choice(CATEGORIES),
+            })
+    db.execute(insert(Expense), rows)
+    rebuild_item_totals(db)
+    db.commit()
+    return owner, ids
+
+
+def walk_chain(db, item_id: str):
+    """Lo que costaba sin el endpoint: seguir los enlaces y agrupar cada mes por separado."""
+    result = []
+    current = db.query(Item).filter(Item.id == item_id).one()
+    while current.previous_item_id:
+        current = db.query(Item).filter(Item.id == current.previous_item_id).one()
+    while current is not None:
+        result.append(db.query(
+            Expense.currency, Expense.ai_category, func.sum(Expense.amount), func.count(Expense.id)
+        ).filter(Expense.item_id == current.id).group_by(Expense.currency, Expense.ai_category).all())
+        current = db.query(Item).filter(Item.id == current.next_item_id).one() if current.next_item_id else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--months", type=int, default=120)
+    parser.add_argument("--expenses-per-month", type=int, default=200)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        owner, ids = seed(db, args.months, args.expenses_per_month)
+        middle = ids[len(ids) // 2]
+        cte_ms, (months, rows) = timed(lambda: item_chain_trend(db, middle, owner.id))
+        walk_ms, walked = timed(lambda: walk_chain(db, middle))
+        assert [m[0] for m in months] == ids and len(walked) == len(ids)
+        assert len(rows) == sum(len(month) for month in walked)
+
+        report(f"Tendencia: cadena de {args.months} meses, {args.months * args.expenses_per_month} gastos", [
+            ("WITH RECURSIVE + contadores", f"{cte_ms:8.1f} ms"),
+            ("item por item", f"{walk_ms:8.1f} ms"),
+            ("speedup", f"{walk_ms / cte_ms:8.1f}x"),
+        ])
+
+
+if __name__ == "__main__":
+    main()
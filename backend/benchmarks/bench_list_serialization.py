@@ -0,0 +1,86 @@
+"""
+Benchmark: serialización del listado de gastos de un item con 10k gastos.
+
+Compara el camino anterior (objetos ORM validados uno por uno con ExpenseResponse
+`from_attributes`, jsonable_encoder y json.dumps, como hace FastAPI con un
+response_model) contra el actual (tuplas de columnas con Core, dicts armados a mano y
+`serialization.dumps`: orjson, o `json` si no está instalado). Reporta también el tamaño con gzip.
+
+Uso: python benchmarks/bench_list_serialization.py [--expenses 10000]
+"""
+import argparse
+import gzip
+import json
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+from common import SessionLocal, create_user, new_id, report, timed
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import insert, select
+
+from models import Expense, Item
+from schemas import ExpenseResponse
+from serialization import EXPENSE_COLUMNS, dumps, expense_dicts, orjson
+
+
+def seed(db, n: int):
+    rng = random.Random(9)
+    owner = create_user(db, "owner@bench.com")
+    item_id = new_id()
+    db.execute(insert(Item), [{"id": item_id, "name": "Item", "item_type": "personal", "owner_id": owner.id,
+                               "is_archived": False, "is_recurring": False, "data_version": 0}])
+    start = datetime(2024, 1, 1)
+    db.execute(insert(Expense), [
+        {
+            "id": new_id(), "item_id": item_id, "amount": round(rng.uniform(5, 300), 2),
+            "description": f"gasto {k}", "payment_method": "banco", "currency": "soles",
+            "paid_by": owner.id, "split_type": "divided", "date": start + timedelta(minutes=37 * k),
+            "created_at": start + timedelta(minutes=37 * k), "is_installment": False, "is_recurring": False,
+            "is_settled": rng.random() < 0.5, "ai_category": "otros", "ai_confidence": 0.35,
+            "ai_model": "rules-v1", "ai_classified_at": start,
+        }
+        for k in range(n)
+    ])
+    db.commit()
+    return item_id
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expenses", type=int, default=10000)
+    args = parser.parse_args()
+
+    adapter = TypeAdapter(List[ExpenseResponse])
+    with SessionLocal() as db:
+        item_id = seed(db, args.expenses)
+        order = (Expense.date.desc(), Expense.created_at.desc(), Expense.id.desc())
+
+        def legacy():
+            db.expunge_all()
+            expenses = db.query(Expense).filter(Expense.item_id == item_id).order_by(*order).all()
+            validated = adapter.validate_python(expenses, from_attributes=True)
+            return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+        def fast():
+            rows = db.execute(select(*EXPENSE_COLUMNS).where(Expense.item_id == item_id).order_by(*order))
+            return dumps(expense_dicts(rows))
+
+        legacy_ms, legacy_body = timed(legacy)
+        fast_ms, fast_body = timed(fast)
+        assert json.loads(legacy_body) == json.loads(fast_body), "las dos salidas difieren"
+        gzip_ms, compressed = timed(lambda: gzip.compress(fast_body, compresslevel=5))
+
+        report(f"Listado de {args.expenses} gastos (encoder: {'orjson' if orjson else 'json'})", [
+            ("ORM + ExpenseResponse", f"{legacy_ms:8.1f} ms"),
+            ("Core + dicts", f"{fast_ms:8.1f} ms"),
+            ("speedup", f"{legacy_ms / fast_ms:8.1f}x"),
+            ("JSON", f"{len(fast_body) / 1024:8.0f} KiB"),
+            ("gzip (nivel 5)", f"{len(compressed) / 1024:8.0f} KiB en {gzip_ms:.1f} ms"),
+        ])
+
+
+if __name__ == "__main__":
+    main()
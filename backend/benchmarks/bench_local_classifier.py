@@ -0,0 +1,64 @@
+"""
+Benchmark: clasificador local (Naive Bayes sobre n-gramas) entrenado con 5k
+correcciones sintéticas; latencia por predicción en lote y tamaño del artefacto.
+
+Uso: python benchmarks/bench_local_classifier.py [--samples 5000] [--predictions 100000]
+"""
+import argparse
+import os
+import random
+import tempfile
+
+from common import report, timed
+
+from local_classifier import NaiveBayesModel
+
+VOCABULARY = {
+    "alimentacion": ["pollo", "brasa", "menu", "chifa", "cevicheria", "almuerzo", "cena", "delivery"],
+    "transporte": ["taxi", "uber", "cabify", "bus", "peaje", "grifo", "gasolina", "cochera"],
+    "mascotas": ["vet", "croquetas", "arena", "gato", "perro", "vacuna", "bano", "petshop"],
+    "hogar": ["ferreteria", "foco", "pintura", "sodimac", "promart", "cortina", "mueble", "limpieza"],
+    "salud": ["farmacia", "inkafarma", "clinica", "consulta", "analisis", "dentista", "lentes", "receta"],
+}
+FILLER = ["lima", "sabado", "pedido", "online", "familia", "extra", "mes", "miraflores"]
+
+
+def samples(n: int, rng: random.Random):
+    rows = []
+    for _ in range(n):
+        category = rng.choice(list(VOCABULARY))
+        words = rng.sample(VOCABULARY[category], 2) + rng.sample(FILLER, rng.randint(0, 2))
+        rng.shuffle(words)
+        rows.append((" ".join(words), category))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=5000)
+    parser.add_argument("--predictions", type=int, default=100000)
+    args = parser.parse_args()
+    rng = random.Random(5)
+
+    train_set = samples(args.samples, rng)
+    test_set = samples(args.predictions, rng)
+    texts = [text_value for text_value, _ in test_set]
+
+    train_ms, model = timed(lambda: NaiveBayesModel.train(train_set), repeat=1)
+    predict_ms, predictions = timed(lambda: model.predict_batch(texts), repeat=3)
+    hits = sum(1 for p, (_, c) in zip(predictions, test_set) if p and p[0] == c)
+
+    path = os.path.join(tempfile.mkdtemp(), "model.json.gz")
+    model.save(path)
+    report(f"Clasificador local: {args.samples} ejemplos, {args.predictions} predicciones", [
+        ("entrenamiento", f"{train_ms:8.1f} ms"),
+        ("predicción en lote", f"{predict_ms:8.1f} ms"),
+        ("por predicción", f"{predict_ms * 1000 / len(texts):8.1f} µs"),
+        ("exactitud", f"{hits / len(texts):8.1%}"),
+        ("n-gramas", f"{len(model.features):8d}"),
+        ("artefacto", f"{os.path.getsize(path) / 1024:8.0f} KB"),
+    ])
+
+
+if __name__ == "__main__":
+    main()
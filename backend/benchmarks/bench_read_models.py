@@ -0,0 +1,173 @@
+"""
+Benchmark: memoria y latencia de los endpoints de lectura con modelos ORM vs read_models.
+
+Un usuario con 200 items (150 propios y 50 donde participa), cada uno con tres
+participantes, una invitación pendiente y algunos gastos. Para cada lectura compara el
+camino anterior (objetos ORM con identity map y relaciones perezosas, validados con el
+schema de respuesta) contra las filas con `__slots__` de read_models.py cargadas con
+`select()` de Core. La memoria se mide con tracemalloc: pico durante el pedido y bloques
+asignados que siguen vivos al terminar (la respuesta y lo que retiene la sesión).
+
+Uso: python benchmarks/bench_read_models.py [--items 200]
+"""
+import argparse
+import random
+import tracemalloc
+from datetime import datetime, timedelta
+
+from common import SessionLocal, create_user, new_id, report, timed
+
+from sqlalchemy import insert, or_, select
+
+from capital import get_user_capital, rebuild_ledger
+from models import Expense, Item, PendingInvitation, UserBalance, UserIncome, item_participants
+from read_models import item_participant_rows, user_balance_rows, user_incomes, user_items
+from schemas import ItemResponse, UserIncomeResponse
+from serialization import item_dict
+
+
+def seed(db, n_items: int):
+    rng = random.Random(21)
+    user = create_user(db, "user@bench.com")
+    user_id = user.id
+    others = [create_user(db, f"otro{k}@bench.com") for k in range(20)]
+    start = datetime(2024, 1, 1)
+    items, links, invitations, expenses = [], [], [], []
+    for k in range(n_items):
+        item_id = new_id()
+        owner = user if k < n_items * 3 // 4 else rng.choice(others)
+        members = {user_id, *(o.id for o in rng.sample(others, 3))} - {owner.id}
+        items.append({"id": item_id, "name": f"Item {k}", "item_type": "shared", "owner_id": owner.id,
+                      "is_archived": False, "is_recurring": False, "data_version": 0,
+                      "created_at": start + timedelta(days=k)})
+        links.extend({"item_id": item_id, "user_id": member} for member in members)
+        invitations.append({"id": new_id(), "item_id": item_id, "email": f"pendiente{k}@bench.com",
+                            "invited_at": start})
+        for j in range(5):
+            expenses.append({
+                "id": new_id(), "item_id": item_id, "amount": round(rng.uniform(5, 300), 2),
+                "description": f"gasto {j}", "payment_method": "banco", "currency": rng.choice(["soles", "dolares"]),
+                "paid_by": owner.id, "split_type": "divided", "date": start + timedelta(days=k, hours=j),
+                "created_at": start + timedelta(days=k, hours=j), "is_settled": False, "pen_rate": 3.7,
+            })
+    db.execute(insert(Item), items)
+    db.execute(insert(item_participants), links)
+    db.execute(insert(PendingInvitation), invitations)
+    db.execute(insert(Expense), expenses)
+    db.execute(insert(UserIncome), [
+        {"id": new_id(), "user_id": user_id, "income_type": "periodic" if k % 2 else "one_time",
+         "amount": 1000.0 + k, "currency": "soles", "description": f"ingreso {k}",
+         "date": start + timedelta(days=30 * k), "day_of_month": 15 if k % 2 else None,
+         "created_at": start + timedelta(days=30 * k)}
+        for k in range(24)
+    ])
+    rebuild_ledger(db)
+    db.commit()
+    return user_id, [row["id"] for row in items]
+
+
+# ---- Camino anterior: objetos ORM ----
+
+def orm_items(db, user_id):
+    items = db.query(Item).filter(or_(
+        Item.owner_id == user_id,
+        Item.id.in_(select(item_participants.c.item_id).where(item_participants.c.user_id == user_id)),
+    )).order_by(Item.created_at.desc()).all()
+    result = []
+    for item in items:
+        data = ItemResponse.model_validate(item).model_dump(mode="json")
+        data["owner_email"] = item.owner.email if item.owner else None
+        result.append(data)
+    return result
+
+
+def orm_participants(db, item_id):
+    item = db.query(Item).filter(Item.id == item_id).first()
+    seen, result = set(), []
+    for participant in [item.owner] + item.participants:
+        if participant.id not in seen:
+            seen.add(participant.id)
+            result.append({"id": participant.id, "email": participant.email, "name": participant.name, "is_pending": False})
+    for invitation in db.query(PendingInvitation).filter(PendingInvitation.item_id == item_id).all():
+        result.append({"id": invitation.id, "email": invitation.email, "name": None, "is_pending": True})
+    return result
+
+
+def orm_capital_reads(db, user_id):
+    balances = db.execute(
+        select(UserBalance, Item.name, Item.item_type, Item.owner_id)
+        .join(Item, Item.id == UserBalance.item_id)
+        .where(UserBalance.user_id == user_id, Item.is_archived.is_(False))
+        .order_by(Item.created_at, Item.id, UserBalance.currency)
+    ).all()
+    incomes = db.query(UserIncome).filter(UserIncome.user_id == user_id).order_by(UserIncome.created_at.desc()).all()
+    return len(balances), [UserIncomeResponse.model_validate(i).model_dump(mode="json") for i in incomes]
+
+
+# ---- Camino actual: read_models ----
+
+def row_items(db, user_id):
+    return [item_dict(row) for row in user_items(db, user_id)]
+
+
+def row_participants(db, item_id):
+    return [{"id": p.id, "email": p.email, "name": p.name, "is_pending": p.is_pending}
+            for p in item_participant_rows(db, item_id)]
+
+
+def row_capital_reads(db, user_id):
+    balances = user_balance_rows(db, user_id)
+    incomes = user_incomes(db, user_id)
+    return len(balances), [UserIncomeResponse.model_validate(i).model_dump(mode="json") for i in incomes]
+
+
+def measure(db, fn):
+    """(pico en KiB, bloques vivos al terminar, resultado) de un pedido con la sesión vacía,
+    como al empezar un request. Una primera pasada sin medir llena el caché de SQL compilado."""
+    fn()
+    db.expunge_all()
+    tracemalloc.start()
+    try:
+        result = fn()
+        live = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024, live, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        user_id, item_ids = seed(db, args.items)
+        cases = [
+            ("GET /api/items", lambda: orm_items(db, user_id), lambda: row_items(db, user_id)),
+            (f"participantes x{len(item_ids)}",
+             lambda: [orm_participants(db, i) for i in item_ids],
+             lambda: [row_participants(db, i) for i in item_ids]),
+            ("capital (saldos + ingresos)", lambda: orm_capital_reads(db, user_id), lambda: row_capital_reads(db, user_id)),
+        ]
+        rows = []
+        for label, legacy, fast in cases:
+            legacy_peak, legacy_live, legacy_result = measure(db, legacy)
+            fast_peak, fast_live, fast_result = measure(db, fast)
+            assert legacy_result == fast_result, f"{label}: las salidas difieren"
+
+            def cold(fn):
+                db.expunge_all()
+                return fn()
+            legacy_ms, _ = timed(lambda: cold(legacy))
+            fast_ms, _ = timed(lambda: cold(fast))
+            rows.append((f"{label} ORM", f"{legacy_ms:8.1f} ms  pico {legacy_peak:7.0f} KiB  {legacy_live:7d} bloques vivos"))
+            rows.append((f"{label} read_models", f"{fast_ms:8.1f} ms  pico {fast_peak:7.0f} KiB  {fast_live:7d} bloques vivos"))
+
+        capital = get_user_capital(user_id, db)
+        assert len(capital["detail"]["items"]) == args.items
+        report(f"Lecturas de un usuario con {args.items} items", rows)
+
+
+if __name__ == "__main__":
+    main()
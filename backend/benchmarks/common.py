@@ -0,0 +1,57 @@
+"""Utilidades compartidas por los benchmarks.
+
+Importar este módulo antes que `database`/`main`: apunta DATABASE_URL a un SQLite
+temporal (o a BENCH_DATABASE_URL si se define, p. ej. un Postgres de pruebas) para
+no tocar la base real.
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from statistics import median
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if os.getenv("BENCH_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["BENCH_DATABASE_URL"]
+else:
+    _fd, _path = tempfile.mkstemp(suffix=".db", prefix="app_gastos_bench_")
+    os.close(_fd)
+    os.environ["DATABASE_URL"] = f"sqlite:///{_path}"
+os.environ.setdefault("SECRET_KEY", "bench-secret-key")
+
+from database import Base, SessionLocal, engine  # noqa: E402
+from models import User  # noqa: E402
+
+Base.metadata.drop_all(bind=engine)
+Base.metadata.create_all(bind=engine)
+
+
+def new_id() -> str:
+    return str(uuid.uuid4())
+
+
+def create_user(db, email: str) -> User:
+    user = User(email=email, hashed_password="x", name=email.split("@")[0], created_at=datetime.utcnow())
+    db.add(user)
+    db.flush()
+    return user
+
+
+def timed(fn, repeat: int = 5):
+    """Ejecuta `fn` `repeat` veces y devuelve (mediana en ms, último resultado)."""
+    samples, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return median(samples), result
+
+
+def report(title: str, rows):
+    print(f"\n{title}")
+    width = max(len(label) for label, _ in rows)
+    for label, value in rows:
+        print(f"  {label.ljust(width)}  {value}")
@@ -0,0 +1,621 @@
+"""Cálculo del capital personal: ingresos acumulados menos la parte de cada gasto
+que le corresponde al usuario, más las deudas pendientes en items compartidos.
+
+La parte de los gastos vive materializada en `user_balances` (un saldo por
+usuario/item/moneda). Los endpoints de escritura aplican deltas sobre ese saldo y
+`capital_rows_query` lo puede regenerar desde `expenses` con un GROUP BY, de modo
+que /api/capital no depende de cuántos gastos tenga el usuario."""
+import calendar
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, case, delete, func, insert, literal, or_, select, union, update
+from sqlalchemy.orm import Session
+
+from exchange_rates import backfill_expense_rates, current_rates_or_empty, pen_rate_sql
+from models import Expense, Item, PendingInvitation, User, UserBalance, item_participants
+from read_models import user_balance_rows, user_incomes
+
+
+def count_periodic_occurrences(start: date, day_of_month: int, until: date, end: date = None) -> int:
+    """Cuenta cuántas veces ocurrió `day_of_month` entre `start` y `until` (inclusive),
+    cortando en `end` si se dio (ingreso periódico cancelado). El mes en que se creó el
+    ingreso siempre cuenta completo, sin importar qué día de ese mes se haya registrado.
+
+    Forma cerrada: cuentan todos los meses desde el de `start` hasta el del corte, menos
+    el último si su día de pago (recortado al largo del mes) todavía no llegó."""
+    effective_until = min(until, end) if end else until
+    months = (effective_until.year - start.year) * 12 + (effective_until.month - start.month) + 1
+    if months <= 0:
+        return 0
+    last_day = calendar.monthrange(effective_until.year, effective_until.month)[1]
+    if min(day_of_month, last_day) > effective_until.day:
+        months -= 1
+    return months
+
+
+def periodic_contributions_batch(incomes: Iterable[Tuple[date, int, Optional[date], float]],
+                                 until: date) -> List[Tuple[int, float]]:
+    """(ocurrencias, monto aportado) de muchos ingresos periódicos (start, day_of_month,
+    end, amount) hasta `until`, de una sola pasada y con la misma regla que
+    `count_periodic_occurrences`. El largo de cada mes de corte se calcula una vez por mes
+    distinto: para los ingresos activos (sin `end`, o con `end` futuro) es siempre el mes
+    de `until`."""
+    until_index = until.year * 12 + until.month - 1
+    month_lengths = {until_index: calendar.monthrange(until.year, until.month)[1]}
+    contributions = []
+    for start, day_of_month, end, amount in incomes:
+        cutoff = end if end is not None and end < until else until
+        cutoff_index = cutoff.year * 12 + cutoff.month - 1
+        months = cutoff_index - (start.year * 12 + start.month - 1) + 1
+        if months <= 0:
+            contributions.append((0, 0.0))
+            continue
+        last_day = month_lengths.get(cutoff_index)
+        if last_day is None:
+            last_day = month_lengths[cutoff_index] = calendar.monthrange(cutoff.year, cutoff.month)[1]
+        if min(day_of_month, last_day) > cutoff.day:
+            months -= 1
+        contributions.append((months, amount * months))
+    return contributions
+
+
+def calculate_user_expense_share(expense: Expense, user_id: str, item: Item, participant_count: int) -> float:
+    """Cuánto de este gasto le corresponde realmente a `user_id`, sin importar quién pagó.
+    Mismo criterio que calculateTotalsByCurrency (frontend/src/pages/Expenses.jsx:609-635).
+    `expense_share_sql` es la traducción a SQL de esta misma regla: mantenerlas en sincronía."""
+    if item.item_type == "personal":
+        return expense.amount if item.owner_id == user_id else 0.0
+
+    if expense.split_type == "assigned":
+        return expense.amount if expense.assigned_to == user_id else 0.0
+    elif expense.split_type == "divided":
+        if participant_count <= 0:
+            return 0.0
+        return expense.amount / participant_count
+    elif expense.split_type == "selected":
+        selected_ids = expense.selected_participants.split(",") if expense.selected_participants else []
+        if user_id in selected_ids and len(selected_ids) > 0:
+            return expense.amount / len(selected_ids)
+        return 0.0
+    return 0.0
+
+
+# ============= SQL =============
+
+def item_members_subquery():
+    """(item_id, user_id) de cada miembro de un item: el owner más los participantes.
+    UNION (no UNION ALL) para no duplicar al owner si también figura como participante."""
+    return union(
+        select(Item.id.label("item_id"), Item.owner_id.label("user_id")),
+        select(item_participants.c.item_id.label("item_id"), item_participants.c.user_id.label("user_id")),
+    ).subquery("members")
+
+
+def participant_count_subquery():
+    """participant_count por item, igual que en el cálculo original:
+    1 (owner) + participantes registrados + invitaciones pendientes."""
+    registered = (
+        select(item_participants.c.item_id, func.count().label("n"))
+        .group_by(item_participants.c.item_id)
+        .subquery("registered")
+    )
+    pending = (
+        select(PendingInvitation.item_id, func.count().label("n"))
+        .group_by(PendingInvitation.item_id)
+        .subquery("pending")
+    )
+    return (
+        select(
+            Item.id.label("item_id"),
+            (1 + func.coalesce(registered.c.n, 0) + func.coalesce(pending.c.n, 0)).label("participant_count"),
+        )
+        .select_from(Item)
+        .outerjoin(registered, registered.c.item_id == Item.id)
+        .outerjoin(pending, pending.c.item_id == Item.id)
+        .subquery("participant_counts")
+    )
+
+
+def expense_share_sql(user_id_col, participant_count_col):
+    """Expresión SQL equivalente a `calculate_user_expense_share` para el usuario `user_id_col`."""
+    selected = Expense.selected_participants
+    padded_selected = literal(",") + selected + literal(",")
+    selected_count = func.length(selected) - func.length(func.replace(selected, ",", "")) + 1
+    is_selected = and_(
+        selected.isnot(None),
+        selected != "",
+        padded_selected.like(literal("%,") + user_id_col + literal(",%")),
+    )
+    return case(
+        (Item.item_type == "personal", case((Item.owner_id == user_id_col, Expense.amount), else_=0.0)),
+        (Expense.split_type == "assigned", case((Expense.assigned_to == user_id_col, Expense.amount), else_=0.0)),
+        (Expense.split_type == "divided", case(
+            (participant_count_col > 0, Expense.amount / participant_count_col), else_=0.0
+        )),
+        (Expense.split_type == "selected", case((is_selected, Expense.amount / selected_count), else_=0.0)),
+        else_=0.0,
+    )
+
+
+def capital_rows_query(user_id: Optional[str] = None, item_id: Optional[str] = None, include_archived: bool = False):
+    """SELECT agrupado por (usuario, item, moneda) con la parte del usuario, lo que le deben
+    y lo que debe en gastos sin saldar, y cuántos gastos le tocan. Filtrable por usuario y/o item.
+    Las columnas *_pen son esos mismos montos en soles al tipo de cambio de la fecha de cada
+    gasto; sin tipo guardado, al tipo actual (`pen_rate_sql`, igual que /totals)."""
+    members = item_members_subquery()
+    counts = participant_count_subquery()
+    rate = pen_rate_sql(Expense.currency, Expense.pen_rate, current_rates_or_empty())
+
+    share = expense_share_sql(members.c.user_id, counts.c.participant_count)
+    pending_debt = and_(
+        Item.item_type == "shared",
+        or_(Expense.is_settled.is_(None), Expense.is_settled.is_(False)),
+    )
+    owed_to_me = case(
+        (and_(pending_debt, Expense.paid_by == members.c.user_id, share < Expense.amount), Expense.amount - share),
+        else_=0.0,
+    )
+    i_owe = case(
+        (and_(pending_debt, Expense.paid_by != members.c.user_id, share > 0), share),
+        else_=0.0,
+    )
+
+    query = (
+        select(
+            members.c.user_id,
+            Item.id.label("item_id"),
+            Expense.currency,
+            func.sum(share).label("share"),
+            func.sum(owed_to_me).label("owed_to_me"),
+            func.sum(i_owe).label("i_owe"),
+            func.coalesce(func.sum(share * rate), 0.0).label("share_pen"),
+            func.coalesce(func.sum(owed_to_me * rate), 0.0).label("owed_to_me_pen"),
+            func.coalesce(func.sum(i_owe * rate), 0.0).label("i_owe_pen"),
+            func.sum(case((share != 0, 1), else_=0)).label("expense_count"),
+            func.sum(case((owed_to_me != 0, 1), else_=0)).label("owed_count"),
+            func.sum(case((i_owe != 0, 1), else_=0)).label("owe_count"),
+        )
+        .select_from(members)
+        .join(Item, Item.id == members.c.item_id)
+        .join(counts, counts.c.item_id == Item.id)
+        .join(Expense, Expense.item_id == Item.id)
+        .group_by(members.c.user_id, Item.id, Expense.currency)
+    )
+    if not include_archived:
+        query = query.where(Item.is_archived.is_(False))
+    if user_id is not None:
+        query = query.where(members.c.user_id == user_id)
+    if item_id is not None:
+        query = query.where(Item.id == item_id)
+    return query
+
+
+# ============= LEDGER (user_balances) =============
+
+LEDGER_FIELDS = (
+    "share", "owed_to_me", "i_owe", "share_pen", "owed_to_me_pen", "i_owe_pen",
+    "expense_count", "owed_count", "owe_count",
+)
+
+# Copia de los campos de un gasto que afectan el saldo, tomada antes de modificarlo
+# para poder restar su contribución anterior.
+ExpenseLedgerState = namedtuple(
+    "ExpenseLedgerState",
+    ["amount", "currency", "paid_by", "split_type", "assigned_to", "selected_participants", "is_settled", "pen_rate"],
+)
+
+
+def expense_ledger_state(expense: Expense) -> ExpenseLedgerState:
+    return ExpenseLedgerState(
+        expense.amount, expense.currency, expense.paid_by, expense.split_type,
+        expense.assigned_to, expense.selected_participants, expense.is_settled, expense.pen_rate,
+    )
+
+
+def item_member_ids(item: Item) -> List[str]:
+    """Owner primero, luego participantes, sin duplicados."""
+    member_ids = [item.owner_id]
+    for participant in item.participants:
+        if participant.id not in member_ids:
+            member_ids.append(participant.id)
+    return member_ids
+
+
+def item_participant_count(item: Item, db: Session) -> int:
+    pending_count = db.query(PendingInvitation).filter(PendingInvitation.item_id == item.id).count()
+    return 1 + len({p.id for p in item.participants}) + pending_count
+
+
+def expense_ledger_deltas(expense, item: Item, member_ids: Iterable[str], participant_count: int,
+                          sign: int = 1, deltas: Optional[Dict] = None) -> Dict:
+    """Acumula en `deltas[(user_id, currency)]` la contribución de un gasto al saldo de cada
+    miembro del item (mismas reglas que `capital_rows_query`). `sign=-1` la resta."""
+    deltas = {} if deltas is None else deltas
+    current_rates = current_rates_or_empty()
+    for user_id in member_ids:
+        share = calculate_user_expense_share(expense, user_id, item, participant_count)
+        owed_to_me = i_owe = 0.0
+        if item.item_type == "shared" and not expense.is_settled:
+            if expense.paid_by == user_id and share < expense.amount:
+                owed_to_me = expense.amount - share
+            elif expense.paid_by != user_id and share > 0:
+                i_owe = share
+        if not (share or owed_to_me or i_owe):
+            continue
+        # Sin tipo guardado, el actual; sin ninguno conocido el gasto no aporta a los montos
+        # en soles (igual que el NULL en el SUM de capital_rows_query)
+        rate = expense.pen_rate
+        if rate is None:
+            rate = 1.0 if expense.currency == "soles" else current_rates.get(expense.currency, 0.0)
+        row = deltas.setdefault((user_id, expense.currency), [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0])
+        row[0] += sign * share
+        row[1] += sign * owed_to_me
+        row[2] += sign * i_owe
+        row[3] += sign * share * rate
+        row[4] += sign * owed_to_me * rate
+        row[5] += sign * i_owe * rate
+        row[6] += sign * (1 if share else 0)
+        row[7] += sign * (1 if owed_to_me else 0)
+        row[8] += sign * (1 if i_owe else 0)
+    return deltas
+
+
+def apply_ledger_deltas(db: Session, item_id: str, deltas: Dict):
+    """Suma los deltas con UPDATE ... SET x = x + :delta (atómico frente a escrituras
+    concurrentes en el mismo item); inserta la fila si todavía no existía."""
+    for (user_id, currency), values in deltas.items():
+        if not any(values):
+            continue
+        increments = {field: getattr(UserBalance, field) + value for field, value in zip(LEDGER_FIELDS, values)}
+        result = db.execute(
+            update(UserBalance)
+            .where(
+                UserBalance.user_id == user_id,
+                UserBalance.item_id == item_id,
+                UserBalance.currency == currency,
+            )
+            .values(**increments, updated_at=datetime.utcnow())
+        )
+        if result.rowcount == 0:
+            db.execute(insert(UserBalance).values(
+                user_id=user_id, item_id=item_id, currency=currency,
+                updated_at=datetime.utcnow(),
+                **dict(zip(LEDGER_FIELDS, values)),
+            ))
+
+
+def update_ledger_for_expense(db: Session, item: Item, before: Optional[ExpenseLedgerState] = None,
+                              after: Optional[Expense] = None):
+    """Resta la contribución anterior del gasto (`before`) y suma la nueva (`after`).
+    Crear: solo `after`; borrar: solo `before`; editar/saldar: ambos."""
+    member_ids = item_member_ids(item)
+    participant_count = item_participant_count(item, db)
+    deltas: Dict = {}
+    if before is not None:
+        expense_ledger_deltas(before, item, member_ids, participant_count, sign=-1, deltas=deltas)
+    if after is not None:
+        expense_ledger_deltas(after, item, member_ids, participant_count, sign=1, deltas=deltas)
+    apply_ledger_deltas(db, item.id, deltas)
+
+
+def rebuild_item_ledger(db: Session, item_id: str):
+    """Regenera los saldos de un item completo. Se usa cuando cambia algo que afecta a
+    todos sus gastos a la vez: participantes, invitaciones pendientes o tipo de item."""
+    db.flush()
+    db.execute(delete(UserBalance).where(UserBalance.item_id == item_id))
+    _insert_ledger_rows(db, capital_rows_query(item_id=item_id, include_archived=True))
+
+
+def rebuild_ledger(db: Session) -> int:
+    """Regenera `user_balances` completo desde `expenses`. Devuelve las filas escritas."""
+    db.flush()
+    db.execute(delete(UserBalance))
+    _insert_ledger_rows(db, capital_rows_query(include_archived=True))
+    return db.query(UserBalance).count()
+
+
+def reprice_unrated_expenses(db: Session) -> Set[str]:
+    """Completa `pen_rate` de los gastos creados cuando su moneda no tenía tipo conocido y
+    regenera los saldos solo de los items donde alguno cambió. Devuelve los miembros de esos
+    items (para invalidar su capital después del commit); no hace commit."""
+    def unrated_by_item() -> Dict[str, int]:
+        return dict(db.execute(
+            select(Expense.item_id, func.count()).where(Expense.pen_rate.is_(None)).group_by(Expense.item_id)
+        ).all())
+
+    before = unrated_by_item()
+    if not before or not backfill_expense_rates(db):
+        return set()
+    after = unrated_by_item()
+    changed = [item_id for item_id, count in before.items() if after.get(item_id, 0) != count]
+    for item_id in changed:
+        rebuild_item_ledger(db, item_id)
+    members = item_members_subquery()
+    return set(db.scalars(select(members.c.user_id).where(members.c.item_id.in_(changed))))
+
+
+def _insert_ledger_rows(db: Session, rows_query):
+    rows = rows_query.subquery()
+    db.execute(insert(UserBalance).from_select(
+        ["user_id", "item_id", "currency", *LEDGER_FIELDS, "updated_at"],
+        select(
+            rows.c.user_id, rows.c.item_id, rows.c.currency,
+            *[rows.c[field] for field in LEDGER_FIELDS],
+            literal(datetime.utcnow()),
+        ),
+    ))
+
+
+def delete_item_ledger(db: Session, item_id: str):
+    db.execute(delete(UserBalance).where(UserBalance.item_id == item_id))
+
+
+# ============= CAPITAL =============
+
+def _add(bucket: Dict[str, float], currency: str, amount: float):
+    bucket[currency] = bucket.get(currency, 0.0) + amount
+
+
+def income_contributions(user_id: str, db: Session, today: date):
+    """(by_currency, income_details) aportados por los ingresos del usuario hasta `today`."""
+    by_currency: Dict[str, float] = {}
+    income_details: List[Dict] = []
+    incomes = user_incomes(db, user_id)
+
+    periodic = [i for i in incomes if i.income_type == "periodic" and i.day_of_month]
+    contributions_by_id = dict(zip(
+        (i.id for i in periodic),
+        periodic_contributions_batch(
+            ((i.date.date(), i.day_of_month, i.end_date.date() if i.end_date else None, i.amount) for i in periodic),
+            today,
+        ),
+    ))
+
+    for income in incomes:
+        by_currency.setdefault(income.currency, 0.0)
+        occurrences, contributed = contributions_by_id.get(income.id, (1, income.amount))
+        by_currency[income.currency] += contributed
+        income_details.append({
+            "id": income.id,
+            "description": income.description,
+            "income_type": income.income_type,
+            "currency": income.currency,
+            "base_amount": round(income.amount, 2),
+            "occurrences": occurrences,
+            "contributed_amount": round(contributed, 2),
+        })
+    return by_currency, income_details
+
+
+def get_user_capital(user_id: str, db: Session) -> Dict:
+    today = datetime.utcnow().date()
+    by_currency, income_details = income_contributions(user_id, db, today)
+    owed_to_me: Dict[str, float] = {}
+    i_owe: Dict[str, float] = {}
+    item_details: List[Dict] = []
+
+    # Los items archivados quedan fuera del presupuesto vigente: sus gastos ya
+    # fueron absorbidos por el capital inicial registrado como ingreso puntual.
+    balances = user_balance_rows(db, user_id)
+
+    # Totales en soles al tipo histórico de cada gasto (para `convert`); los ingresos no
+    # tienen tipo histórico y se convierten al del día.
+    pen = {"incomes": dict(by_currency), "share": 0.0, "owed_to_me": 0.0, "i_owe": 0.0}
+    details_by_item: Dict[str, Dict] = {}
+    for balance in balances:
+        currency = balance.currency
+        pen["share"] += balance.share_pen or 0.0
+        pen["owed_to_me"] += balance.owed_to_me_pen or 0.0
+        pen["i_owe"] += balance.i_owe_pen or 0.0
+        if balance.expense_count:
+            _add(by_currency, currency, -balance.share)
+            detail = details_by_item.get(balance.item_id)
+            if detail is None:
+                detail = details_by_item[balance.item_id] = {
+                    "item_id": balance.item_id,
+                    "item_name": balance.item_name,
+                    "item_type": balance.item_type,
+                    "role": "owner" if balance.owner_id == user_id else "participant",
+                    "expense_count": 0,
+                    "amounts": {},
+                }
+                item_details.append(detail)
+            detail["expense_count"] += balance.expense_count
+            detail["amounts"][currency] = round(balance.share, 2)
+        if balance.owed_count:
+            _add(owed_to_me, currency, balance.owed_to_me)
+        if balance.owe_count:
+            _add(i_owe, currency, balance.i_owe)
+
+    return {
+        "by_currency": {c: round(a, 2) for c, a in by_currency.items()},
+        "owed_to_me": {c: round(a, 2) for c, a in owed_to_me.items()},
+        "i_owe": {c: round(a, 2) for c, a in i_owe.items()},
+        "detail": {
+            "incomes": income_details,
+            "items": item_details,
+        },
+        "pen": pen,
+    }
+
+
+# ============= SERIE TEMPORAL =============
+
+def _month_index(value: date) -> int:
+    return value.year * 12 + value.month - 1
+
+
+def _month_end(month_index: int) -> date:
+    year, month = divmod(month_index, 12)
+    return date(year, month + 1, calendar.monthrange(year, month + 1)[1])
+
+
+def user_monthly_shares_query(user_id: str, until: date):
+    """Parte del usuario por (año, mes, moneda) de los gastos hasta `until` inclusive,
+    con las mismas reglas que el capital (items archivados fuera)."""
+    members = item_members_subquery()
+    counts = participant_count_subquery()
+    share = expense_share_sql(members.c.user_id, counts.c.participant_count)
+    spent_at = func.coalesce(Expense.date, Expense.created_at)
+    year = func.extract("year", spent_at)
+    month = func.extract("month", spent_at)
+    return (
+        select(year.label("year"), month.label("month"), Expense.currency, func.sum(share).label("share"))
+        .select_from(members)
+        .join(Item, Item.id == members.c.item_id)
+        .join(counts, counts.c.item_id == Item.id)
+        .join(Expense, Expense.item_id == Item.id)
+        .where(
+            members.c.user_id == user_id,
+            Item.is_archived.is_(False),
+            spent_at < datetime.combine(until + timedelta(days=1), datetime.min.time()),
+        )
+        .group_by(year, month, Expense.currency)
+    )
+
+
+def capital_series(user_id: str, db: Session, start: date, end: date) -> List[Dict]:
+    """Capital por moneda al cierre de cada mes entre `start` y `end` (el último punto es
+    `end` mismo). Se arma en una pasada: los gastos llegan ya agrupados por mes desde SQL y
+    cada ingreso aporta un rango contiguo de meses, marcado en un arreglo de diferencias;
+    dos sumas prefijas dan el saldo acumulado de cada punto."""
+    first = _month_index(start)
+    months = _month_index(end) - first + 1
+    points = [_month_end(first + k) for k in range(months)]
+    points[-1] = end
+
+    # increments[currency][k]: lo que cambia el saldo en el punto k (k=0 incluye todo lo anterior)
+    increments: Dict[str, List[float]] = {}
+    diffs: Dict[str, List[float]] = {}
+
+    def bucket(table, currency):
+        if currency not in table:
+            table[currency] = [0.0] * (months + 1)
+        return table[currency]
+
+    for row in db.execute(user_monthly_shares_query(user_id, end)):
+        k = max(0, int(row.year) * 12 + int(row.month) - 1 - first)
+        bucket(increments, row.currency)[k] -= row.share
+
+    for income in user_incomes(db, user_id):
+        income_start = income.date.date()
+        if not (income.income_type == "periodic" and income.day_of_month):
+            if income_start <= end:
+                bucket(increments, income.currency)[max(0, _month_index(income_start) - first)] += income.amount
+            continue
+
+        income_end = income.end_date.date() if income.end_date else None
+        day = income.day_of_month
+        bucket(increments, income.currency)[0] += income.amount * count_periodic_occurrences(
+            income_start, day, points[0], income_end
+        )
+        # Meses 1..months-1 en los que cae una ocurrencia: desde el mes de inicio hasta el
+        # último pago no posterior a `end_date` ni al punto final.
+        last = months - 1
+        for cutoff in (income_end, points[-1]):
+            if cutoff is None:
+                continue
+            cutoff_k = _month_index(cutoff) - first
+            cutoff_day = min(day, calendar.monthrange(cutoff.year, cutoff.month)[1])
+            last = min(last, cutoff_k if cutoff_day <= cutoff.day else cutoff_k - 1)
+        begin = max(1, _month_index(income_start) - first)
+        if begin <= last:
+            diff = bucket(diffs, income.currency)
+            diff[begin] += income.amount
+            diff[last + 1] -= income.amount
+
+    for currency, diff in diffs.items():
+        running = 0.0
+        target = bucket(increments, currency)
+        for k in range(months):
+            running += diff[k]
+            target[k] += running
+
+    series = []
+    totals = {currency: 0.0 for currency in increments}
+    for k, point in enumerate(points):
+        for currency, values in increments.items():
+            totals[currency] += values[k]
+        series.append({"date": point, "by_currency": {c: round(a, 2) for c, a in totals.items()}})
+    return series
+
+
+def capital_at(user_id: str, db: Session, at: date) -> Dict[str, float]:
+    """Capital por moneda al final del día `at`."""
+    return capital_series(user_id, db, at, at)[-1]["by_currency"]
+
+
+# ============= CACHE =============
+
+class CapitalCache:
+    """LRU en memoria de `get_user_capital`, por (usuario, versión de sus datos, día).
+
+    La versión vive en `users.capital_version`, así que vale para todos los workers: los
+    endpoints que modifican gastos, ingresos, participantes o el archivado de un item llaman
+    a `bump` con los usuarios afectados *antes* del commit, dentro de su transacción, y cada
+    lectura consulta esa columna por clave primaria. La versión nueva deja inalcanzables las
+    entradas viejas de todos los procesos, que terminan saliendo por LRU. El día forma parte
+    de la clave porque los ingresos periódicos suman ocurrencias con el paso del tiempo."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bump(self, db: Session, user_ids: Iterable[str]):
+        """Incrementa la versión de los usuarios; se confirma con la transacción de `db`."""
+        ids = sorted(set(user_ids))
+        if ids:
+            db.execute(
+                update(User).where(User.id.in_(ids)).values(capital_version=User.capital_version + 1)
+                .execution_options(synchronize_session=False)
+            )
+
+    def get(self, user_id: str, db: Session) -> Dict:
+        today = datetime.utcnow().date()
+        version = db.scalar(select(User.capital_version).where(User.id == user_id)) or 0
+        with self._lock:
+            key = (user_id, version, today)
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        capital = get_user_capital(user_id, db)
+
+        with self._lock:
+            self._entries[key] = capital
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return capital
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+capital_cache = CapitalCache(max_entries=int(os.getenv("CAPITAL_CACHE_SIZE", "1024")))
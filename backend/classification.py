@@ -0,0 +1,353 @@
+"""
+Clasificación de gastos por reglas (palabras clave de cada categoría).
+
+Las palabras clave se compilan una vez en un autómata Aho-Corasick que recorre la
+descripción en una sola pasada, sin importar cuántas categorías y palabras haya. La
+semántica es la de siempre: gana la primera categoría (por `position`) que tenga
+alguna palabra contenida en la descripción.
+
+Las categorías (nombres, categoría por defecto y el autómata) se guardan en memoria
+en `category_registry` y se recargan solo cuando cambian: los endpoints de categorías
+incrementan una fila de versión en la base que todos los workers comparan.
+"""
+
+import os
+import threading
+import time
+import unicodedata
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, select, update
+from sqlalchemy.orm import Session
+
+from capital import item_members_subquery
+from local_classifier import LOCAL_MODEL, local_classifier
+from models import CacheVersion, Category, Expense
+from summaries import ExpenseSummaryState, add_summary_delta, apply_summary_deltas
+
+DEFAULT_CATEGORY = "otros"
+RULES_MODEL = "rules-v1"
+RULES_CONFIDENCE = 0.35
+
+Classification = namedtuple("Classification", ["category", "confidence", "model"])
+
+
+def normalize_description(text: Optional[str]) -> str:
+    """Forma canónica para comparar descripciones: sin tildes ni diacríticos, en
+    minúsculas y con los espacios colapsados ("  Clínica  SAN Pablo" -> "clinica san pablo").
+    Se guarda en `expenses.description_normalized` al escribir el gasto."""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(folded.lower().split())
+
+
+def split_keywords(keywords: Optional[str]) -> List[str]:
+    """Palabras clave de una categoría (guardadas separadas por coma), sin vacías."""
+    if not keywords:
+        return []
+    return [k.strip() for k in keywords.split(",") if k.strip()]
+
+
+class KeywordMatcher:
+    """Autómata Aho-Corasick sobre las palabras clave de todas las categorías.
+
+    Las palabras clave se normalizan igual que las descripciones (`normalize_description`),
+    así "alimentación" en una descripción coincide con la palabra "alimentacion".
+
+    Se construye como DFA completo (cada estado tiene su transición por cada carácter
+    del alfabeto de las palabras), así la búsqueda es un `dict.get` por carácter. Cada
+    estado guarda el índice de la mejor categoría (la de menor posición) entre las
+    palabras que terminan en él, incluidas las que llegan por enlaces de fallo."""
+
+    def __init__(self, categories: Sequence[Tuple[str, Iterable[str]]], default: str = DEFAULT_CATEGORY):
+        self.default = default
+        self.names = [name for name, _ in categories]
+        self._goto: List[Dict[str, int]] = [{}]
+        self._best: List[Optional[int]] = [None]
+
+        for index, (_, keywords) in enumerate(categories):
+            for keyword in keywords:
+                keyword = normalize_description(keyword)
+                if keyword:
+                    self._add(keyword, index)
+        self._compile()
+
+    def _add(self, keyword: str, index: int):
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._best.append(None)
+                self._goto[state][ch] = nxt
+            state = nxt
+        if self._best[state] is None or index < self._best[state]:
+            self._best[state] = index
+
+    def _compile(self):
+        """BFS: enlaces de fallo, herencia de la mejor categoría y transiciones del DFA."""
+        fail = [0] * len(self._goto)
+        trie = [dict(edges) for edges in self._goto]
+        queue = list(trie[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            inherited = self._best[fail[state]]
+            if inherited is not None and (self._best[state] is None or inherited < self._best[state]):
+                self._best[state] = inherited
+            for ch, nxt in trie[state].items():
+                fallback = fail[state]
+                while fallback and ch not in trie[fallback]:
+                    fallback = fail[fallback]
+                target = trie[fallback].get(ch, 0)
+                fail[nxt] = target if target != nxt else 0
+                queue.append(nxt)
+            # Transiciones del DFA: las propias del trie más las del estado de fallo
+            # (ya completas, porque está más cerca de la raíz y se procesó antes).
+            if state:
+                self._goto[state] = {**self._goto[fail[state]], **trie[state]}
+
+    def match_index(self, text: str) -> Optional[int]:
+        """Índice de la primera categoría (por posición) con alguna palabra en `text`."""
+        goto, best_by_state = self._goto, self._best
+        state, best = 0, None
+        for ch in text:
+            state = goto[state].get(ch, 0)
+            found = best_by_state[state]
+            if found is not None and (best is None or found < best):
+                if found == 0:
+                    return 0
+                best = found
+        return best
+
+    def classify(self, description: Optional[str]) -> str:
+        return self.classify_normalized(normalize_description(description))
+
+    def classify_normalized(self, text_value: str) -> str:
+        """Como `classify`, para una descripción ya normalizada (la columna guardada)."""
+        if not text_value:
+            return self.default
+        index = self.match_index(text_value)
+        return self.names[index] if index is not None else self.default
+
+    def classify_batch(self, normalized: Iterable[str]) -> List[str]:
+        classify = self.classify_normalized
+        return [classify(text_value) for text_value in normalized]
+
+
+class CategorySnapshot:
+    """Foto inmutable de la tabla de categorías: nombres en orden de `position`, el
+    conjunto para validar, la categoría por defecto y el autómata de palabras clave
+    (compilado la primera vez que se pide)."""
+
+    __slots__ = ("version", "names", "name_set", "default", "_keywords", "_matcher", "_lock")
+
+    def __init__(self, version: int, categories: Sequence[Tuple[str, Optional[str], bool]]):
+        self.version = version
+        self.names: Tuple[str, ...] = tuple(name for name, _, _ in categories)
+        self.name_set = frozenset(self.names)
+        self.default = next((name for name, _, is_default in categories if is_default), DEFAULT_CATEGORY)
+        self._keywords = tuple((name, tuple(split_keywords(keywords))) for name, keywords, _ in categories)
+        self._matcher: Optional[KeywordMatcher] = None
+        self._lock = threading.Lock()
+
+    @property
+    def matcher(self) -> KeywordMatcher:
+        if self._matcher is None:
+            with self._lock:
+                if self._matcher is None:
+                    self._matcher = KeywordMatcher(self._keywords, default=DEFAULT_CATEGORY)
+        return self._matcher
+
+    def validate(self, category: Optional[str]) -> str:
+        normalized = (category or "").strip().lower()
+        return normalized if normalized in self.name_set else DEFAULT_CATEGORY
+
+
+class CategoryRegistry:
+    """Copia de las categorías compartida por el proceso.
+
+    Los endpoints de categorías llaman a `bump` dentro de su transacción (incrementa la
+    fila "categories" de `cache_versions`) e `invalidate` tras el commit. Los demás
+    workers se enteran comparando esa fila con la versión de su copia, como mucho una
+    vez cada `check_interval` segundos para no sumar una consulta por llamada."""
+
+    VERSION_KEY = "categories"
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot: Optional[CategorySnapshot] = None
+        self._checked_at = 0.0
+        self.loads = 0
+        self.version_checks = 0
+
+    def _db_version(self, db: Session) -> int:
+        self.version_checks += 1
+        version = db.query(CacheVersion.version).filter(CacheVersion.name == self.VERSION_KEY).scalar()
+        return version or 0
+
+    def get(self, db: Session) -> CategorySnapshot:
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            return snapshot
+        with self._lock:
+            version = self._db_version(db)
+            if self._snapshot is None or self._snapshot.version != version:
+                categories = db.query(
+                    Category.name, Category.keywords, Category.is_default
+                ).order_by(Category.position).all()
+                self._snapshot = CategorySnapshot(version, categories)
+                self.loads += 1
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def bump(self, db: Session):
+        """Marca las categorías como modificadas; se confirma con la transacción de `db`."""
+        updated = db.query(CacheVersion).filter(CacheVersion.name == self.VERSION_KEY).update(
+            {"version": CacheVersion.version + 1, "updated_at": datetime.utcnow()},
+            synchronize_session=False,
+        )
+        if not updated:
+            db.add(CacheVersion(name=self.VERSION_KEY, version=1))
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else None,
+            "categories": len(snapshot.names) if snapshot else 0,
+            "loads": self.loads,
+            "version_checks": self.version_checks,
+        }
+
+
+category_registry = CategoryRegistry(check_interval=float(os.getenv("CATEGORY_VERSION_CHECK_SECONDS", "1")))
+
+
+def get_category_names(db: Session) -> List[str]:
+    return list(category_registry.get(db).names)
+
+
+def validate_category(category: Optional[str], db: Session) -> str:
+    return category_registry.get(db).validate(category)
+
+
+def classify_expense_with_rules(description: str, db: Session) -> str:
+    return category_registry.get(db).matcher.classify(description)
+
+
+def classify_normalized_batch(texts: Sequence[str], db: Session) -> List[Classification]:
+    """Clasificación automática de un lote de descripciones normalizadas: el modelo local
+    (si hay artefacto entrenado) y, para lo que no acepta (poca confianza, fuera del
+    presupuesto de tiempo, categoría borrada), las reglas."""
+    snapshot = category_registry.get(db)
+    predictions = local_classifier.predict_batch(texts, allowed=snapshot.name_set)
+    matcher = snapshot.matcher
+    return [
+        Classification(prediction[0], round(prediction[1], 4), LOCAL_MODEL) if prediction is not None
+        else Classification(matcher.classify_normalized(text_value), RULES_CONFIDENCE, RULES_MODEL)
+        for text_value, prediction in zip(texts, predictions)
+    ]
+
+
+# ============= RECLASIFICACIÓN MASIVA =============
+
+AUTOMATIC_MODELS = (RULES_MODEL, LOCAL_MODEL)
+
+
+def reclassify_rules_expenses(db: Session, item_id: Optional[str] = None, user_id: Optional[str] = None,
+                              chunk_size: int = 1000, progress=None) -> Dict:
+    """Vuelve a clasificar los gastos clasificados automáticamente (reglas o modelo local,
+    ver `classify_normalized_batch`): de un item, de los items de un usuario o de toda la base.
+
+    Lee los gastos en streaming (`yield_per`) de a `chunk_size`, los clasifica por lote y
+    escribe solo los que cambian con un UPDATE ... CASE por lote. Los manuales y los de IA
+    no se tocan. `progress(stats)` se llama tras cada lote. No hace commit."""
+    query = select(
+        Expense.id, Expense.description, Expense.description_normalized,
+        Expense.ai_category, Expense.ai_confidence, Expense.ai_model,
+        Expense.item_id, Expense.currency, Expense.amount,
+    ).where(Expense.ai_model.in_(AUTOMATIC_MODELS))
+    if item_id is not None:
+        query = query.where(Expense.item_id == item_id)
+    if user_id is not None:
+        members = item_members_subquery()
+        query = query.where(Expense.item_id.in_(select(members.c.item_id).where(members.c.user_id == user_id)))
+
+    stats = {"scanned": 0, "updated": 0, "chunks": 0, "elapsed_ms": 0.0, "rows_per_second": 0.0}
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    result = db.execute(query.execution_options(yield_per=chunk_size))
+    for chunk in result.partitions():
+        results = classify_normalized_batch([
+            normalized if normalized is not None else normalize_description(description)
+            for _, description, normalized, *_ in chunk
+        ], db)
+        changed = {
+            row[0]: result
+            for row, result in zip(chunk, results)
+            if tuple(row[3:6]) != tuple(result)
+        }
+        if changed:
+            ids = list(changed)
+            db.execute(
+                update(Expense)
+                .where(Expense.id.in_(ids))
+                .values(
+                    ai_category=case({i: changed[i].category for i in ids}, value=Expense.id),
+                    ai_confidence=case({i: changed[i].confidence for i in ids}, value=Expense.id),
+                    ai_model=case({i: changed[i].model for i in ids}, value=Expense.id),
+                    ai_classified_at=now,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            deltas: Dict = {}
+            for row in chunk:
+                if row[0] in changed:
+                    currency, amount = row[7] or "soles", float(row[8] or 0.0)
+                    add_summary_delta(deltas, row[6], ExpenseSummaryState(currency, row[3] or "", amount), sign=-1)
+                    add_summary_delta(deltas, row[6], ExpenseSummaryState(currency, changed[row[0]].category, amount))
+            apply_summary_deltas(db, deltas)
+        stats["scanned"] += len(chunk)
+        stats["updated"] += len(changed)
+        stats["chunks"] += 1
+        elapsed = time.perf_counter() - started
+        stats["elapsed_ms"] = round(elapsed * 1000, 1)
+        stats["rows_per_second"] = round(stats["scanned"] / elapsed, 1) if elapsed else 0.0
+        if progress is not None:
+            progress(stats)
+    return stats
+
+
+def backfill_normalized_descriptions(db: Session, chunk_size: int = 1000) -> int:
+    """Completa `description_normalized` de los gastos que no la tienen, por lotes (la
+    normalización es Python, no SQL). Devuelve cuántos gastos se completaron; no hace commit."""
+    query = (
+        select(Expense.id, Expense.description)
+        .where(Expense.description_normalized.is_(None))
+        .limit(chunk_size)
+    )
+    total = 0
+    # Cada UPDATE saca sus filas de la condición, así que basta repetir el SELECT
+    while True:
+        chunk = {expense_id: normalize_description(description) for expense_id, description in db.execute(query)}
+        if not chunk:
+            return total
+        db.execute(
+            update(Expense)
+            .where(Expense.id.in_(list(chunk)))
+            .values(description_normalized=case(chunk, value=Expense.id), updated_at=Expense.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        total += len(chunk)
@@ -0,0 +1,47 @@
+"""
+Clasifica con el LLM (endpoint compatible con OpenAI) los gastos que todavía no
+tienen clasificación manual ni del LLM.
+
+Las descripciones repetidas se envían una sola vez: se deduplican, se reutiliza lo
+que el LLM ya clasificó en la base y se mandan varias por llamada, con llamadas
+concurrentes limitadas (LLM_CONCURRENCY) y reintentos con backoff. Requiere
+OPENAI_API_KEY (y opcionalmente OPENAI_BASE_URL / OPENAI_MODEL). A diferencia de la API,
+por defecto no corta por tiempo (LLM_MAX_SECONDS); --max-seconds pone un tope.
+
+Uso: python classify_expenses_llm.py [--item ITEM_ID] [--limit N] [--max-seconds S]
+"""
+
+import argparse
+
+from database import SessionLocal, Base, engine
+from classification import category_registry
+from llm_classifier import llm_classifier, classify_expenses_with_llm
+
+def classify(item_id=None, limit=None, max_seconds=None):
+    if not llm_classifier.enabled:
+        print("❌ Falta OPENAI_API_KEY.")
+        return None
+    llm_classifier.max_seconds = max_seconds or float("inf")
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        try:
+            print(f"Clasificando gastos con {llm_classifier.model}...")
+            stats = classify_expenses_with_llm(db, category_registry.get(db).names, item_id=item_id, limit=limit)
+            db.commit()
+            llm = llm_classifier.stats()
+            print(f"✅ {stats['updated']} de {stats['expenses']} gastos clasificados "
+                  f"({stats['unique_descriptions']} descripciones distintas, {llm['sent']} enviadas al LLM "
+                  f"en {llm['requests']} llamadas, {llm['retries']} reintentos) en {stats['elapsed_ms']:.0f} ms.")
+            return stats
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Error clasificando con el LLM: {e}")
+            raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--item", help="solo los gastos de este item")
+    parser.add_argument("--limit", type=int, help="máximo de gastos a procesar")
+    parser.add_argument("--max-seconds", type=float, help="tiempo máximo para las llamadas al LLM")
+    args = parser.parse_args()
+    classify(args.item, args.limit, args.max_seconds)
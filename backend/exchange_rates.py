@@ -0,0 +1,401 @@
+"""Tipo de cambio a soles (PEN).
+
+Los handlers solo leen: primero la copia en memoria del proceso y, si no hay, la última
+fila de `exchange_rates`. Nunca salen a la red. Un hilo de fondo
+(`ExchangeRateRefresher`) es el único que consulta al proveedor y guarda el resultado
+en la base, así que todos los workers comparten los tipos del día y sobreviven reinicios.
+
+Cuando el tipo en memoria es de un día anterior se sirve igual (stale-while-revalidate)
+y se despierta al refresher; las consultas al proveedor son single-flight, así que por
+cada vencimiento sale una sola llamada, por una conexión HTTP reutilizada.
+
+Proveedores (EXCHANGE_RATE_PROVIDER):
+- "http" (por defecto): open.er-api.com, gratis y sin API key.
+- "file": un JSON local (EXCHANGE_RATES_FILE) para entornos sin red o fixtures, con
+  `{"dolares": 3.75, "reales": 0.68}` o `{"2026-08-01": {"dolares": ..., "reales": ...}, ...}`.
+"""
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from fastapi import HTTPException
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import ExchangeRate, Expense
+
+CONVERTIBLE_CURRENCIES = ("dolares", "reales")
+
+
+# ============= PROVEEDORES =============
+
+class RateProvider:
+    """Devuelve tipos de cambio a PEN por fecha: {date: {"dolares": x, "reales": y}}."""
+    name = "base"
+
+    def fetch(self) -> Dict[date, Dict[str, float]]:
+        raise NotImplementedError
+
+
+class HttpRateProvider(RateProvider):
+    """Reutiliza una `requests.Session` con pool de conexiones: las consultas sucesivas
+    aprovechan la conexión TCP/TLS abierta (keep-alive) en vez de abrir una nueva."""
+    name = "open.er-api.com"
+
+    def __init__(self, url: str = "https://open.er-api.com/v6/latest/USD", timeout: float = 5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def fetch(self) -> Dict[date, Dict[str, float]]:
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        usd_to_pen = data["rates"]["PEN"]
+        usd_to_brl = data["rates"]["BRL"]
+        return {date.today(): {
+            "dolares": usd_to_pen,
+            "reales": usd_to_pen / usd_to_brl,
+        }}
+
+
+class FileRateProvider(RateProvider):
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fetch(self) -> Dict[date, Dict[str, float]]:
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        if all(currency in data for currency in CONVERTIBLE_CURRENCIES):
+            return {date.today(): {c: float(data[c]) for c in CONVERTIBLE_CURRENCIES}}
+        return {
+            date.fromisoformat(day): {c: float(rates[c]) for c in CONVERTIBLE_CURRENCIES}
+            for day, rates in data.items()
+        }
+
+
+def provider_from_env() -> RateProvider:
+    kind = os.getenv("EXCHANGE_RATE_PROVIDER", "http").lower()
+    if kind == "file":
+        return FileRateProvider(os.getenv("EXCHANGE_RATES_FILE", "exchange_rates.json"))
+    return HttpRateProvider()
+
+
+# ============= ALMACÉN =============
+
+class RateStore:
+    """Copia en memoria de los últimos tipos de cambio conocidos, respaldada por la tabla."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._as_of: Optional[date] = None
+        self._rates: Optional[Dict[str, float]] = None
+
+    def current(self) -> Tuple[Optional[date], Optional[Dict[str, float]]]:
+        with self._lock:
+            return self._as_of, self._rates
+
+    def remember(self, as_of: date, rates: Dict[str, float]):
+        with self._lock:
+            if self._as_of is None or as_of >= self._as_of:
+                self._as_of, self._rates = as_of, dict(rates)
+
+    def clear(self):
+        with self._lock:
+            self._as_of, self._rates = None, None
+
+    def load_latest(self, db: Session) -> bool:
+        """Carga en memoria la fecha más reciente guardada. False si la tabla está vacía."""
+        latest = db.query(func.max(ExchangeRate.rate_date)).scalar()
+        if latest is None:
+            return False
+        rows = db.query(ExchangeRate).filter(ExchangeRate.rate_date == latest).all()
+        rates = {row.currency: row.rate_to_pen for row in rows}
+        if not all(c in rates for c in CONVERTIBLE_CURRENCIES):
+            return False
+        self.remember(latest, rates)
+        return True
+
+    def save(self, db: Session, rates_by_date: Dict[date, Dict[str, float]], source: str):
+        """Inserta o actualiza los tipos de cada fecha y refresca la copia en memoria."""
+        now = datetime.utcnow()
+        for day, rates in rates_by_date.items():
+            for currency, rate in rates.items():
+                row = db.query(ExchangeRate).filter(
+                    ExchangeRate.rate_date == day,
+                    ExchangeRate.currency == currency
+                ).first()
+                if not row:
+                    row = ExchangeRate(rate_date=day, currency=currency)
+                    db.add(row)
+                row.rate_to_pen = rate
+                row.source = source
+                row.fetched_at = now
+        db.commit()
+        latest = max(rates_by_date)
+        self.remember(latest, rates_by_date[latest])
+
+
+rate_store = RateStore()
+
+
+class FetchMetrics:
+    """Contadores de las consultas al proveedor y de las lecturas servidas vencidas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.fetches = 0
+        self.failures = 0
+        self.coalesced = 0
+        self.stale_served = 0
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self.last_latency_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_success_at: Optional[datetime] = None
+
+    def record_fetch(self, latency_ms: float, error: Optional[Exception] = None):
+        with self._lock:
+            self.fetches += 1
+            self.total_latency_ms += latency_ms
+            self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+            self.last_latency_ms = latency_ms
+            if error is None:
+                self.last_success_at = datetime.utcnow()
+            else:
+                self.failures += 1
+                self.last_error = str(error)
+
+    def increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            as_of, _ = rate_store.current()
+            return {
+                "as_of": as_of.isoformat() if as_of else None,
+                "fetches": self.fetches,
+                "failures": self.failures,
+                "coalesced": self.coalesced,
+                "stale_served": self.stale_served,
+                "avg_latency_ms": round(self.total_latency_ms / self.fetches, 1) if self.fetches else None,
+                "max_latency_ms": round(self.max_latency_ms, 1) if self.fetches else None,
+                "last_latency_ms": round(self.last_latency_ms, 1) if self.last_latency_ms is not None else None,
+                "last_error": self.last_error,
+                "last_success_at": self.last_success_at.isoformat() if self.last_success_at else None,
+            }
+
+
+fetch_metrics = FetchMetrics()
+
+
+def get_exchange_rates_to_pen(db: Optional[Session] = None) -> Dict[str, float]:
+    """Cuántos soles equivalen a 1 dólar y 1 real según el último tipo de cambio conocido.
+    Lee memoria o la base; nunca bloquea en la red. Si lo conocido es de un día anterior
+    lo devuelve igual y le pide al refresher que lo renueve."""
+    as_of, rates = rate_store.current()
+    if not rates and db is not None and rate_store.load_latest(db):
+        as_of, rates = rate_store.current()
+    if not rates:
+        exchange_rate_refresher.wake()
+        raise HTTPException(status_code=503, detail="No se pudo obtener el tipo de cambio")
+    if as_of < date.today():
+        fetch_metrics.increment("stale_served")
+        exchange_rate_refresher.wake()
+    return rates
+
+
+# ============= TIPO HISTÓRICO POR GASTO =============
+
+def rate_on(db: Session, currency: str, day) -> Optional[float]:
+    """Soles por unidad de `currency` vigentes en `day`: el último tipo guardado en o antes
+    de ese día; si no hay historia tan antigua, el más cercano posterior; si la tabla está
+    vacía, el tipo en memoria. None solo si no se conoce ningún tipo para la moneda."""
+    if currency == "soles":
+        return 1.0
+    if isinstance(day, datetime):
+        day = day.date()
+    day = day or date.today()
+    rate = db.query(ExchangeRate.rate_to_pen).filter(
+        ExchangeRate.currency == currency,
+        ExchangeRate.rate_date <= day
+    ).order_by(ExchangeRate.rate_date.desc()).limit(1).scalar()
+    if rate is None:
+        rate = db.query(ExchangeRate.rate_to_pen).filter(
+            ExchangeRate.currency == currency
+        ).order_by(ExchangeRate.rate_date).limit(1).scalar()
+    if rate is None:
+        _, rates = rate_store.current()
+        rate = (rates or {}).get(currency)
+    return rate
+
+
+def historical_rate_subquery(currency_col, date_col):
+    """Subconsulta correlacionada con el tipo vigente en `date_col` (último en o antes)."""
+    return (
+        select(ExchangeRate.rate_to_pen)
+        .where(ExchangeRate.currency == currency_col, ExchangeRate.rate_date <= date_col)
+        .order_by(ExchangeRate.rate_date.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def current_rates_or_empty() -> Dict[str, float]:
+    """Tipos en memoria sin consultar la base ni la red (vacío si todavía no hay)."""
+    _, rates = rate_store.current()
+    return rates or {}
+
+
+def pen_rate_sql(currency_col, rate_col, current_rates: Dict[str, float]):
+    """Soles por unidad en SQL: el tipo guardado en el gasto y, si falta, el actual. NULL
+    si la moneda no tiene tipo conocido, para que el gasto quede fuera de los SUM en vez
+    de contarse a la par."""
+    fallback = case(
+        (currency_col == "soles", 1.0),
+        *[(currency_col == currency, rate) for currency, rate in current_rates.items()],
+        else_=None,
+    )
+    return func.coalesce(rate_col, fallback)
+
+
+def pen_amount_sql(amount_col, currency_col, rate_col, current_rates: Dict[str, float]):
+    """`amount * rate` en SQL con el tipo de `pen_rate_sql` (NULL sin tipo conocido)."""
+    return amount_col * pen_rate_sql(currency_col, rate_col, current_rates)
+
+
+def pen_to_target(amount_pen: float, target: str, rates: Dict[str, float]) -> float:
+    return amount_pen if target == "soles" else amount_pen / rates["dolares"]
+
+
+def backfill_expense_rates(db: Session, only_missing: bool = True) -> int:
+    """Completa `expenses.pen_rate` con el tipo vigente en la fecha de cada gasto (en un
+    solo UPDATE). Los gastos más antiguos que la historia guardada toman el primer tipo
+    conocido. Devuelve cuántos gastos se actualizaron; no hace commit."""
+    earliest = (
+        select(ExchangeRate.rate_to_pen)
+        .where(ExchangeRate.currency == Expense.currency)
+        .order_by(ExchangeRate.rate_date)
+        .limit(1)
+        .scalar_subquery()
+    )
+    expense_day = func.coalesce(func.date(Expense.date), func.date(Expense.created_at))
+    rate = case(
+        (Expense.currency == "soles", 1.0),
+        else_=func.coalesce(historical_rate_subquery(Expense.currency, expense_day), earliest),
+    )
+    # pen_rate no se expone al cliente: no cuenta como cambio para la sincronización
+    query = update(Expense).values(pen_rate=rate, updated_at=Expense.updated_at)
+    if only_missing:
+        query = query.where(Expense.pen_rate.is_(None))
+    return db.execute(query.execution_options(synchronize_session=False)).rowcount
+
+
+# ============= REFRESCO EN SEGUNDO PLANO =============
+
+class ExchangeRateRefresher:
+    """Hilo que mantiene al día `exchange_rates`. En cada vuelta, si la base ya tiene los
+    tipos de hoy (otro worker los trajo) solo los carga en memoria; si no, consulta al
+    proveedor y los guarda. Los errores se registran y se reintenta en la siguiente vuelta.
+
+    `refresh_once` es single-flight: si ya hay una consulta en curso, quien llega no
+    consulta de nuevo; espera ese resultado (`wait=True`) o vuelve enseguida.
+
+    `after_save(db)` corre después de cada guardado con la misma sesión (main.py le pasa
+    el recálculo de los gastos que se crearon sin tipo conocido) y se confirma junto con
+    los tipos nuevos."""
+
+    def __init__(self, session_factory, provider: RateProvider, interval_seconds: float = 900,
+                 after_save: Optional[Callable[[Session], None]] = None):
+        self.session_factory = session_factory
+        self.provider = provider
+        self.interval_seconds = interval_seconds
+        self.after_save = after_save
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._in_flight = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh_once(self, wait: bool = True) -> bool:
+        if not self._in_flight.acquire(blocking=False):
+            fetch_metrics.increment("coalesced")
+            if not wait:
+                return False
+            with self._in_flight:
+                return rate_store.current()[0] == date.today()
+        try:
+            return self._refresh()
+        finally:
+            self._in_flight.release()
+
+    def _refresh(self) -> bool:
+        with self.session_factory() as db:
+            rate_store.load_latest(db)
+            as_of, _ = rate_store.current()
+            if as_of == date.today():
+                return True
+            started = time.perf_counter()
+            try:
+                rates_by_date = self.provider.fetch()
+            except Exception as e:
+                fetch_metrics.record_fetch((time.perf_counter() - started) * 1000, error=e)
+                print(f"Tipo de cambio ({self.provider.name}): {e}")
+                return False
+            fetch_metrics.record_fetch((time.perf_counter() - started) * 1000)
+            rate_store.save(db, rates_by_date, self.provider.name)
+            if self.after_save is not None:
+                try:
+                    self.after_save(db)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    print(f"Tipo de cambio, después de guardar: {e}")
+            return True
+
+    def wake(self):
+        """Pide una vuelta inmediata al hilo (no bloquea; sin hilo corriendo no hace nada)."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.refresh_once(wait=False)
+            except Exception as e:
+                print(f"Tipo de cambio: {e}")
+            self._wake.wait(self.interval_seconds)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="exchange-rate-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+
+exchange_rate_refresher = ExchangeRateRefresher(
+    SessionLocal,
+    provider_from_env(),
+    interval_seconds=float(os.getenv("EXCHANGE_RATE_REFRESH_SECONDS", "900"))
+)
@@ -0,0 +1,279 @@
+"""Operaciones de gastos por lote: alta (p. ej. importar los movimientos de un mes del
+banco) y cambios o bajas masivas sobre una selección (saldar todo lo pendiente entre dos
+personas, borrar una selección, cambiar el medio de pago de muchos gastos).
+
+El alta es un solo pedido con hasta BULK_EXPENSES_MAX gastos en vez de un POST por gasto: el acceso
+al item se verifica una vez, cada fila se valida por separado (las inválidas se
+informan con su índice y no impiden el alta de las demás), las descripciones se
+clasifican en un lote con `classify_normalized_batch` y las filas se insertan con un
+solo INSERT de varias filas. Saldos (`user_balances`) y contadores del resumen
+(`item_category_totals`) se actualizan con un delta acumulado por lote, todo en la
+transacción de `db`.
+
+Los cambios masivos son un solo UPDATE o DELETE sobre los gastos del item que elige la
+selección (`selection_ids`); después se regeneran con un GROUP BY los saldos del item y,
+si cambiaron montos o categorías (bajas), sus contadores del resumen.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, update
+from sqlalchemy.orm import Session
+
+from capital import (
+    ExpenseLedgerState, apply_ledger_deltas, expense_ledger_deltas, expense_share_sql, item_participant_count,
+    rebuild_item_ledger
+)
+from classification import classify_normalized_batch, normalize_description
+from exchange_rates import rate_on
+from expense_sync import record_tombstones
+from models import Expense, Item, ItemCategoryTotal, UserBalance, generate_uuid
+from schemas import ExpenseBulkChanges, ExpenseCreate, ExpenseSelection
+from summaries import ExpenseSummaryState, add_summary_delta, apply_summary_deltas, rebuild_item_totals
+
+BULK_EXPENSES_MAX = int(os.getenv("BULK_EXPENSES_MAX", "5000"))
+SPLIT_TYPES = ("divided", "assigned", "selected")
+
+
+def parse_expense_date(value: Optional[str]) -> Optional[datetime]:
+    """Fecha del gasto como la manda el frontend: ISO con o sin zona, o el formato de un
+    input datetime-local ('YYYY-MM-DDTHH:MM'). ValueError si no es ninguno."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M')
+
+
+def _validation_detail(error: ValidationError) -> str:
+    first = error.errors()[0]
+    field = ".".join(str(part) for part in first["loc"])
+    return f"{field}: {first['msg']}" if field else first["msg"]
+
+
+def validate_expense_rows(raw_rows: Sequence[Dict], member_ids: Sequence[str], default_payer: str
+                          ) -> Tuple[List[Tuple[int, ExpenseCreate, Optional[datetime]]], List[Dict]]:
+    """([(índice, gasto, fecha)] válidos, [{"index", "detail"}] inválidos). Además del
+    schema, exige una fecha legible y que quien pagó y a quien se asigna sean miembros
+    del item (si no, el saldo de la importación quedaría repartido a gente de afuera)."""
+    members = set(member_ids)
+    valid, errors = [], []
+    for index, raw in enumerate(raw_rows):
+        try:
+            expense = ExpenseCreate.model_validate(raw)
+        except ValidationError as e:
+            errors.append({"index": index, "detail": _validation_detail(e)})
+            continue
+        try:
+            expense_date = parse_expense_date(expense.date)
+        except ValueError:
+            errors.append({"index": index, "detail": f"date: fecha inválida ({expense.date})"})
+            continue
+        if expense.split_type not in SPLIT_TYPES:
+            detail = f"split_type: debe ser uno de {', '.join(SPLIT_TYPES)}"
+        elif (expense.paid_by or default_payer) not in members:
+            detail = "paid_by: no es miembro del item"
+        elif expense.split_type == "assigned" and expense.assigned_to not in members:
+            detail = "assigned_to: no es miembro del item"
+        elif expense.split_type == "selected" and not set(expense.selected_participants or []) <= members:
+            detail = "selected_participants: incluye usuarios que no son miembros del item"
+        else:
+            valid.append((index, expense, expense_date))
+            continue
+        errors.append({"index": index, "detail": detail})
+    return valid, errors
+
+
+def insert_expenses(db: Session, item: Item, member_ids: Sequence[str], default_payer: str,
+                    expenses: Sequence[Tuple[ExpenseCreate, Optional[datetime]]],
+                    ids: Optional[Sequence[str]] = None) -> List[str]:
+    """Inserta los gastos (ya validados) con un solo INSERT y aplica sus deltas de saldo y
+    de resumen. `ids` permite fijar el id de cada gasto. Devuelve los ids en el orden
+    recibido; no hace commit."""
+    if not expenses:
+        return []
+    now = datetime.utcnow()
+    ids = list(ids) if ids is not None else [generate_uuid() for _ in expenses]
+    normalized = [normalize_description(expense.description) for expense, _ in expenses]
+    classifications = classify_normalized_batch(normalized, db)
+    rates: Dict[Tuple[str, object], Optional[float]] = {}
+
+    rows = []
+    for expense_id, (expense, expense_date), description_normalized, auto in zip(ids, expenses, normalized, classifications):
+        spent = expense_date or now
+        rate_key = (expense.currency, spent.date())
+        if rate_key not in rates:
+            rates[rate_key] = rate_on(db, expense.currency, spent)
+        rows.append({
+            "id": expense_id,
+            "item_id": item.id,
+            "amount": expense.amount,
+            "description": expense.description,
+            "description_normalized": description_normalized,
+            "payment_method": expense.payment_method,
+            "currency": expense.currency,
+            "paid_by": expense.paid_by or default_payer,
+            "split_type": expense.split_type,
+            "assigned_to": expense.assigned_to,
+            "selected_participants": ",".join(expense.selected_participants) if expense.selected_participants else None,
+            "date": spent,
+            "created_at": now,
+            "updated_at": now,
+            "is_installment": expense.is_installment,
+            "installment_number": expense.installment_number,
+            "installment_total": expense.installment_total,
+            "installment_group_id": expense.installment_group_id,
+            "is_recurring": expense.is_recurring,
+            "is_settled": expense.is_settled,
+            "ai_category": auto.category,
+            "ai_confidence": auto.confidence,
+            "ai_model": auto.model,
+            "ai_classified_at": now,
+            "pen_rate": rates[rate_key],
+        })
+    db.execute(insert(Expense), rows)
+
+    participant_count = item_participant_count(item, db)
+    ledger_deltas: Dict = {}
+    summary_deltas: Dict = {}
+    for row in rows:
+        state = ExpenseLedgerState(
+            row["amount"], row["currency"], row["paid_by"], row["split_type"],
+            row["assigned_to"], row["selected_participants"], row["is_settled"], row["pen_rate"],
+        )
+        expense_ledger_deltas(state, item, member_ids, participant_count, deltas=ledger_deltas)
+        add_summary_delta(summary_deltas, item.id, ExpenseSummaryState(row["currency"], row["ai_category"] or "", row["amount"]))
+    apply_ledger_deltas(db, item.id, ledger_deltas)
+    apply_summary_deltas(db, summary_deltas)
+    return ids
+
+
+# ============= CAMBIOS MASIVOS =============
+
+LEDGER_CHANGES = ("split_type", "assigned_to", "selected_participants", "is_settled")
+
+
+def selection_is_empty(selection: ExpenseSelection) -> bool:
+    return selection.ids is None and not any(
+        value is not None for name, value in selection if name != "ids"
+    )
+
+
+def selection_error(selection: ExpenseSelection, member_ids: Sequence[str]) -> Optional[str]:
+    """Motivo por el que la selección no es válida, o None."""
+    if selection_is_empty(selection):
+        return "Selección vacía: indicar ids o algún filtro"
+    if selection.ids is not None and len(selection.ids) > BULK_EXPENSES_MAX:
+        return f"Máximo {BULK_EXPENSES_MAX} ids por pedido"
+    if selection.between is not None and (
+        len(selection.between) != 2 or len(set(selection.between)) != 2 or not set(selection.between) <= set(member_ids)
+    ):
+        return "between: deben ser dos miembros distintos del item"
+    return None
+
+
+def changes_error(changes: ExpenseBulkChanges, member_ids: Sequence[str]) -> Optional[str]:
+    """Mismas reglas que el alta (ver `validate_expense_rows`) para los campos que cambian."""
+    members = set(member_ids)
+    if not changes.model_dump(exclude_none=True):
+        return "No hay cambios para aplicar"
+    if changes.split_type is not None and changes.split_type not in SPLIT_TYPES:
+        return f"split_type: debe ser uno de {', '.join(SPLIT_TYPES)}"
+    if changes.split_type == "assigned" and changes.assigned_to is None:
+        return "assigned_to: obligatorio con split_type 'assigned'"
+    if changes.split_type == "selected" and not changes.selected_participants:
+        return "selected_participants: obligatorio con split_type 'selected'"
+    if changes.assigned_to is not None and changes.assigned_to not in members:
+        return "assigned_to: no es miembro del item"
+    if changes.selected_participants is not None and not set(changes.selected_participants) <= members:
+        return "selected_participants: incluye usuarios que no son miembros del item"
+    return None
+
+
+def selection_ids(db: Session, item: Item, selection: ExpenseSelection):
+    """SELECT de los ids de los gastos del item que elige `selection`, para usar como
+    subconsulta del UPDATE/DELETE."""
+    query = select(Expense.id).join(Item, Item.id == Expense.item_id).where(Expense.item_id == item.id)
+    if selection.ids is not None:
+        query = query.where(Expense.id.in_(selection.ids))
+    if selection.between:
+        a, b = selection.between
+        count = literal(item_participant_count(item, db))
+        # Deuda entre a y b: pagó uno y al otro le toca una parte (mismas reglas que el capital)
+        query = query.where(Item.item_type == "shared", or_(
+            and_(Expense.paid_by == a, expense_share_sql(literal(b), count) > 0),
+            and_(Expense.paid_by == b, expense_share_sql(literal(a), count) > 0),
+        ))
+    if selection.paid_by is not None:
+        query = query.where(Expense.paid_by == selection.paid_by)
+    if selection.is_settled is not None:
+        settled = func.coalesce(Expense.is_settled, False)
+        query = query.where(settled.is_(True) if selection.is_settled else settled.is_(False))
+    if selection.category is not None:
+        query = query.where(Expense.ai_category == selection.category)
+    if selection.date_from is not None:
+        query = query.where(Expense.date >= datetime.combine(selection.date_from, datetime.min.time()))
+    if selection.date_to is not None:
+        query = query.where(Expense.date < datetime.combine(selection.date_to + timedelta(days=1), datetime.min.time()))
+    return query
+
+
+def bulk_update_expenses(db: Session, item: Item, selection: ExpenseSelection, changes: ExpenseBulkChanges) -> int:
+    """Aplica `changes` (ya validados) con un UPDATE y regenera los saldos del item si
+    cambió el reparto o el saldado. Devuelve cuántos gastos cambiaron; no hace commit."""
+    values = changes.model_dump(exclude_none=True)
+    if "selected_participants" in values:
+        values["selected_participants"] = ",".join(values["selected_participants"]) or None
+    affected = db.execute(
+        update(Expense)
+        .where(Expense.id.in_(selection_ids(db, item, selection)))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if affected and any(name in values for name in LEDGER_CHANGES):
+        rebuild_item_ledger(db, item.id)
+    return affected
+
+
+def bulk_delete_expenses(db: Session, item: Item, selection: ExpenseSelection) -> int:
+    """Borra la selección, deja sus tombstones y regenera saldos y contadores del item.
+    Devuelve cuántos gastos se borraron; no hace commit."""
+    ids = list(db.scalars(selection_ids(db, item, selection)))
+    for start in range(0, len(ids), 1000):
+        db.execute(
+            delete(Expense)
+            .where(Expense.id.in_(ids[start:start + 1000]))
+            .execution_options(synchronize_session=False)
+        )
+    if ids:
+        record_tombstones(db, item.id, ids)
+        rebuild_item_ledger(db, item.id)
+        rebuild_item_totals(db, [item.id])
+    return len(ids)
+
+
+def item_aggregates(db: Session, item_id: str, user_id: str) -> Dict:
+    """Totales del item y saldo del usuario en el item, por moneda, desde los contadores
+    materializados (la forma de ExpenseBulkResult sin `affected`)."""
+    totals = {
+        currency: {"total_amount": round(total or 0.0, 2), "expense_count": int(count or 0)}
+        for currency, total, count in db.execute(
+            select(ItemCategoryTotal.currency, func.sum(ItemCategoryTotal.total_amount),
+                   func.sum(ItemCategoryTotal.expense_count))
+            .where(ItemCategoryTotal.item_id == item_id)
+            .group_by(ItemCategoryTotal.currency)
+        )
+        if count
+    }
+    balance = {
+        currency: {"share": round(share, 2), "owed_to_me": round(owed_to_me, 2), "i_owe": round(i_owe, 2)}
+        for currency, share, owed_to_me, i_owe in db.execute(
+            select(UserBalance.currency, UserBalance.share, UserBalance.owed_to_me, UserBalance.i_owe)
+            .where(UserBalance.item_id == item_id, UserBalance.user_id == user_id)
+        )
+        if share or owed_to_me or i_owe
+    }
+    return {"totals": totals, "balance": balance}
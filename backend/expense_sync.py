@@ -0,0 +1,83 @@
+"""Sincronización por cambios del listado de gastos de un item.
+
+El cliente guarda una copia local del listado y, en vez de volver a pedirlo completo
+después de cada cambio, pide `GET /api/items/{item_id}/expenses/changes?since=<marca>`:
+los gastos creados o modificados después de la marca (`expenses.updated_at`), los ids de
+los borrados (`expense_tombstones`) y la marca para el siguiente pedido. El costo depende
+de cuántos cambios hubo, no del tamaño del item.
+
+La marca es un instante del servidor (isoformat con microsegundos) corrido
+SYNC_WATERMARK_LAG_SECONDS hacia atrás, para cubrir transacciones que todavía no habían
+confirmado al consultar y diferencias de reloj entre workers: el pedido siguiente puede
+repetir algunos cambios, que el cliente vuelve a aplicar sin efecto (upsert por id). Si
+la marca es anterior a la retención de tombstones (EXPENSE_TOMBSTONE_DAYS) la respuesta
+pide una resincronización completa (`full_resync`).
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from models import Expense, ExpenseTombstone, Item
+from serialization import EXPENSE_COLUMNS, expense_dicts
+
+SYNC_WATERMARK_LAG = timedelta(seconds=float(os.getenv("SYNC_WATERMARK_LAG_SECONDS", "5")))
+TOMBSTONE_RETENTION = timedelta(days=int(os.getenv("EXPENSE_TOMBSTONE_DAYS", "90")))
+
+
+def record_tombstones(db: Session, item_id: str, expense_ids: Iterable[str]):
+    """Registra los gastos borrados del item; se confirma con la transacción de `db`."""
+    now = datetime.utcnow()
+    rows = [{"expense_id": expense_id, "item_id": item_id, "deleted_at": now} for expense_id in expense_ids]
+    if rows:
+        db.execute(insert(ExpenseTombstone), rows)
+
+
+def delete_item_tombstones(db: Session, item_id: str):
+    db.execute(delete(ExpenseTombstone).where(ExpenseTombstone.item_id == item_id))
+
+
+def prune_tombstones(db: Session) -> int:
+    """Borra los tombstones más viejos que la retención. Devuelve cuántos; no hace commit."""
+    cutoff = datetime.utcnow() - TOMBSTONE_RETENTION
+    return db.execute(delete(ExpenseTombstone).where(ExpenseTombstone.deleted_at < cutoff)).rowcount
+
+
+def parse_watermark(value: str) -> datetime:
+    """Marca recibida del cliente, en UTC sin zona como las columnas. ValueError si no es
+    una fecha ISO."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def expense_changes(db: Session, item_id: str, since: Optional[datetime]) -> Dict:
+    """Cambios del item desde `since` con la forma de ExpenseChangesResponse. Sin `since`
+    devuelve todos los gastos (sincronización inicial)."""
+    now = datetime.utcnow()
+    watermark = (now - SYNC_WATERMARK_LAG).isoformat(timespec="microseconds")
+    if since is not None and since < now - TOMBSTONE_RETENTION:
+        return {"expenses": [], "deleted": [], "item_changed": True, "full_resync": True, "watermark": watermark}
+
+    query = select(*EXPENSE_COLUMNS).where(Expense.item_id == item_id)
+    deleted, item_changed = [], True
+    if since is not None:
+        query = query.where(Expense.updated_at > since)
+        deleted = list(db.scalars(
+            select(ExpenseTombstone.expense_id)
+            .where(ExpenseTombstone.item_id == item_id, ExpenseTombstone.deleted_at > since)
+            .order_by(ExpenseTombstone.deleted_at)
+        ))
+        item_updated = db.scalar(select(Item.updated_at).where(Item.id == item_id))
+        item_changed = item_updated is None or item_updated > since
+    rows = db.execute(query.order_by(Expense.updated_at, Expense.id))
+    return {
+        "expenses": expense_dicts(rows),
+        "deleted": deleted,
+        "item_changed": item_changed,
+        "full_resync": False,
+        "watermark": watermark,
+    }
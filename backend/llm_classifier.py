@@ -0,0 +1,331 @@
+"""
+Clasificación de gastos con un LLM externo (endpoint compatible con OpenAI).
+
+Pipeline asíncrono por lotes: las descripciones normalizadas se deduplican, se buscan
+en la cache (memoria y gastos ya clasificados por el LLM en la base) y solo las nuevas
+se envían, varias por llamada, con un semáforo que limita las llamadas simultáneas y
+reintentos con backoff exponencial ante 429/5xx o errores de red. Así "netflix" o
+"uber" se consultan una sola vez aunque aparezcan en miles de gastos. Cada `classify`
+tiene un presupuesto total (LLM_MAX_SECONDS): pasado ese tiempo no se reintenta ni se
+empiezan lotes nuevos, y esos gastos quedan con la clasificación por reglas.
+
+Se activa con OPENAI_API_KEY; OPENAI_BASE_URL permite apuntar a otro proveedor
+compatible o a un servidor local (los tests usan uno).
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+from sqlalchemy import case, select, update
+from sqlalchemy.orm import Session
+
+from models import Expense
+from summaries import ExpenseSummaryState, add_summary_delta, apply_summary_deltas
+
+LLM_CONFIDENCE = 0.9
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+SYSTEM_PROMPT = (
+    "Clasificas gastos personales en Perú. Para cada descripción de la lista elige "
+    "exactamente una categoría de las permitidas. Responde solo JSON con la forma "
+    '{"categories": [...]} en el mismo orden y con la misma cantidad que la lista.'
+)
+
+
+def llm_model_label(model: str) -> str:
+    """Valor de `ai_model` para clasificaciones del LLM. Siempre empieza con "gpt-": es
+    la marca con la que `update_expense` las respeta al editar la descripción."""
+    return model if model.startswith("gpt-") else f"gpt-compat-{model}"
+
+
+class LLMCache:
+    """Categoría por descripción normalizada (LRU en memoria, compartida por el proceso)."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMClassifier:
+    def __init__(self, base_url: str, api_key: str, model: str, concurrency: int = 4, batch_size: int = 25,
+                 max_retries: int = 3, backoff_seconds: float = 0.5, timeout: float = 30.0,
+                 max_seconds: float = 20.0, cache: Optional[LLMCache] = None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.max_seconds = max_seconds
+        self.cache = cache if cache is not None else LLMCache()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "retries": 0, "failed_batches": 0, "sent": 0, "cache_hits": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def label(self) -> str:
+        return llm_model_label(self.model)
+
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        return {"enabled": self.enabled, "model": self.model, "cache_entries": len(self.cache), **stats}
+
+    def reset_stats(self):
+        with self._stats_lock:
+            for key in self._stats:
+                self._stats[key] = 0
+
+    async def classify(self, texts: Sequence[str], categories: Sequence[str],
+                       default: str = "otros") -> Dict[str, str]:
+        """Categoría por descripción normalizada. Las que ya están en la cache no se
+        envían; las de un lote que falló tras los reintentos o que no entró en
+        `max_seconds` quedan fuera del resultado."""
+        allowed = set(categories)
+        result: Dict[str, str] = {}
+        pending: List[str] = []
+        for text_value in dict.fromkeys(t for t in texts if t):
+            cached = self.cache.get(text_value)
+            if cached is not None and cached in allowed:
+                result[text_value] = cached
+            else:
+                pending.append(text_value)
+        self._count("cache_hits", len(result))
+        if not pending:
+            return result
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        deadline = time.monotonic() + self.max_seconds
+        async with httpx.AsyncClient(base_url=self.base_url, headers=headers, timeout=self.timeout) as client:
+            async def run(batch: List[str]):
+                async with semaphore:
+                    try:
+                        return batch, await self._classify_batch(client, batch, categories, deadline)
+                    except LLMError as e:
+                        self._count("failed_batches")
+                        print(f"Clasificación LLM: {e}")
+                        return batch, None
+
+            for batch, labels in await asyncio.gather(*(run(b) for b in batches)):
+                if labels is None:
+                    continue
+                for text_value, label in zip(batch, labels):
+                    category = label if label in allowed else default
+                    self.cache.put(text_value, category)
+                    result[text_value] = category
+        return result
+
+    async def _classify_batch(self, client: httpx.AsyncClient, batch: List[str],
+                              categories: Sequence[str], deadline: float) -> List[str]:
+        payload = {
+            "model": self.model,
+            "temperature": 0,
+            "response_format": {"type": "json_object"},
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": json.dumps(
+                    {"categorias_permitidas": list(categories), "descripciones": batch}, ensure_ascii=False
+                )},
+            ],
+        }
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMError(f"sin tiempo tras {attempt} intentos (LLM_MAX_SECONDS={self.max_seconds:g})")
+            if attempt:
+                self._count("retries")
+            self._count("requests")
+            try:
+                response = await client.post("/chat/completions", json=payload, timeout=min(self.timeout, remaining))
+            except httpx.HTTPError as e:
+                error, retry_after = f"{type(e).__name__}: {e}", None
+            else:
+                if response.status_code == 200:
+                    try:
+                        body = response.json()
+                    except ValueError as e:
+                        raise LLMError(f"Respuesta no JSON ({response.headers.get('content-type')}): {e}")
+                    labels = self._parse(body, len(batch))
+                    self._count("sent", len(batch))
+                    return labels
+                if response.status_code not in RETRYABLE_STATUS:
+                    raise LLMError(f"HTTP {response.status_code}: {response.text[:200]}")
+                error, retry_after = f"HTTP {response.status_code}", response.headers.get("retry-after")
+            if attempt == self.max_retries:
+                raise LLMError(f"{error} tras {self.max_retries + 1} intentos")
+            delay = self._backoff(attempt, retry_after)
+            if time.monotonic() + delay >= deadline:
+                raise LLMError(f"{error}; sin tiempo para reintentar (LLM_MAX_SECONDS={self.max_seconds:g})")
+            await asyncio.sleep(delay)
+        raise LLMError("sin intentos")  # pragma: no cover
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff_seconds * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    @staticmethod
+    def _parse(body: Dict, expected: int) -> List[str]:
+        try:
+            content = body["choices"][0]["message"]["content"]
+            labels = json.loads(content)["categories"]
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            raise LLMError(f"Respuesta inválida: {e}")
+        if not isinstance(labels, list) or len(labels) != expected:
+            raise LLMError(f"Respuesta con {len(labels) if isinstance(labels, list) else '?'} categorías para {expected} gastos")
+        return [str(label).strip().lower() for label in labels]
+
+
+def llm_classifier_from_env() -> LLMClassifier:
+    return LLMClassifier(
+        base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        api_key=os.getenv("OPENAI_API_KEY", ""),
+        model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+        concurrency=int(os.getenv("LLM_CONCURRENCY", "4")),
+        batch_size=int(os.getenv("LLM_BATCH_SIZE", "25")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+        max_seconds=float(os.getenv("LLM_MAX_SECONDS", "20")),
+        cache=LLMCache(int(os.getenv("LLM_CACHE_SIZE", "10000"))),
+    )
+
+
+llm_classifier = llm_classifier_from_env()
+
+
+# ============= JOB =============
+
+def _known_llm_labels(db: Session, texts: Sequence[str], chunk_size: int = 500) -> Dict[str, str]:
+    """Categorías que el LLM ya asignó en la base a estas descripciones (cache persistente)."""
+    known: Dict[str, str] = {}
+    for start in range(0, len(texts), chunk_size):
+        rows = db.execute(
+            select(Expense.description_normalized, Expense.ai_category)
+            .where(
+                Expense.description_normalized.in_(texts[start:start + chunk_size]),
+                Expense.ai_model.like("gpt-%"),
+                Expense.ai_category.isnot(None),
+            )
+        )
+        for text_value, category in rows:
+            known.setdefault(text_value, category)
+    return known
+
+
+def classify_expenses_with_llm(db: Session, categories: Sequence[str], item_id: Optional[str] = None,
+                               classifier: Optional[LLMClassifier] = None, limit: Optional[int] = None) -> Dict:
+    """Envía al LLM los gastos sin clasificación del LLM ni manual (reglas, modelo local o
+    sin categoría) de un item o de toda la base, y guarda el resultado con un
+    UPDATE ... CASE. Se llama desde código síncrono (endpoints en el threadpool, scripts):
+    corre su propio event loop, acotado por `classifier.max_seconds`. No hace commit.
+
+    `complete` indica si el LLM (o su cache) clasificó todos los gastos pendientes; si algún
+    lote falló, esos gastos siguen con la clasificación anterior."""
+    classifier = classifier or llm_classifier
+    stats = {"expenses": 0, "unique_descriptions": 0, "updated": 0, "complete": False, "elapsed_ms": 0.0}
+    if not classifier.enabled:
+        return stats
+    started = time.perf_counter()
+
+    query = select(
+        Expense.id, Expense.description_normalized, Expense.item_id,
+        Expense.currency, Expense.ai_category, Expense.amount,
+    ).where(
+        Expense.description_normalized.isnot(None),
+        Expense.description_normalized != "",
+        (Expense.ai_model.is_(None)) | ((Expense.ai_model != "manual") & ~Expense.ai_model.like("gpt-%")),
+    )
+    if item_id is not None:
+        query = query.where(Expense.item_id == item_id)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = db.execute(query).all()
+    texts = list(dict.fromkeys(row[1] for row in rows))
+    stats["expenses"], stats["unique_descriptions"] = len(rows), len(texts)
+    if not rows:
+        stats["complete"] = True
+        return stats
+
+    allowed = set(categories)
+    labels = {t: c for t, c in _known_llm_labels(db, texts).items() if c in allowed}
+    for text_value, category in labels.items():
+        classifier.cache.put(text_value, category)
+    classifier._count("cache_hits", len(labels))
+    remaining = [t for t in texts if t not in labels]
+    if remaining:
+        labels.update(asyncio.run(classifier.classify(remaining, categories)))
+
+    changed = {row[0]: labels[row[1]] for row in rows if row[1] in labels}
+    ids = list(changed)
+    now = datetime.utcnow()
+    for start in range(0, len(ids), 1000):
+        chunk = ids[start:start + 1000]
+        db.execute(
+            update(Expense)
+            .where(Expense.id.in_(chunk))
+            .values(
+                ai_category=case({i: changed[i] for i in chunk}, value=Expense.id),
+                ai_confidence=LLM_CONFIDENCE,
+                ai_model=classifier.label,
+                ai_classified_at=now,
+            )
+            .execution_options(synchronize_session=False)
+        )
+    deltas: Dict = {}
+    for expense_id, _, row_item, currency, category, amount in rows:
+        if expense_id in changed:
+            currency, amount = currency or "soles", float(amount or 0.0)
+            add_summary_delta(deltas, row_item, ExpenseSummaryState(currency, category or "", amount), sign=-1)
+            add_summary_delta(deltas, row_item, ExpenseSummaryState(currency, changed[expense_id], amount))
+    apply_summary_deltas(db, deltas)
+    stats["updated"] = len(ids)
+    stats["complete"] = len(ids) == len(rows)
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return stats
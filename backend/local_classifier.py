@@ -0,0 +1,249 @@
+"""
+Clasificador local de gastos aprendido de las correcciones manuales.
+
+Naive Bayes multinomial sobre n-gramas de caracteres de la descripción normalizada
+(`expenses.description_normalized`). Se entrena offline (train_local_classifier.py)
+con los gastos que el usuario recategorizó a mano (`ai_model == "manual"`) y se guarda
+como un JSON comprimido con las log-probabilidades de cada n-grama por categoría.
+
+Corre en CPU, en Python puro y sin dependencias extra: cada descripción suma los
+vectores de sus n-gramas columna a columna, y dentro de un lote las descripciones
+repetidas se puntúan una sola vez. Cada lote tiene un presupuesto de tiempo por
+predicción; lo que no entra en el presupuesto o sale con poca confianza vuelve al
+clasificador por reglas (ver `classification.classify_normalized_batch`).
+"""
+
+import gzip
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Expense
+
+LOCAL_MODEL = "local-nb-v1"
+ARTIFACT_VERSION = 1
+
+
+def char_ngrams(text: str, n_min: int = 2, n_max: int = 4) -> List[str]:
+    """n-gramas de caracteres de cada palabra, con un espacio de borde (" uber " -> " u", "ub", ...)."""
+    grams: List[str] = []
+    for word in text.split():
+        padded = f" {word} "
+        for n in range(n_min, n_max + 1):
+            grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+class NaiveBayesModel:
+    """Modelo entrenado: categorías, log P(categoría) y log P(n-grama | categoría) para el
+    vocabulario retenido. Los n-gramas fuera del vocabulario se ignoran."""
+
+    def __init__(self, classes: Sequence[str], class_log_prior: Sequence[float],
+                 features: Dict[str, Sequence[float]], ngram_range: Tuple[int, int] = (2, 4),
+                 samples: int = 0, trained_at: Optional[str] = None):
+        self.classes = tuple(classes)
+        self.class_log_prior = tuple(class_log_prior)
+        self.features = {gram: tuple(vector) for gram, vector in features.items()}
+        self.ngram_range = tuple(ngram_range)
+        self.samples = samples
+        self.trained_at = trained_at
+
+    @classmethod
+    def train(cls, samples: Iterable[Tuple[str, str]], alpha: float = 0.5, min_count: int = 2,
+              ngram_range: Tuple[int, int] = (2, 4)) -> "NaiveBayesModel":
+        """Entrena con pares (descripción normalizada, categoría). `min_count` descarta los
+        n-gramas que aparecen menos veces en total (achica el artefacto sin perder señal)."""
+        class_counts: Counter = Counter()
+        gram_counts: Dict[str, Counter] = defaultdict(Counter)
+        total = 0
+        for text_value, category in samples:
+            if not text_value or not category:
+                continue
+            total += 1
+            class_counts[category] += 1
+            for gram in char_ngrams(text_value, *ngram_range):
+                gram_counts[gram][category] += 1
+
+        classes = sorted(class_counts)
+        vocabulary = [g for g, counts in gram_counts.items() if sum(counts.values()) >= min_count]
+        class_totals = {c: sum(gram_counts[g][c] for g in vocabulary) for c in classes}
+        size = len(vocabulary)
+        denominators = {c: math.log(class_totals[c] + alpha * size) for c in classes}
+        features = {
+            gram: [round(math.log(gram_counts[gram][c] + alpha) - denominators[c], 4) for c in classes]
+            for gram in vocabulary
+        }
+        priors = [round(math.log(class_counts[c] / total), 4) for c in classes]
+        return cls(classes, priors, features, ngram_range, samples=total,
+                   trained_at=datetime.utcnow().isoformat())
+
+    def predict_batch(self, texts: Sequence[str], deadline: Optional[float] = None,
+                      min_coverage: float = 0.5) -> List[Optional[Tuple[str, float]]]:
+        """(categoría, probabilidad) por descripción, o None si menos de `min_coverage` de sus
+        n-gramas están en el vocabulario (el modelo no vio nada parecido y su probabilidad no
+        significa mucho). Si se pasa `deadline` (perf_counter) y vence, corta: la lista sale
+        más corta. Se puntúa una descripción a la vez; las repetidas en el lote reutilizan
+        el primer resultado."""
+        features, priors, classes = self.features, self.class_log_prior, self.classes
+        results: List[Optional[Tuple[str, float]]] = []
+        scored: Dict[str, Optional[Tuple[str, float]]] = {}
+        for text_value in texts:
+            if text_value in scored:
+                results.append(scored[text_value])
+                continue
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            grams = char_ngrams(text_value, *self.ngram_range)
+            vectors = [features[g] for g in grams if g in features]
+            prediction = None
+            if vectors and len(vectors) >= min_coverage * len(grams):
+                scores = [prior + sum(column) for prior, column in zip(priors, zip(*vectors))]
+                best = max(range(len(scores)), key=scores.__getitem__)
+                top = scores[best]
+                prediction = (classes[best], 1.0 / sum(math.exp(score - top) for score in scores))
+            scored[text_value] = prediction
+            results.append(prediction)
+        return results
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": ARTIFACT_VERSION,
+            "model": LOCAL_MODEL,
+            "classes": list(self.classes),
+            "class_log_prior": list(self.class_log_prior),
+            "ngram_range": list(self.ngram_range),
+            "samples": self.samples,
+            "trained_at": self.trained_at,
+            "features": {gram: list(vector) for gram, vector in self.features.items()},
+        }
+
+    def save(self, path: str):
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"), ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "NaiveBayesModel":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != ARTIFACT_VERSION:
+            raise ValueError(f"Versión de artefacto no soportada: {data.get('version')}")
+        return cls(data["classes"], data["class_log_prior"], data["features"],
+                   tuple(data["ngram_range"]), data.get("samples", 0), data.get("trained_at"))
+
+
+def manual_training_samples(db: Session) -> List[Tuple[str, str]]:
+    """Pares (descripción normalizada, categoría) de las correcciones manuales."""
+    rows = db.query(Expense.description_normalized, Expense.ai_category).filter(
+        Expense.ai_model == "manual",
+        Expense.description_normalized.isnot(None),
+        Expense.ai_category.isnot(None),
+    )
+    return [(text_value, category) for text_value, category in rows if text_value]
+
+
+class LocalClassifier:
+    """Modelo cargado desde `path`, compartido por el proceso. Se recarga solo si el
+    archivo cambia (otro entrenamiento), mirando su mtime como mucho una vez cada
+    `check_interval` segundos para no sumar un stat por predicción; sin artefacto,
+    `model()` devuelve None y todo va por reglas."""
+
+    def __init__(self, path: str, budget_ms: float = 2.0, min_confidence: float = 0.6,
+                 check_interval: float = 1.0):
+        self.path = path
+        self.budget_ms = budget_ms
+        self.min_confidence = min_confidence
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._model: Optional[NaiveBayesModel] = None
+        self._mtime: Optional[float] = None
+        self._checked_at: Optional[float] = None
+        self._pinned: Optional[NaiveBayesModel] = None
+        self._stats = {"predictions": 0, "accepted": 0, "low_confidence": 0, "over_budget": 0, "total_ms": 0.0}
+
+    def model(self) -> Optional[NaiveBayesModel]:
+        if self._pinned is not None:
+            return self._pinned
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self._model
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._model, self._mtime = None, None
+            return None
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        self._model = NaiveBayesModel.load(self.path)
+                    except Exception as e:
+                        print(f"Clasificador local: {e}")
+                        self._model = None
+                    self._mtime = mtime
+        return self._model
+
+    def set_model(self, model: Optional[NaiveBayesModel]):
+        """Fija `model` en vez del archivo (tests y benchmarks); None vuelve al archivo."""
+        with self._lock:
+            self._pinned = model
+
+    def predict_batch(self, texts: Sequence[str], allowed: Optional[frozenset] = None) -> List[Optional[Tuple[str, float]]]:
+        """Predicciones aceptadas (categoría existente y confianza suficiente) o None para
+        las que deben ir por reglas. El lote completo tiene `budget_ms` por descripción."""
+        model = self.model()
+        if model is None or not texts:
+            return [None] * len(texts)
+        started = time.perf_counter()
+        deadline = started + self.budget_ms * len(texts) / 1000
+        raw = model.predict_batch(texts, deadline=deadline)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        accepted: List[Optional[Tuple[str, float]]] = []
+        with self._lock:
+            self._stats["predictions"] += len(raw)
+            self._stats["total_ms"] += elapsed_ms
+            self._stats["over_budget"] += len(texts) - len(raw)
+            for prediction in raw:
+                if prediction is None or prediction[1] < self.min_confidence or (
+                    allowed is not None and prediction[0] not in allowed
+                ):
+                    self._stats["low_confidence"] += 1
+                    accepted.append(None)
+                else:
+                    self._stats["accepted"] += 1
+                    accepted.append(prediction)
+        return accepted + [None] * (len(texts) - len(raw))
+
+    def stats(self) -> Dict:
+        model = self._pinned or self._model
+        with self._lock:
+            stats = dict(self._stats)
+        predictions = stats.pop("predictions")
+        total_ms = stats.pop("total_ms")
+        return {
+            "loaded": model is not None,
+            "trained_at": model.trained_at if model else None,
+            "samples": model.samples if model else 0,
+            "predictions": predictions,
+            **stats,
+            "avg_ms": round(total_ms / predictions, 4) if predictions else 0.0,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {"predictions": 0, "accepted": 0, "low_confidence": 0, "over_budget": 0, "total_ms": 0.0}
+
+
+local_classifier = LocalClassifier(
+    os.getenv("LOCAL_CLASSIFIER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_classifier.json.gz")),
+    budget_ms=float(os.getenv("LOCAL_CLASSIFIER_BUDGET_MS", "2")),
+    min_confidence=float(os.getenv("LOCAL_CLASSIFIER_MIN_CONFIDENCE", "0.6")),
+)
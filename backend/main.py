@@ -1,31 +1,70 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, text
+from sqlalchemy import func, or_, select, text, tuple_
 from datetime import timedelta, datetime, date
-import calendar
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import os
 import json
+import base64
 import re
-import requests
 
 from database import engine, get_db, Base, DATABASE_URL, SessionLocal
-from models import User, Item, Expense, PendingInvitation, UserItemBudget, ItemSummary, Category, UserIncome
+from models import (
+    User, Item, Expense, PendingInvitation, UserItemBudget, ItemSummary, Category, UserIncome, UserBalance,
+    ItemCategoryTotal
+)
 from schemas import (
     UserCreate, UserLogin, UserResponse, Token,
     ItemCreate, ItemUpdate, ItemResponse,
-    ExpenseCreate, ExpenseUpdate, ExpenseResponse, ExpenseCategoryUpdate,
+    ExpenseCreate, ExpenseUpdate, ExpenseResponse, ExpenseCategoryUpdate, DuplicateExpenseGroup,
+    ExpenseChangesResponse, ExpenseBulkCreate, ExpenseBulkCreateResponse, OfflineSyncRequest, OfflineSyncResponse,
+    ExpenseSelection, ExpenseBulkChanges, ExpenseBulkUpdate, ExpenseBulkResult,
     ItemParticipantAdd,
     UserItemBudgetUpdate, UserItemBudgetResponse,
-    ItemSummaryResponse,
-    CategoryCreate, CategoryUpdate, CategoryResponse,
-    UserIncomeCreate, UserIncomeUpdate, UserIncomeResponse, CapitalResponse
+    ItemSummaryResponse, ItemTotalsResponse, ItemTrendResponse,
+    CategoryCreate, CategoryUpdate, CategoryResponse, ReclassifyResponse,
+    UserIncomeCreate, UserIncomeUpdate, UserIncomeResponse, CapitalResponse,
+    CapitalPoint, CapitalSeriesResponse
 )
 from auth import (
     get_password_hash, verify_password, create_access_token,
     get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
 )
+from capital import (
+    count_periodic_occurrences, capital_cache, item_member_ids, capital_series, capital_at,
+    expense_ledger_state, update_ledger_for_expense, rebuild_item_ledger, rebuild_ledger, delete_item_ledger,
+    reprice_unrated_expenses
+)
+from classification import (
+    category_registry, classify_expense_with_rules, validate_category, reclassify_rules_expenses,
+    classify_normalized_batch, normalize_description, backfill_normalized_descriptions
+)
+from local_classifier import local_classifier
+from llm_classifier import llm_classifier, classify_expenses_with_llm
+from serialization import (
+    json_response, expense_dicts, category_dicts, item_dict, EXPENSE_COLUMNS, CATEGORY_COLUMNS
+)
+from expense_bulk import (
+    BULK_EXPENSES_MAX, bulk_delete_expenses, bulk_update_expenses, changes_error, insert_expenses, item_aggregates,
+    parse_expense_date, selection_error, selection_is_empty, validate_expense_rows
+)
+from expense_sync import (
+    delete_item_tombstones, expense_changes, parse_watermark, prune_tombstones, record_tombstones
+)
+from offline_sync import delete_item_sync_keys, prune_sync_keys, sync_offline_expenses
+from read_models import ItemRow, item_participant_rows, item_row, item_summary_row, user_incomes, user_items
+from summaries import (
+    lock_item_for_summary, summary_is_fresh, summary_locks, expense_summary_state, update_summary_for_expense,
+    apply_summary_deltas, add_summary_delta, move_category_totals, rebuild_item_totals, delete_item_totals,
+    item_chain_trend
+)
+from exchange_rates import (
+    get_exchange_rates_to_pen, exchange_rate_refresher, fetch_metrics,
+    rate_on, pen_amount_sql, pen_to_target
+)
 
 # Crear tablas
 Base.metadata.create_all(bind=engine)
@@ -138,15 +177,50 @@ try:
             ("ai_confidence",        "FLOAT"),
             ("ai_model",             "VARCHAR"),
             ("ai_classified_at",     "TIMESTAMP"),
+            ("pen_rate",             "FLOAT"),
+            ("description_normalized", "VARCHAR"),
+            ("updated_at",           "TIMESTAMP"),
         ]
         for col_name, col_def in new_expense_cols:
             if not column_exists(conn, 'expenses', col_name):
                 print(f"Migrando: Agregando columna '{col_name}' a expenses...")
                 conn.execute(text(f"ALTER TABLE expenses ADD COLUMN {col_name} {col_def}"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_expenses_item_description_normalized "
+            "ON expenses (item_id, description_normalized)"
+        ))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_expenses_item_date_created "
+            "ON expenses (item_id, date DESC, created_at DESC, id DESC)"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_expenses_item_updated ON expenses (item_id, updated_at)"))
+        conn.execute(text("UPDATE expenses SET updated_at = created_at WHERE updated_at IS NULL"))
         conn.commit()
 except Exception as e:
     print(f"Migracion expenses: {e}")
 
+# Migración: montos en soles (al tipo de cada gasto) en user_balances
+try:
+    with engine.connect() as conn:
+        ledger_pen_cols = ["share_pen", "owed_to_me_pen", "i_owe_pen"]
+        for col_name in ledger_pen_cols:
+            if not column_exists(conn, 'user_balances', col_name):
+                print(f"Migrando: Agregando columna '{col_name}' a user_balances...")
+                conn.execute(text(f"ALTER TABLE user_balances ADD COLUMN {col_name} FLOAT NOT NULL DEFAULT 0"))
+        conn.commit()
+except Exception as e:
+    print(f"Migracion user_balances: {e}")
+
+# Migración: versión del capital por usuario (invalida la cache de /api/capital en todos los workers)
+try:
+    with engine.connect() as conn:
+        if not column_exists(conn, 'users', 'capital_version'):
+            print("Migrando: Agregando columna 'capital_version' a users...")
+            conn.execute(text("ALTER TABLE users ADD COLUMN capital_version INTEGER NOT NULL DEFAULT 0"))
+            conn.commit()
+except Exception as e:
+    print(f"Migracion users.capital_version: {e}")
+
 # Migración: Agregar columnas de items mensuales conectados
 try:
     with engine.connect() as conn:
@@ -154,15 +228,31 @@ try:
             ("is_recurring",      "BOOLEAN DEFAULT FALSE"),
             ("previous_item_id",  "VARCHAR"),
             ("next_item_id",      "VARCHAR"),
+            ("data_version",      "INTEGER NOT NULL DEFAULT 0"),
+            ("updated_at",        "TIMESTAMP"),
         ]
         for col_name, col_def in new_item_cols:
             if not column_exists(conn, 'items', col_name):
                 print(f"Migrando: Agregando columna '{col_name}' a items...")
                 conn.execute(text(f"ALTER TABLE items ADD COLUMN {col_name} {col_def}"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_items_previous_item_id ON items (previous_item_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_items_next_item_id ON items (next_item_id)"))
+        conn.execute(text("UPDATE items SET updated_at = created_at WHERE updated_at IS NULL"))
         conn.commit()
 except Exception as e:
     print(f"Migracion items: {e}")
 
+# Migración: versiones con las que se generó cada resumen
+try:
+    with engine.connect() as conn:
+        for col_name in ["source_version", "categories_version"]:
+            if not column_exists(conn, 'item_summaries', col_name):
+                print(f"Migrando: Agregando columna '{col_name}' a item_summaries...")
+                conn.execute(text(f"ALTER TABLE item_summaries ADD COLUMN {col_name} INTEGER"))
+        conn.commit()
+except Exception as e:
+    print(f"Migracion item_summaries: {e}")
+
 def seed_categories(db: Session):
     """Crea las categorías iniciales si la tabla está vacía. Idempotente."""
     if db.query(Category).count() == 0:
@@ -175,7 +265,9 @@ def seed_categories(db: Session):
                 position=position,
                 is_default=(name == "otros")
             ))
+        category_registry.bump(db)
         db.commit()
+        category_registry.invalidate()
 
 try:
     with SessionLocal() as seed_db:
@@ -183,24 +275,75 @@ try:
 except Exception as e:
     print(f"Seed categorias: {e}")
 
-def get_category_names(db: Session) -> List[str]:
-    return [c.name for c in db.query(Category).order_by(Category.position).all()]
-
-def validate_category(category: str, db: Session) -> str:
-    normalized = (category or "").strip().lower()
-    return normalized if normalized in get_category_names(db) else "otros"
-
-def classify_expense_with_rules(description: str, db: Session) -> str:
-    text_value = (description or "").strip().lower()
-    if not text_value:
-        return "otros"
-    for category in db.query(Category).order_by(Category.position).all():
-        if not category.keywords:
-            continue
-        keywords = [k.strip() for k in category.keywords.split(",") if k.strip()]
-        if any(keyword in text_value for keyword in keywords):
-            return category.name
-    return "otros"
+# Backfill: descripción normalizada de los gastos anteriores a la columna
+try:
+    with SessionLocal() as normalize_db:
+        if normalize_db.query(Expense.id).filter(Expense.description_normalized.is_(None)).first() is not None:
+            print("Backfill: completando expenses.description_normalized...")
+            backfill_normalized_descriptions(normalize_db)
+            normalize_db.commit()
+except Exception as e:
+    print(f"Backfill description_normalized: {e}")
+
+# Purga de tombstones de gastos y claves de la cola offline vencidos (ver expense_sync.py
+# y offline_sync.py)
+try:
+    with SessionLocal() as prune_db:
+        if prune_tombstones(prune_db) + prune_sync_keys(prune_db):
+            prune_db.commit()
+except Exception as e:
+    print(f"Purga expense_tombstones/synced_expense_keys: {e}")
+
+# Backfill: tipo de cambio histórico de cada gasto y saldos materializados (user_balances)
+# para bases creadas antes del ledger
+try:
+    with SessionLocal() as ledger_db:
+        # Solo regenera los items cuyos gastos recibieron tipo: sin tipos guardados no hace nada
+        repriced_members = reprice_unrated_expenses(ledger_db)
+        if repriced_members:
+            print("Backfill: completados expenses.pen_rate y sus saldos")
+            capital_cache.bump(ledger_db, repriced_members)
+            ledger_db.commit()
+        if ledger_db.query(UserBalance).first() is None and ledger_db.query(Expense).first() is not None:
+            print("Backfill: regenerando user_balances desde expenses...")
+            rebuild_ledger(ledger_db)
+            ledger_db.commit()
+except Exception as e:
+    print(f"Backfill user_balances: {e}")
+
+# Backfill: contadores del resumen (item_category_totals) para bases creadas antes de ellos
+try:
+    with SessionLocal() as totals_db:
+        if totals_db.query(ItemCategoryTotal).first() is None and totals_db.query(Expense).first() is not None:
+            print("Backfill: regenerando item_category_totals desde expenses...")
+            rebuild_item_totals(totals_db)
+            totals_db.commit()
+except Exception as e:
+    print(f"Backfill item_category_totals: {e}")
+
+
+def classify_unclassified(item_id: str, db: Session):
+    """Clasifica en un solo lote los gastos del item que todavía no tienen categoría."""
+    pending = db.query(Expense).filter(
+        Expense.item_id == item_id,
+        or_(Expense.ai_category.is_(None), Expense.ai_category == "")
+    ).all()
+    if not pending:
+        return
+    now = datetime.utcnow()
+    results = classify_normalized_batch(
+        [e.description_normalized or normalize_description(e.description) for e in pending], db
+    )
+    deltas: Dict = {}
+    for expense, (category, confidence, model) in zip(pending, results):
+        add_summary_delta(deltas, item_id, expense_summary_state(expense), sign=-1)
+        expense.ai_category = category
+        expense.ai_confidence = confidence
+        expense.ai_model = model
+        expense.ai_classified_at = now
+        add_summary_delta(deltas, item_id, expense_summary_state(expense))
+    apply_summary_deltas(db, deltas)
+    db.flush()
 
 def ensure_item_access(item_id: str, current_user: User, db: Session) -> Item:
     item = db.query(Item).filter(Item.id == item_id).first()
@@ -210,34 +353,23 @@ def ensure_item_access(item_id: str, current_user: User, db: Session) -> Item:
         raise HTTPException(status_code=403, detail="Not authorized to access this item")
     return item
 
-# ============= PERSONAL CAPITAL =============
-
-_exchange_rate_cache = {"date": None, "rates": None}
-
-def get_exchange_rates_to_pen() -> Dict[str, float]:
-    """Devuelve cuántos soles equivalen a 1 dólar y 1 real, cacheado por día.
-    Fuente: open.er-api.com (gratis, sin API key)."""
-    today = date.today()
-    if _exchange_rate_cache["date"] == today and _exchange_rate_cache["rates"]:
-        return _exchange_rate_cache["rates"]
+def mark_item_changed(item: Item):
+    """Los cambios de participantes e invitaciones no tocan la fila de items: se marcan a
+    mano para que la sincronización por cambios avise al cliente (`item_changed`)."""
+    item.updated_at = datetime.utcnow()
+
+def ensure_item_readable(item_id: str, current_user: User, db: Session,
+                         forbidden_detail: str = "Not authorized to access this item") -> ItemRow:
+    """Como `ensure_item_access` para endpoints de solo lectura: una fila de read_models en
+    vez del item ORM con sus participantes cargados."""
+    item = item_row(db, item_id, current_user.id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    if not item.is_member:
+        raise HTTPException(status_code=403, detail=forbidden_detail)
+    return item
 
-    try:
-        response = requests.get("https://open.er-api.com/v6/latest/USD", timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        usd_to_pen = data["rates"]["PEN"]
-        usd_to_brl = data["rates"]["BRL"]
-        rates = {
-            "dolares": usd_to_pen,
-            "reales": usd_to_pen / usd_to_brl,
-        }
-        _exchange_rate_cache["date"] = today
-        _exchange_rate_cache["rates"] = rates
-        return rates
-    except Exception:
-        if _exchange_rate_cache["rates"]:
-            return _exchange_rate_cache["rates"]
-        raise HTTPException(status_code=503, detail="No se pudo obtener el tipo de cambio")
+# ============= PERSONAL CAPITAL =============
 
 def convert_currency_dict(amounts: Dict[str, float], target: str, rates: Dict[str, float]) -> Dict[str, float]:
     """Convierte todos los montos de `amounts` a la moneda `target` ('soles' o 'dolares')."""
@@ -254,146 +386,27 @@ def convert_currency_dict(amounts: Dict[str, float], target: str, rates: Dict[st
             total += in_pen if target == "soles" else in_pen / rates["dolares"]
     return {target: round(total, 2)}
 
-def count_periodic_occurrences(start: date, day_of_month: int, until: date, end: date = None) -> int:
-    """Cuenta cuántas veces ocurrió `day_of_month` entre `start` y `until` (inclusive),
-    cortando en `end` si se dio (ingreso periódico cancelado). El mes en que se creó el
-    ingreso siempre cuenta completo, sin importar qué día de ese mes se haya registrado."""
-    effective_until = min(until, end) if end else until
-    effective_start = date(start.year, start.month, 1)
-    if effective_start > effective_until:
-        return 0
-
-    count = 0
-    year, month = effective_start.year, effective_start.month
-    while (year, month) <= (effective_until.year, effective_until.month):
-        last_day = calendar.monthrange(year, month)[1]
-        occurrence_day = min(day_of_month, last_day)
-        occurrence_date = date(year, month, occurrence_day)
-        if effective_start <= occurrence_date <= effective_until:
-            count += 1
-        if month == 12:
-            year, month = year + 1, 1
-        else:
-            month += 1
-    return count
-
-def calculate_user_expense_share(expense: Expense, user_id: str, item: Item, participant_count: int) -> float:
-    """Cuánto de este gasto le corresponde realmente a `user_id`, sin importar quién pagó.
-    Mismo criterio que calculateTotalsByCurrency (frontend/src/pages/Expenses.jsx:609-635)."""
-    if item.item_type == "personal":
-        return expense.amount if item.owner_id == user_id else 0.0
-
-    if expense.split_type == "assigned":
-        return expense.amount if expense.assigned_to == user_id else 0.0
-    elif expense.split_type == "divided":
-        if participant_count <= 0:
-            return 0.0
-        return expense.amount / participant_count
-    elif expense.split_type == "selected":
-        selected_ids = expense.selected_participants.split(",") if expense.selected_participants else []
-        if user_id in selected_ids and len(selected_ids) > 0:
-            return expense.amount / len(selected_ids)
-        return 0.0
-    return 0.0
-
-def get_user_capital(user_id: str, db: Session) -> Dict:
-    by_currency: Dict[str, float] = {}
-    owed_to_me: Dict[str, float] = {}
-    i_owe: Dict[str, float] = {}
-    income_details: List[Dict] = []
-    item_details: List[Dict] = []
-    today = datetime.utcnow().date()
-
-    incomes = db.query(UserIncome).filter(UserIncome.user_id == user_id).all()
-    for income in incomes:
-        by_currency.setdefault(income.currency, 0.0)
-        if income.income_type == "periodic" and income.day_of_month:
-            occurrences = count_periodic_occurrences(
-                income.date.date(), income.day_of_month, today,
-                income.end_date.date() if income.end_date else None
-            )
-            contributed = income.amount * occurrences
-        else:
-            occurrences = 1
-            contributed = income.amount
-        by_currency[income.currency] += contributed
-        income_details.append({
-            "id": income.id,
-            "description": income.description,
-            "income_type": income.income_type,
-            "currency": income.currency,
-            "base_amount": round(income.amount, 2),
-            "occurrences": occurrences,
-            "contributed_amount": round(contributed, 2),
-        })
-
-    items = db.query(Item).filter(
-        or_(
-            Item.owner_id == user_id,
-            Item.participants.any(User.id == user_id)
-        )
-    ).all()
-
-    for item in items:
-        # Los items archivados quedan fuera del presupuesto vigente: sus gastos ya
-        # fueron absorbidos por el capital inicial registrado como ingreso puntual.
-        if item.is_archived:
-            continue
-
-        participant_count = 1 + len({p.id for p in item.participants})
-        pending_count = db.query(PendingInvitation).filter(PendingInvitation.item_id == item.id).count()
-        participant_count += pending_count
-
-        item_amounts: Dict[str, float] = {}
-        expense_count = 0
-        for expense in item.expenses:
-            share = calculate_user_expense_share(expense, user_id, item, participant_count)
-            if share:
-                by_currency.setdefault(expense.currency, 0.0)
-                by_currency[expense.currency] -= share
-                item_amounts.setdefault(expense.currency, 0.0)
-                item_amounts[expense.currency] += share
-                expense_count += 1
-
-            # Deudas pendientes (informativas, ya reflejadas en by_currency vía "share"):
-            # lo que otros me deben cuando yo pagué de más, o lo que debo cuando pagó otro.
-            if item.item_type == "shared" and not expense.is_settled:
-                if expense.paid_by == user_id and share < expense.amount:
-                    owed_to_me.setdefault(expense.currency, 0.0)
-                    owed_to_me[expense.currency] += expense.amount - share
-                elif expense.paid_by != user_id and share > 0:
-                    i_owe.setdefault(expense.currency, 0.0)
-                    i_owe[expense.currency] += share
-
-        if item_amounts:
-            item_details.append({
-                "item_id": item.id,
-                "item_name": item.name,
-                "item_type": item.item_type,
-                "role": "owner" if item.owner_id == user_id else "participant",
-                "expense_count": expense_count,
-                "amounts": {c: round(a, 2) for c, a in item_amounts.items()},
-            })
-
-    return {
-        "by_currency": {c: round(a, 2) for c, a in by_currency.items()},
-        "owed_to_me": {c: round(a, 2) for c, a in owed_to_me.items()},
-        "i_owe": {c: round(a, 2) for c, a in i_owe.items()},
-        "detail": {
-            "incomes": income_details,
-            "items": item_details,
-        },
-    }
+def build_summary_payload(item_id: str, db: Session) -> Tuple[Dict[str, List[Dict[str, float]]], int]:
+    """Totales y cantidad de gastos por moneda × categoría del item, leídos de los
+    contadores de `item_category_totals` (una fila por par moneda/categoría). Las
+    categorías que ya no existen se suman a "otros" en una pasada sobre esas pocas filas.
+    Devuelve (payload, gastos contados)."""
+    rows = db.query(
+        ItemCategoryTotal.currency,
+        ItemCategoryTotal.category,
+        ItemCategoryTotal.total_amount,
+        ItemCategoryTotal.expense_count,
+    ).filter(ItemCategoryTotal.item_id == item_id, ItemCategoryTotal.expense_count > 0)
 
-def build_summary_payload(expenses: List[Expense], db: Session) -> Dict[str, List[Dict[str, float]]]:
     grouped: Dict[str, Dict[str, Dict[str, float]]] = {}
-    for expense in expenses:
-        currency = expense.currency or "soles"
-        category = validate_category(expense.ai_category, db)
-        grouped.setdefault(currency, {})
-        grouped[currency].setdefault(category, {"total_amount": 0.0, "expense_count": 0})
-        grouped[currency][category]["total_amount"] += float(expense.amount)
-        grouped[currency][category]["expense_count"] += 1
+    categories = category_registry.get(db)
+    expense_count = 0
+    for currency, raw_category, total_amount, count in rows:
+        category = categories.validate(raw_category)
+        stats = grouped.setdefault(currency, {}).setdefault(category, {"total_amount": 0.0, "expense_count": 0})
+        stats["total_amount"] += float(total_amount or 0.0)
+        stats["expense_count"] += count
+        expense_count += count
 
     result: Dict[str, List[Dict[str, float]]] = {}
     for currency, stats in grouped.items():
@@ -405,14 +418,15 @@ def build_summary_payload(expenses: List[Expense], db: Session) -> Dict[str, Lis
             }
             for category, values in sorted(
                 stats.items(),
-                key=lambda item: item[1]["total_amount"],
-                reverse=True
+                key=lambda item: (-item[1]["total_amount"], item[0])
             )
         ]
-    return result
+    return result, expense_count
 
-def sync_summary_snapshot(item_id: str, current_user: User, expenses: List[Expense], db: Session) -> ItemSummary:
-    categories_by_currency = build_summary_payload(expenses, db)
+def sync_summary_snapshot(item_id: str, current_user: User, db: Session, item_version: int,
+                          ai_model: str = "rules-v1") -> ItemSummary:
+    categories_version = category_registry.get(db).version
+    categories_by_currency, expense_count = build_summary_payload(item_id, db)
     categories_json = json.dumps(categories_by_currency, ensure_ascii=False)
     now = datetime.utcnow()
 
@@ -425,15 +439,44 @@ def sync_summary_snapshot(item_id: str, current_user: User, expenses: List[Expen
         db.add(summary)
 
     summary.generated_by = current_user.id
-    summary.ai_model = "rules-v1"
+    summary.ai_model = ai_model
     summary.categories_json = categories_json
-    summary.expenses_processed = len(expenses)
+    summary.expenses_processed = expense_count
+    summary.source_version = item_version
+    summary.categories_version = categories_version
     summary.generated_at = now
     summary.updated_at = now
     return summary
 
+def summary_response(summary: ItemSummary) -> Dict:
+    return {
+        "item_id": summary.item_id,
+        "generated_at": summary.generated_at,
+        "ai_model": summary.ai_model,
+        "expenses_processed": summary.expenses_processed,
+        "categories_by_currency": json.loads(summary.categories_json)
+    }
+
 app = FastAPI(title="App Gastos API")
 
+def reprice_after_rates_saved(db: Session):
+    """Al guardar tipos nuevos, valoriza los gastos que se crearon sin tipo conocido (p. ej.
+    en dólares antes del primer fetch) y regenera sus saldos sin esperar a un reinicio."""
+    members = reprice_unrated_expenses(db)
+    capital_cache.bump(db, members)
+    db.commit()
+
+exchange_rate_refresher.after_save = reprice_after_rates_saved
+
+@app.on_event("startup")
+def start_exchange_rate_refresher():
+    if os.getenv("EXCHANGE_RATE_REFRESH", "true").lower() == "true":
+        exchange_rate_refresher.start()
+
+@app.on_event("shutdown")
+def stop_exchange_rate_refresher():
+    exchange_rate_refresher.stop()
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -441,7 +484,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_BYTES", "4096")), compresslevel=5)
 
 # ============= AUTH ENDPOINTS =============
 
@@ -469,6 +514,7 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
     ).all()
 
     # Agregar el usuario a los items con invitaciones pendientes
+    affected_users = set()
     for invitation in pending_invitations:
         item = db.query(Item).filter(Item.id == invitation.item_id).first()
         if item and new_user not in item.participants:
@@ -476,7 +522,12 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
 
         # Eliminar la invitación pendiente
         db.delete(invitation)
+        if item:
+            mark_item_changed(item)
+            rebuild_item_ledger(db, item.id)
+            affected_users.update(item_member_ids(item))
 
+    capital_cache.bump(db, affected_users)
     db.commit()
 
     return new_user
@@ -517,32 +568,9 @@ def get_items(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Obtener items donde el usuario es owner O es participante
-    items = db.query(Item).filter(
-        or_(
-            Item.owner_id == current_user.id,
-            Item.participants.any(User.id == current_user.id)
-        )
-    ).order_by(Item.created_at.desc()).all()
-
-    # Agregar owner_email a cada item
-    result = []
-    for item in items:
-        item_dict = {
-            "id": item.id,
-            "name": item.name,
-            "item_type": item.item_type,
-            "owner_id": item.owner_id,
-            "owner_email": item.owner.email if item.owner else None,
-            "is_archived": item.is_archived,
-            "is_recurring": item.is_recurring,
-            "previous_item_id": item.previous_item_id,
-            "next_item_id": item.next_item_id,
-            "created_at": item.created_at
-        }
-        result.append(item_dict)
-
-    return result
+    # Items donde el usuario es owner O es participante, con el email del owner en la
+    # misma consulta
+    return json_response([item_dict(row) for row in user_items(db, current_user.id)])
 
 @app.post("/api/items", response_model=ItemResponse, status_code=status.HTTP_201_CREATED)
 def create_item(
@@ -600,13 +628,16 @@ def update_item(
 
     if item_update.name is not None:
         item.name = item_update.name
-    if item_update.item_type is not None:
+    if item_update.item_type is not None and item_update.item_type != item.item_type:
         item.item_type = item_update.item_type
+        rebuild_item_ledger(db, item.id)
     if item_update.is_archived is not None:
         item.is_archived = item_update.is_archived
     if item_update.is_recurring is not None:
         item.is_recurring = item_update.is_recurring
 
+    members = item_member_ids(item)
+    capital_cache.bump(db, members)
     db.commit()
     db.refresh(item)
     return item
@@ -706,6 +737,7 @@ def create_next_month_item(
             item_id=new_item.id,
             amount=expense.amount,
             description=expense.description,
+            description_normalized=normalize_description(expense.description),
             payment_method=expense.payment_method,
             currency=expense.currency,
             paid_by=expense.paid_by,
@@ -717,7 +749,12 @@ def create_next_month_item(
             installment_number=expense.installment_number + 1,
             installment_total=expense.installment_total,
             installment_group_id=expense.installment_group_id,
-            is_settled=False
+            is_settled=False,
+            ai_category=expense.ai_category,
+            ai_confidence=expense.ai_confidence,
+            ai_model=expense.ai_model,
+            ai_classified_at=expense.ai_classified_at,
+            pen_rate=rate_on(db, expense.currency, datetime.utcnow()),
         ))
 
     # Trasladar gastos recurrentes indefinidos (ej. Netflix, alquiler)
@@ -730,6 +767,7 @@ def create_next_month_item(
             item_id=new_item.id,
             amount=expense.amount,
             description=expense.description,
+            description_normalized=normalize_description(expense.description),
             payment_method=expense.payment_method,
             currency=expense.currency,
             paid_by=expense.paid_by,
@@ -738,11 +776,20 @@ def create_next_month_item(
             selected_participants=expense.selected_participants,
             date=datetime.utcnow(),
             is_recurring=True,
-            is_settled=False
+            is_settled=False,
+            ai_category=expense.ai_category,
+            ai_confidence=expense.ai_confidence,
+            ai_model=expense.ai_model,
+            ai_classified_at=expense.ai_classified_at,
+            pen_rate=rate_on(db, expense.currency, datetime.utcnow()),
         ))
 
     item.next_item_id = new_item.id
+    rebuild_item_ledger(db, new_item.id)
+    rebuild_item_totals(db, [new_item.id])
 
+    members = item_member_ids(new_item)
+    capital_cache.bump(db, members)
     db.commit()
     db.refresh(new_item)
     return new_item
@@ -760,14 +807,20 @@ def delete_item(
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
 
-    # Eliminar presupuestos personales del item antes de borrarlo
+    # Eliminar presupuestos personales y saldos del item antes de borrarlo
     db.query(UserItemBudget).filter(UserItemBudget.item_id == item_id).delete()
+    delete_item_ledger(db, item_id)
+    delete_item_totals(db, item_id)
+    delete_item_tombstones(db, item_id)
+    delete_item_sync_keys(db, item_id)
 
     # Desenlazar la cadena mensual antes de borrar (evita violar el FK)
     db.query(Item).filter(Item.previous_item_id == item_id).update({"previous_item_id": None})
     db.query(Item).filter(Item.next_item_id == item_id).update({"next_item_id": None})
 
+    members = item_member_ids(item)
     db.delete(item)
+    capital_cache.bump(db, members)
     db.commit()
     return None
 
@@ -860,43 +913,12 @@ def get_item_participants(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Verificar que el item pertenece al usuario o es participante
-    item = db.query(Item).filter(Item.id == item_id).first()
-    if not item:
-        raise HTTPException(status_code=404, detail="Item not found")
-
-    if item.owner_id != current_user.id and current_user not in item.participants:
-        raise HTTPException(status_code=403, detail="Not authorized")
-
-    # Incluir al owner y a todos los participantes
-    all_participants = [item.owner] + item.participants
-    # Remover duplicados si el owner también está en participants
-    seen = set()
-    unique_participants = []
-    for participant in all_participants:
-        if participant.id not in seen:
-            seen.add(participant.id)
-            unique_participants.append({
-                "id": participant.id,
-                "email": participant.email,
-                "name": participant.name,
-                "is_pending": False
-            })
-
-    # Agregar invitaciones pendientes
-    pending_invitations = db.query(PendingInvitation).filter(
-        PendingInvitation.item_id == item_id
-    ).all()
-
-    for invitation in pending_invitations:
-        unique_participants.append({
-            "id": invitation.id,
-            "email": invitation.email,
-            "name": None,
-            "is_pending": True
-        })
-
-    return unique_participants
+    ensure_item_readable(item_id, current_user, db, forbidden_detail="Not authorized")
+    # Owner, participantes (sin duplicar al owner) e invitaciones pendientes
+    return [
+        {"id": p.id, "email": p.email, "name": p.name, "is_pending": p.is_pending}
+        for p in item_participant_rows(db, item_id)
+    ]
 
 @app.post("/api/items/{item_id}/participants", status_code=status.HTTP_201_CREATED)
 def add_item_participant(
@@ -928,6 +950,10 @@ def add_item_participant(
 
         # Agregar participante
         item.participants.append(user_to_add)
+        mark_item_changed(item)
+        rebuild_item_ledger(db, item.id)
+        members = item_member_ids(item)
+        capital_cache.bump(db, members)
         db.commit()
 
         return {"id": user_to_add.id, "email": user_to_add.email, "name": user_to_add.name, "is_pending": False}
@@ -948,6 +974,10 @@ def add_item_participant(
             email=participant.email
         )
         db.add(new_invitation)
+        mark_item_changed(item)
+        rebuild_item_ledger(db, item.id)
+        members = item_member_ids(item)
+        capital_cache.bump(db, members)
         db.commit()
 
         return {"id": new_invitation.id, "email": participant.email, "name": None, "is_pending": True}
@@ -971,6 +1001,10 @@ def remove_item_participant(
     user_to_remove = db.query(User).filter(User.id == user_id).first()
     if user_to_remove and user_to_remove in item.participants:
         item.participants.remove(user_to_remove)
+        mark_item_changed(item)
+        rebuild_item_ledger(db, item.id)
+        members = item_member_ids(item) + [user_to_remove.id]
+        capital_cache.bump(db, members)
         db.commit()
         return None
 
@@ -982,6 +1016,10 @@ def remove_item_participant(
 
     if pending_invitation:
         db.delete(pending_invitation)
+        mark_item_changed(item)
+        rebuild_item_ledger(db, item.id)
+        members = item_member_ids(item)
+        capital_cache.bump(db, members)
         db.commit()
         return None
 
@@ -989,12 +1027,37 @@ def remove_item_participant(
 
 # ============= EXPENSES ENDPOINTS =============
 
+def encode_expense_cursor(expense) -> str:
+    """Cursor opaco con la clave de orden (date, created_at, id) del último gasto de la página."""
+    key = [expense.date.isoformat(), expense.created_at.isoformat(), expense.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+def decode_expense_cursor(cursor: str) -> Tuple[datetime, datetime, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        expense_date, created_at, expense_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(expense_date), datetime.fromisoformat(created_at), str(expense_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
 @app.get("/api/items/{item_id}/expenses", response_model=List[ExpenseResponse])
 def get_expenses(
     item_id: str,
+    q: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    """q: filtra por descripción, sin distinguir tildes ni mayúsculas ("clinica" encuentra
+    "Clínica San Pablo").
+
+    Paginación por cursor (keyset) sobre (date, created_at, id), del más reciente al más
+    antiguo: con `limit` devuelve esa cantidad y, si hay más, el cursor de la página
+    siguiente en el header X-Next-Cursor, que se pasa como `cursor`. Cada página es un
+    recorrido del índice ix_expenses_item_date_created desde el cursor, así que cuesta lo
+    mismo al principio que al final de la lista. Sin `limit` ni `cursor` devuelve todo,
+    como antes."""
     # Verificar que el item existe y el usuario tiene acceso
     item = db.query(Item).filter(Item.id == item_id).first()
     if not item:
@@ -1004,13 +1067,91 @@ def get_expenses(
     if item.owner_id != current_user.id and current_user not in item.participants:
         raise HTTPException(status_code=403, detail="Not authorized to access this item")
 
+    # Tuplas de columnas y JSON armado a mano (ver serialization.py): sin objetos ORM ni
+    # validación de ExpenseResponse por fila
+    query = select(*EXPENSE_COLUMNS).where(Expense.item_id == item_id)
+    search = normalize_description(q)
+    if search:
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.where(Expense.description_normalized.like(f"%{escaped}%", escape="\\"))
+    if cursor:
+        query = query.where(
+            tuple_(Expense.date, Expense.created_at, Expense.id) < tuple_(*decode_expense_cursor(cursor))
+        )
+    query = query.order_by(Expense.date.desc(), Expense.created_at.desc(), Expense.id.desc())
+    if limit is None and cursor is None:
+        return json_response(expense_dicts(db.execute(query)))
+
+    page_size = limit or 100
+    rows = db.execute(query.limit(page_size + 1)).all()
+    headers = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        headers = {"X-Next-Cursor": encode_expense_cursor(rows[-1])}
+    return json_response(expense_dicts(rows), headers=headers)
+
+@app.get("/api/items/{item_id}/expenses/changes", response_model=ExpenseChangesResponse)
+def get_expense_changes(
+    item_id: str,
+    since: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Gastos creados, modificados o borrados después de `since` (la `watermark` de la
+    respuesta anterior), para mantener una copia local del listado sin volver a pedirlo
+    completo. Sin `since` devuelve todos los gastos. Ver expense_sync.py."""
+    ensure_item_readable(item_id, current_user, db)
+    try:
+        watermark = parse_watermark(since) if since else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since inválido (fecha ISO de la última watermark)")
+    return json_response(expense_changes(db, item_id, watermark))
+
+@app.get("/api/items/{item_id}/expenses/duplicates", response_model=List[DuplicateExpenseGroup])
+def get_duplicate_expenses(
+    item_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Grupos de gastos del item con la misma descripción normalizada, monto, moneda y día:
+    candidatos a haberse registrado dos veces."""
+    ensure_item_access(item_id, current_user, db)
+    day = func.date(Expense.date)
+    keys = (
+        db.query(
+            Expense.description_normalized.label("description_normalized"),
+            Expense.amount.label("amount"),
+            Expense.currency.label("currency"),
+            day.label("day"),
+        )
+        .filter(Expense.item_id == item_id, Expense.description_normalized.isnot(None))
+        .group_by(Expense.description_normalized, Expense.amount, Expense.currency, day)
+        .having(func.count(Expense.id) > 1)
+        .subquery()
+    )
     expenses = (
-        db.query(Expense)
+        db.query(Expense, keys.c.day)
+        .join(keys, (Expense.description_normalized == keys.c.description_normalized)
+              & (Expense.amount == keys.c.amount)
+              & (Expense.currency == keys.c.currency)
+              & (day == keys.c.day))
         .filter(Expense.item_id == item_id)
-        .order_by(Expense.date.desc(), Expense.created_at.desc())
+        .order_by(day.desc(), Expense.description_normalized, Expense.created_at)
         .all()
     )
-    return expenses
+
+    groups: Dict[tuple, Dict] = {}
+    for expense, expense_day in expenses:
+        key = (expense.description_normalized, expense.amount, expense.currency, str(expense_day))
+        group = groups.setdefault(key, {
+            "description_normalized": expense.description_normalized,
+            "amount": expense.amount,
+            "currency": expense.currency,
+            "date": str(expense_day),
+            "expenses": [],
+        })
+        group["expenses"].append(expense)
+    return list(groups.values())
 
 @app.post("/api/items/{item_id}/expenses", response_model=ExpenseResponse, status_code=status.HTTP_201_CREATED)
 def create_expense(
@@ -1029,18 +1170,10 @@ def create_expense(
         raise HTTPException(status_code=403, detail="Not authorized to access this item")
 
     # Parse date string to datetime if provided
-    from datetime import datetime as dt
-    expense_date = None
-    if expense.date:
-        try:
-            # Handle both ISO format with and without timezone
-            expense_date = dt.fromisoformat(expense.date.replace('Z', '+00:00'))
-        except ValueError:
-            try:
-                # Try parsing without timezone (from datetime-local input)
-                expense_date = dt.strptime(expense.date, '%Y-%m-%dT%H:%M')
-            except ValueError:
-                expense_date = dt.now()
+    try:
+        expense_date = parse_expense_date(expense.date)
+    except ValueError:
+        expense_date = datetime.now()
 
     # Determinar quién pagó (por defecto el usuario actual)
     paid_by_id = expense.paid_by if expense.paid_by else current_user.id
@@ -1051,12 +1184,14 @@ def create_expense(
         selected_participants_str = ','.join(expense.selected_participants)
 
     now = datetime.utcnow()
-    auto_category = classify_expense_with_rules(expense.description, db)
+    description_normalized = normalize_description(expense.description)
+    auto = classify_normalized_batch([description_normalized], db)[0]
 
     new_expense = Expense(
         item_id=item_id,
         amount=expense.amount,
         description=expense.description,
+        description_normalized=description_normalized,
         payment_method=expense.payment_method,
         currency=expense.currency,
         paid_by=paid_by_id,
@@ -1070,17 +1205,117 @@ def create_expense(
         installment_group_id=expense.installment_group_id,
         is_recurring=expense.is_recurring,
         is_settled=expense.is_settled,
-        ai_category=auto_category,
-        ai_confidence=0.35,
-        ai_model="rules-v1",
+        ai_category=auto.category,
+        ai_confidence=auto.confidence,
+        ai_model=auto.model,
         ai_classified_at=now,
+        pen_rate=rate_on(db, expense.currency, expense_date),
     )
     db.add(new_expense)
+    update_ledger_for_expense(db, item, after=new_expense)
+    update_summary_for_expense(db, item_id, after=new_expense)
+    members = item_member_ids(item)
+    capital_cache.bump(db, members)
     db.commit()
     db.refresh(new_expense)
 
     return new_expense
 
+@app.post("/api/items/{item_id}/expenses/bulk", response_model=ExpenseBulkCreateResponse, status_code=status.HTTP_201_CREATED)
+def create_expenses_bulk(
+    item_id: str,
+    payload: ExpenseBulkCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Crea hasta BULK_EXPENSES_MAX gastos en una transacción (ver expense_bulk.py). Las
+    filas inválidas se devuelven en `errors` con su índice; las demás se crean igual."""
+    if len(payload.expenses) > BULK_EXPENSES_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo {BULK_EXPENSES_MAX} gastos por pedido")
+    item = ensure_item_access(item_id, current_user, db)
+    members = item_member_ids(item)
+    valid, errors = validate_expense_rows(payload.expenses, members, current_user.id)
+    ids = insert_expenses(db, item, members, current_user.id, [(expense, date) for _, expense, date in valid])
+    if ids:
+        capital_cache.bump(db, members)
+    db.commit()
+    return {"created": len(ids), "ids": ids, "errors": errors}
+
+def apply_bulk_change(item_id: str, selection: ExpenseSelection, changes: Optional[ExpenseBulkChanges],
+                      current_user: User, db: Session) -> Dict:
+    """UPDATE (con `changes`) o DELETE (sin) masivo sobre la selección; devuelve la
+    cantidad afectada y los nuevos totales del item y saldo del usuario."""
+    item = ensure_item_access(item_id, current_user, db)
+    members = item_member_ids(item)
+    error = selection_error(selection, members) or (changes_error(changes, members) if changes else None)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    if changes is None:
+        affected = bulk_delete_expenses(db, item, selection)
+    else:
+        affected = bulk_update_expenses(db, item, selection, changes)
+    if affected:
+        capital_cache.bump(db, members)
+    db.commit()
+    return {"affected": affected, **item_aggregates(db, item_id, current_user.id)}
+
+@app.patch("/api/items/{item_id}/expenses", response_model=ExpenseBulkResult)
+def update_expenses_bulk(
+    item_id: str,
+    payload: ExpenseBulkUpdate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Cambia payment_method, split_type, assigned_to, selected_participants y/o
+    is_settled de todos los gastos de la selección con un solo UPDATE."""
+    return apply_bulk_change(item_id, payload.selection, payload.changes, current_user, db)
+
+@app.post("/api/items/{item_id}/expenses/settle", response_model=ExpenseBulkResult)
+def settle_expenses_bulk(
+    item_id: str,
+    selection: ExpenseSelection,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Marca como saldados los gastos pendientes de la selección, p. ej. todo lo que se
+    deben dos personas en el item: {"between": [user_a, user_b]}. Para saldar todo el item
+    basta {"is_settled": false}."""
+    if selection_is_empty(selection):
+        raise HTTPException(status_code=400, detail="Selección vacía: indicar ids o algún filtro")
+    pending = selection.model_copy(update={"is_settled": False})
+    return apply_bulk_change(item_id, pending, ExpenseBulkChanges(is_settled=True), current_user, db)
+
+@app.post("/api/items/{item_id}/expenses/bulk-delete", response_model=ExpenseBulkResult)
+def delete_expenses_bulk(
+    item_id: str,
+    selection: ExpenseSelection,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return apply_bulk_change(item_id, selection, None, current_user, db)
+
+@app.post("/api/sync/expenses", response_model=OfflineSyncResponse)
+def sync_expenses(
+    payload: OfflineSyncRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Aplica la cola offline del frontend en un pedido, con una clave de idempotencia por
+    entrada: reenviar la cola no duplica gastos (ver offline_sync.py)."""
+    if len(payload.entries) > BULK_EXPENSES_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo {BULK_EXPENSES_MAX} gastos por pedido")
+    try:
+        results, members = sync_offline_expenses(db, current_user.id, payload.entries)
+        capital_cache.bump(db, members)
+        db.commit()
+    except IntegrityError:
+        # Otro pedido con las mismas claves confirmó primero: al reintentar salen como duplicadas
+        db.rollback()
+        results, members = sync_offline_expenses(db, current_user.id, payload.entries)
+        capital_cache.bump(db, members)
+        db.commit()
+    return {"results": results}
+
 @app.put("/api/items/{item_id}/expenses/{expense_id}", response_model=ExpenseResponse)
 def update_expense(
     item_id: str,
@@ -1105,12 +1340,15 @@ def update_expense(
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
+    ledger_before = expense_ledger_state(expense)
+    summary_before = expense_summary_state(expense)
     recategorize_with_rules = False
 
     if expense_update.amount is not None:
         expense.amount = expense_update.amount
     if expense_update.description is not None:
         expense.description = expense_update.description
+        expense.description_normalized = normalize_description(expense_update.description)
         recategorize_with_rules = True
     if expense_update.payment_method is not None:
         expense.payment_method = expense_update.payment_method
@@ -1125,16 +1363,10 @@ def update_expense(
     if expense_update.selected_participants is not None:
         expense.selected_participants = ','.join(expense_update.selected_participants) if expense_update.selected_participants else None
     if expense_update.date is not None:
-        from datetime import datetime as dt
         try:
-            # Handle both ISO format with and without timezone
-            expense.date = dt.fromisoformat(expense_update.date.replace('Z', '+00:00'))
+            expense.date = parse_expense_date(expense_update.date) or datetime.now()
         except ValueError:
-            try:
-                # Try parsing without timezone (from datetime-local input)
-                expense.date = dt.strptime(expense_update.date, '%Y-%m-%dT%H:%M')
-            except ValueError:
-                expense.date = dt.now()
+            expense.date = datetime.now()
     if expense_update.is_installment is not None:
         expense.is_installment = expense_update.is_installment
     if expense_update.installment_number is not None:
@@ -1148,14 +1380,20 @@ def update_expense(
     if expense_update.is_settled is not None:
         expense.is_settled = expense_update.is_settled
 
+    if expense_update.currency is not None or expense_update.date is not None:
+        expense.pen_rate = rate_on(db, expense.currency, expense.date)
+
     if recategorize_with_rules and expense.description:
-        # Solo reaplicar reglas si la clasificación actual no viene de IA OpenAI.
+        # Solo reclasificar si la clasificación actual no viene de IA OpenAI.
         if not expense.ai_model or not expense.ai_model.startswith("gpt-"):
-            expense.ai_category = classify_expense_with_rules(expense.description, db)
-            expense.ai_confidence = 0.35
-            expense.ai_model = "rules-v1"
+            auto = classify_normalized_batch([expense.description_normalized], db)[0]
+            expense.ai_category, expense.ai_confidence, expense.ai_model = auto
             expense.ai_classified_at = datetime.utcnow()
 
+    update_ledger_for_expense(db, item, before=ledger_before, after=expense)
+    update_summary_for_expense(db, item_id, before=summary_before, after=expense)
+    members = item_member_ids(item)
+    capital_cache.bump(db, members)
     db.commit()
     db.refresh(expense)
     return expense
@@ -1178,7 +1416,11 @@ def toggle_expense_settled(
     ).first()
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
+    ledger_before = expense_ledger_state(expense)
     expense.is_settled = not expense.is_settled
+    update_ledger_for_expense(db, item, before=ledger_before, after=expense)
+    members = item_member_ids(item)
+    capital_cache.bump(db, members)
     db.commit()
     db.refresh(expense)
     return expense
@@ -1203,10 +1445,12 @@ def set_expense_category(
     if category != payload.category.strip().lower():
         raise HTTPException(status_code=400, detail="Invalid category")
 
+    summary_before = expense_summary_state(expense)
     expense.ai_category = category
     expense.ai_confidence = 1.0
     expense.ai_model = "manual"
     expense.ai_classified_at = datetime.utcnow()
+    update_summary_for_expense(db, item.id, before=summary_before, after=expense)
 
     db.commit()
     db.refresh(expense)
@@ -1219,7 +1463,7 @@ def get_categories(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    return db.query(Category).order_by(Category.position).all()
+    return json_response(category_dicts(db.execute(select(*CATEGORY_COLUMNS).order_by(Category.position))))
 
 @app.post("/api/categories", response_model=CategoryResponse, status_code=status.HTTP_201_CREATED)
 def create_category(
@@ -1243,7 +1487,9 @@ def create_category(
         is_default=False
     )
     db.add(new_category)
+    category_registry.bump(db)
     db.commit()
+    category_registry.invalidate()
     db.refresh(new_category)
     return new_category
 
@@ -1272,12 +1518,15 @@ def update_category(
             db.query(Expense).filter(Expense.ai_category == db_category.name).update(
                 {"ai_category": normalized}
             )
+            move_category_totals(db, db_category.name, normalized)
             db_category.name = normalized
 
     if category_update.keywords is not None:
         db_category.keywords = category_update.keywords.strip() or None
 
+    category_registry.bump(db)
     db.commit()
+    category_registry.invalidate()
     db.refresh(db_category)
     return db_category
 
@@ -1300,11 +1549,31 @@ def delete_category(
     db.query(Expense).filter(Expense.ai_category == db_category.name).update(
         {"ai_category": default_name}
     )
+    move_category_totals(db, db_category.name, default_name)
 
     db.delete(db_category)
+    category_registry.bump(db)
     db.commit()
+    category_registry.invalidate()
     return None
 
+@app.post("/api/categories/reclassify", response_model=ReclassifyResponse)
+def reclassify_expenses(
+    item_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Reaplica las palabras clave vigentes a los gastos clasificados por reglas del item
+    indicado o, sin item_id, de todos los items del usuario. Los manuales y los de IA se
+    respetan."""
+    if item_id is not None:
+        ensure_item_access(item_id, current_user, db)
+        stats = reclassify_rules_expenses(db, item_id=item_id)
+    else:
+        stats = reclassify_rules_expenses(db, user_id=current_user.id)
+    db.commit()
+    return stats
+
 @app.delete("/api/items/{item_id}/expenses/{expense_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_expense(
     item_id: str,
@@ -1328,7 +1597,12 @@ def delete_expense(
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
+    update_ledger_for_expense(db, item, before=expense_ledger_state(expense))
+    update_summary_for_expense(db, item_id, before=expense_summary_state(expense))
+    members = item_member_ids(item)
     db.delete(expense)
+    record_tombstones(db, item_id, [expense_id])
+    capital_cache.bump(db, members)
     db.commit()
     return None
 
@@ -1340,33 +1614,28 @@ def get_item_summary(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    ensure_item_access(item_id, current_user, db)
-    expenses = (
-        db.query(Expense)
-        .filter(Expense.item_id == item_id)
-        .order_by(Expense.date.desc(), Expense.created_at.desc())
-        .all()
-    )
-    if not expenses:
-        raise HTTPException(status_code=404, detail="Summary not generated yet")
-
-    now = datetime.utcnow()
-    for expense in expenses:
-        if not expense.ai_category:
-            expense.ai_category = classify_expense_with_rules(expense.description, db)
-            expense.ai_confidence = 0.35
-            expense.ai_model = "rules-v1"
-            expense.ai_classified_at = now
-
-    summary = sync_summary_snapshot(item_id, current_user, expenses, db)
-    db.commit()
-    return {
-        "item_id": item_id,
-        "generated_at": summary.generated_at,
-        "ai_model": summary.ai_model,
-        "expenses_processed": summary.expenses_processed,
-        "categories_by_currency": json.loads(summary.categories_json)
-    }
+    """Sirve el resumen guardado si sigue vigente (solo lectura). Si algún gasto del item
+    o las categorías cambiaron desde que se generó, lo regenera una sola vez aunque haya
+    varios pedidos a la vez (ver summaries.py)."""
+    item = ensure_item_readable(item_id, current_user, db)
+    categories_version = category_registry.get(db).version
+    summary = item_summary_row(db, item_id)
+    if summary_is_fresh(summary, item.data_version, categories_version):
+        return summary_response(summary)
+
+    with summary_locks.hold(item_id):
+        item_version = lock_item_for_summary(db, item_id)
+        summary = db.query(ItemSummary).populate_existing().filter(ItemSummary.item_id == item_id).first()
+        if not summary_is_fresh(summary, item_version, categories_version):
+            if db.query(Expense.id).filter(Expense.item_id == item_id).first() is None:
+                db.rollback()
+                raise HTTPException(status_code=404, detail="Summary not generated yet")
+            classify_unclassified(item_id, db)
+            # Clasificar gastos pendientes incrementa la versión: el snapshot guarda la nueva
+            item_version = lock_item_for_summary(db, item_id)
+            summary = sync_summary_snapshot(item_id, current_user, db, item_version)
+        db.commit()
+    return summary_response(summary)
 
 @app.post("/api/items/{item_id}/summary/generate", response_model=ItemSummaryResponse)
 def generate_item_summary(
@@ -1374,33 +1643,116 @@ def generate_item_summary(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    ensure_item_access(item_id, current_user, db)
-    expenses = (
-        db.query(Expense)
-        .filter(Expense.item_id == item_id)
-        .order_by(Expense.date.desc(), Expense.created_at.desc())
-        .all()
-    )
-    if not expenses:
+    ensure_item_readable(item_id, current_user, db)
+    # Con OPENAI_API_KEY, los gastos sin clasificación manual ni del LLM pasan antes por el LLM
+    # (acotado por LLM_MAX_SECONDS). El resumen lleva la etiqueta del LLM solo si clasificó
+    # todos; si algún lote falló, esos gastos quedan por reglas y el resumen también.
+    summary_model = "rules-v1"
+    if llm_classifier.enabled:
+        llm_stats = classify_expenses_with_llm(db, category_registry.get(db).names, item_id=item_id)
+        if llm_stats["complete"]:
+            summary_model = llm_classifier.label
+
+    if db.query(Expense.id).filter(Expense.item_id == item_id).first() is None:
         raise HTTPException(status_code=400, detail="No expenses found for this item")
 
-    now = datetime.utcnow()
-    for expense in expenses:
-        if not expense.ai_category:
-            expense.ai_category = classify_expense_with_rules(expense.description, db)
-            expense.ai_confidence = 0.35
-            expense.ai_model = "rules-v1"
-            expense.ai_classified_at = now
-
-    summary = sync_summary_snapshot(item_id, current_user, expenses, db)
-    db.commit()
+    with summary_locks.hold(item_id):
+        classify_unclassified(item_id, db)
+        item_version = lock_item_for_summary(db, item_id)
+        summary = sync_summary_snapshot(item_id, current_user, db, item_version, ai_model=summary_model)
+        db.commit()
+    return summary_response(summary)
+
+@app.get("/api/items/{item_id}/trend", response_model=ItemTrendResponse)
+def get_item_trend(
+    item_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Gasto por mes × moneda × categoría a lo largo de la cadena de items mensuales
+    (previous_item_id/next_item_id), resuelta con una consulta recursiva. Cada categoría
+    trae un total por mes, en el orden de `months`."""
+    ensure_item_readable(item_id, current_user, db)
+    months, rows = item_chain_trend(db, item_id, current_user.id)
+    position = {month_id: index for index, (month_id, _, _) in enumerate(months)}
+    categories = category_registry.get(db)
+
+    grouped: Dict[str, Dict[str, Dict[str, list]]] = {}
+    for month_id, currency, raw_category, total_amount, count in rows:
+        category = categories.validate(raw_category)
+        stats = grouped.setdefault(currency, {}).setdefault(
+            category, {"totals": [0.0] * len(months), "expense_counts": [0] * len(months)}
+        )
+        stats["totals"][position[month_id]] += float(total_amount or 0.0)
+        stats["expense_counts"][position[month_id]] += int(count)
 
+    categories_by_currency = {}
+    for currency, stats in grouped.items():
+        rows_out = [
+            {
+                "category": category,
+                "totals": [round(value, 2) for value in values["totals"]],
+                "expense_counts": values["expense_counts"],
+                "total_amount": round(sum(values["totals"]), 2),
+            }
+            for category, values in stats.items()
+        ]
+        rows_out.sort(key=lambda row: (-row["total_amount"], row["category"]))
+        categories_by_currency[currency] = rows_out
     return {
         "item_id": item_id,
-        "generated_at": summary.generated_at,
-        "ai_model": summary.ai_model,
-        "expenses_processed": summary.expenses_processed,
-        "categories_by_currency": json.loads(summary.categories_json)
+        "months": [{"item_id": month_id, "name": name, "created_at": created_at} for month_id, name, created_at in months],
+        "categories_by_currency": categories_by_currency,
+    }
+
+@app.get("/api/items/{item_id}/totals", response_model=ItemTotalsResponse)
+def get_item_totals(
+    item_id: str,
+    convert: str = "soles",
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Total del item y por categoría en una sola moneda. Cada gasto se convierte al tipo
+    de cambio de su fecha (SUM(amount * pen_rate) en SQL); el total en soles se pasa a
+    dólares al tipo del día. Los gastos en una moneda sin tipo conocido quedan fuera de los
+    montos y se cuentan en `unpriced_count`."""
+    if convert not in ("soles", "dolares"):
+        raise HTTPException(status_code=400, detail="convert debe ser 'soles' o 'dolares'")
+    ensure_item_access(item_id, current_user, db)
+    rates = get_exchange_rates_to_pen(db)
+    amount_pen = pen_amount_sql(Expense.amount, Expense.currency, Expense.pen_rate, rates)
+    rows = db.query(
+        Expense.ai_category,
+        func.sum(amount_pen),
+        func.count(Expense.id),
+        func.count(Expense.id) - func.count(amount_pen),
+    ).filter(Expense.item_id == item_id).group_by(Expense.ai_category).all()
+
+    by_category: Dict[str, Dict[str, float]] = {}
+    unpriced_count = 0
+    for category, total_pen, count, unpriced in rows:
+        stat = by_category.setdefault(validate_category(category, db), {"total_amount": 0.0, "expense_count": 0})
+        stat["total_amount"] += total_pen or 0.0
+        stat["expense_count"] += count
+        unpriced_count += unpriced
+
+    stats = [
+        {
+            "category": category,
+            "total_amount": round(pen_to_target(stat["total_amount"], convert, rates), 2),
+            "expense_count": stat["expense_count"],
+        }
+        for category, stat in by_category.items()
+    ]
+    stats.sort(key=lambda row: (-row["total_amount"], row["category"]))
+    total_pen = sum(stat["total_amount"] for stat in by_category.values())
+    return {
+        "item_id": item_id,
+        "currency": convert,
+        "total": round(pen_to_target(total_pen, convert, rates), 2),
+        "expense_count": sum(stat["expense_count"] for stat in stats),
+        "unpriced_count": unpriced_count,
+        "by_category": stats,
     }
 
 # ============================================
@@ -1408,9 +1760,12 @@ def generate_item_summary(
 # ============================================
 
 @app.get("/api/exchange-rates")
-def get_exchange_rates(current_user: User = Depends(get_current_user)):
-    """Cuántos soles equivalen a 1 dólar y 1 real, según el tipo de cambio del día."""
-    return get_exchange_rates_to_pen()
+def get_exchange_rates(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Cuántos soles equivalen a 1 dólar y 1 real, según el último tipo de cambio conocido."""
+    return get_exchange_rates_to_pen(db)
 
 # ============================================
 # PERSONAL CAPITAL
@@ -1422,24 +1777,70 @@ def get_capital(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """convert: 'soles' o 'dolares' para colapsar todas las monedas en una sola
-    usando el tipo de cambio del día. Si se omite, devuelve cada moneda por separado."""
-    capital = get_user_capital(current_user.id, db)
-    incomes = db.query(UserIncome).filter(
-        UserIncome.user_id == current_user.id
-    ).order_by(UserIncome.created_at.desc()).all()
+    """convert: 'soles' o 'dolares' para colapsar todas las monedas en una sola. Cada gasto
+    se convierte al tipo de cambio de su fecha y los ingresos al del día; el total en soles
+    se pasa a dólares al tipo del día. Si se omite, devuelve cada moneda por separado."""
+    capital = capital_cache.get(current_user.id, db)
+    incomes = user_incomes(db, current_user.id)
 
     if convert in ("soles", "dolares"):
-        rates = get_exchange_rates_to_pen()
+        rates = get_exchange_rates_to_pen(db)
+        pen = capital["pen"]
+        incomes_pen = convert_currency_dict(pen["incomes"], "soles", rates).get("soles", 0.0)
+
+        def converted(amounts: Dict[str, float], amount_pen: float) -> Dict[str, float]:
+            return {convert: round(pen_to_target(amount_pen, convert, rates), 2)} if amounts else {}
+
         capital = {
-            "by_currency": convert_currency_dict(capital["by_currency"], convert, rates),
-            "owed_to_me": convert_currency_dict(capital["owed_to_me"], convert, rates),
-            "i_owe": convert_currency_dict(capital["i_owe"], convert, rates),
+            "by_currency": converted(capital["by_currency"], incomes_pen - pen["share"]),
+            "owed_to_me": converted(capital["owed_to_me"], pen["owed_to_me"]),
+            "i_owe": converted(capital["i_owe"], pen["i_owe"]),
             "detail": capital["detail"],
         }
 
     return {**capital, "incomes": incomes}
 
+CAPITAL_SERIES_MAX_MONTHS = 600
+
+def parse_query_date(value: str, field: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{field} inválida (formato YYYY-MM-DD)")
+
+@app.get("/api/capital/series", response_model=CapitalSeriesResponse)
+def get_capital_series(
+    start: str,
+    end: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Capital por moneda al cierre de cada mes entre `start` y `end` (por defecto hoy).
+    El último punto es `end` mismo, aunque caiga a mitad de mes."""
+    start_date = parse_query_date(start, "start")
+    end_date = parse_query_date(end, "end") if end else datetime.utcnow().date()
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start debe ser anterior a end")
+    months = (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+    if months > CAPITAL_SERIES_MAX_MONTHS:
+        raise HTTPException(status_code=400, detail=f"El rango no puede superar {CAPITAL_SERIES_MAX_MONTHS} meses")
+
+    return {
+        "start": start_date,
+        "end": end_date,
+        "points": capital_series(current_user.id, db, start_date, end_date),
+    }
+
+@app.get("/api/capital/at", response_model=CapitalPoint)
+def get_capital_at(
+    at: str = Query(..., alias="date"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Capital por moneda al final del día `date` (YYYY-MM-DD)."""
+    at_date = parse_query_date(at, "date")
+    return {"date": at_date, "by_currency": capital_at(current_user.id, db, at_date)}
+
 @app.post("/api/capital/incomes", response_model=UserIncomeResponse, status_code=status.HTTP_201_CREATED)
 def create_income(
     income: UserIncomeCreate,
@@ -1470,6 +1871,7 @@ def create_income(
         day_of_month=income.day_of_month if income.income_type == "periodic" else None
     )
     db.add(new_income)
+    capital_cache.bump(db, [current_user.id])
     db.commit()
     db.refresh(new_income)
     return new_income
@@ -1504,6 +1906,7 @@ def update_income(
         except ValueError:
             raise HTTPException(status_code=400, detail="end_date inválida")
 
+    capital_cache.bump(db, [current_user.id])
     db.commit()
     db.refresh(db_income)
     return db_income
@@ -1522,9 +1925,25 @@ def delete_income(
         raise HTTPException(status_code=404, detail="Income not found")
 
     db.delete(db_income)
+    capital_cache.bump(db, [current_user.id])
     db.commit()
     return None
 
+# ============================================
+# MÉTRICAS
+# ============================================
+
+@app.get("/api/metrics")
+def get_metrics(current_user: User = Depends(get_current_user)):
+    """Métricas en memoria de este proceso (cada worker de uvicorn tiene las suyas)."""
+    return {
+        "capital_cache": capital_cache.stats(),
+        "exchange_rates": fetch_metrics.stats(),
+        "categories": category_registry.stats(),
+        "local_classifier": local_classifier.stats(),
+        "llm_classifier": llm_classifier.stats(),
+    }
+
 @app.get("/")
 def root():
     return {"message": "App Gastos API"}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, Boolean, Table
+from sqlalchemy import Column, String, Integer, Float, Date, DateTime, ForeignKey, Boolean, Table, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -24,6 +24,8 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     name = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Versión de los datos que entran en su capital; la incrementa CapitalCache.bump
+    capital_version = Column(Integer, nullable=False, default=0)
 
     # Relaciones
     items = relationship("Item", back_populates="owner")
@@ -41,7 +43,18 @@ class Item(Base):
     is_recurring = Column(Boolean, nullable=False, default=False)
     previous_item_id = Column(String, ForeignKey("items.id"), nullable=True)
     next_item_id = Column(String, ForeignKey("items.id"), nullable=True)
+    # Se incrementa con cada escritura que cambia el resumen (ver summaries.py)
+    data_version = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Cambios del item en sí o de sus participantes/invitaciones (ver mark_item_changed en
+    # main.py); los de sus gastos van en data_version y expenses.updated_at
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # La cadena mensual se recorre por estos enlaces (ver summaries.item_chain_cte)
+        Index("ix_items_previous_item_id", "previous_item_id"),
+        Index("ix_items_next_item_id", "next_item_id"),
+    )
 
     # Relaciones
     owner = relationship("User", back_populates="items")
@@ -81,11 +94,50 @@ class Expense(Base):
     ai_confidence = Column(Float, nullable=True)
     ai_model = Column(String, nullable=True)
     ai_classified_at = Column(DateTime, nullable=True)
+    pen_rate = Column(Float, nullable=True)  # soles por unidad de `currency` vigentes en `date`
+    description_normalized = Column(String, nullable=True)  # sin tildes, minúsculas, espacios simples
+    # Último cambio visible para el cliente (sincronización por cambios, ver expense_sync.py)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
     # Relaciones
     item = relationship("Item", back_populates="expenses")
     paid_by_user = relationship("User", back_populates="expenses", foreign_keys=[paid_by])
 
+    __table_args__ = (
+        Index("ix_expenses_item_description_normalized", "item_id", "description_normalized"),
+        # Listado del item y paginación por cursor (ver get_expenses)
+        Index("ix_expenses_item_date_created", "item_id", date.desc(), created_at.desc(), id.desc()),
+        Index("ix_expenses_item_updated", "item_id", "updated_at"),
+    )
+
+# Gastos borrados, para que los clientes que sincronizan por cambios también se enteren
+# de las bajas (ver expense_sync.py). Se purgan pasados EXPENSE_TOMBSTONE_DAYS días.
+class ExpenseTombstone(Base):
+    __tablename__ = "expense_tombstones"
+
+    expense_id = Column(String, primary_key=True)
+    item_id = Column(String, ForeignKey("items.id", ondelete="CASCADE"), nullable=False)
+    deleted_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_expense_tombstones_item_deleted", "item_id", "deleted_at"),
+    )
+
+# Claves de idempotencia de los gastos creados desde la cola offline del frontend: una
+# entrada reenviada con la misma clave no crea otro gasto (ver offline_sync.py).
+class SyncedExpenseKey(Base):
+    __tablename__ = "synced_expense_keys"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    client_key = Column(String, primary_key=True)
+    item_id = Column(String, ForeignKey("items.id", ondelete="CASCADE"), nullable=False)
+    expense_id = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_synced_expense_keys_created_at", "created_at"),
+    )
+
 class Category(Base):
     __tablename__ = "categories"
 
@@ -134,8 +186,71 @@ class ItemSummary(Base):
     ai_model = Column(String, nullable=True)
     categories_json = Column(String, nullable=False, default="{}")
     expenses_processed = Column(Integer, nullable=False, default=0)
+    # Versiones del item y de las categorías con las que se generó
+    source_version = Column(Integer, nullable=True)
+    categories_version = Column(Integer, nullable=True)
     generated_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, nullable=False)
 
     item = relationship("Item")
     user = relationship("User")
+
+# Total y cantidad de gastos por item/moneda/categoría (la categoría tal cual está en
+# expenses.ai_category, "" si no tiene). Lo mantienen los endpoints de gastos con deltas
+# (ver summaries.py); verify_item_summaries.py lo compara contra expenses.
+class ItemCategoryTotal(Base):
+    __tablename__ = "item_category_totals"
+
+    item_id = Column(String, ForeignKey("items.id", ondelete="CASCADE"), primary_key=True)
+    currency = Column(String, primary_key=True)
+    category = Column(String, primary_key=True)
+    total_amount = Column(Float, nullable=False, default=0.0)
+    expense_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, nullable=False)
+
+# Saldo materializado por usuario/item/moneda. Lo mantienen los endpoints de gastos
+# y participantes (ver capital.py); se regenera con rebuild_capital_ledger.py.
+class UserBalance(Base):
+    __tablename__ = "user_balances"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    item_id = Column(String, ForeignKey("items.id", ondelete="CASCADE"), primary_key=True)
+    currency = Column(String, primary_key=True)
+    share = Column(Float, nullable=False, default=0.0)
+    owed_to_me = Column(Float, nullable=False, default=0.0)
+    i_owe = Column(Float, nullable=False, default=0.0)
+    share_pen = Column(Float, nullable=False, default=0.0)  # mismos montos en soles, al tipo de cada gasto
+    owed_to_me_pen = Column(Float, nullable=False, default=0.0)
+    i_owe_pen = Column(Float, nullable=False, default=0.0)
+    expense_count = Column(Integer, nullable=False, default=0)
+    owed_count = Column(Integer, nullable=False, default=0)
+    owe_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_user_balances_user_id", "user_id"),
+    )
+
+# Tipo de cambio diario: cuántos soles vale 1 unidad de `currency` ("dolares", "reales")
+class ExchangeRate(Base):
+    __tablename__ = "exchange_rates"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    rate_date = Column(Date, nullable=False)
+    currency = Column(String, nullable=False)
+    rate_to_pen = Column(Float, nullable=False)
+    source = Column(String, nullable=False)
+    fetched_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("rate_date", "currency", name="uq_exchange_rates_date_currency"),
+    )
+
+# Versión de datos cacheados en memoria por cada worker (p. ej. "categories"). Quien
+# modifica esos datos incrementa la versión; los workers la comparan con la de su copia.
+class CacheVersion(Base):
+    __tablename__ = "cache_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, nullable=False)
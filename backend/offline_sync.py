@@ -0,0 +1,110 @@
+"""Sincronización de la cola offline de gastos (IndexedDB `pending-expenses` del frontend).
+
+El frontend manda toda la cola en un pedido a `POST /api/sync/expenses`; cada entrada
+trae una clave de idempotencia generada en el cliente al encolarla. La clave se guarda
+en `synced_expense_keys` (única por usuario) en la misma transacción que el gasto, así
+que reenviar una entrada ya aplicada (se cortó la conexión antes de la respuesta, el
+usuario reintentó) devuelve `duplicate` con el id del gasto original en vez de crearlo
+de nuevo. Los gastos se crean por item con `insert_expenses` (ver expense_bulk.py).
+
+Cada entrada tiene su resultado (`created`, `duplicate` o `error`) para que el cliente
+vacíe su cola en una pasada: borra las creadas y las duplicadas y deja las que fallaron.
+Las claves se purgan pasados OFFLINE_SYNC_KEY_DAYS días.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence, Set, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from capital import item_member_ids
+from expense_bulk import insert_expenses, validate_expense_rows
+from models import Item, SyncedExpenseKey, generate_uuid
+from read_models import item_row
+
+SYNC_KEY_RETENTION = timedelta(days=int(os.getenv("OFFLINE_SYNC_KEY_DAYS", "30")))
+
+
+def _stored_keys(db: Session, user_id: str, keys: Sequence[str]) -> Dict[str, str]:
+    """{clave: expense_id} de las claves del usuario que ya se aplicaron."""
+    unique = list(set(keys))
+    stored: Dict[str, str] = {}
+    for start in range(0, len(unique), 1000):
+        stored.update(db.execute(
+            select(SyncedExpenseKey.client_key, SyncedExpenseKey.expense_id)
+            .where(SyncedExpenseKey.user_id == user_id, SyncedExpenseKey.client_key.in_(unique[start:start + 1000]))
+        ).all())
+    return stored
+
+
+def _result(key: str, status: str, expense_id: str = None, detail: str = None) -> Dict:
+    return {"key": key, "status": status, "expense_id": expense_id, "detail": detail}
+
+
+def sync_offline_expenses(db: Session, user_id: str, entries: Sequence) -> Tuple[List[Dict], Set[str]]:
+    """Aplica las entradas (`key`, `item_id`, `expense`) que todavía no se aplicaron.
+    Devuelve (resultados en el orden de `entries`, miembros de los items con gastos
+    nuevos). No hace commit; si otro pedido confirmó las mismas claves en paralelo, el
+    INSERT de las claves falla con IntegrityError y basta con reintentar."""
+    stored = _stored_keys(db, user_id, [entry.key for entry in entries])
+    results: Dict[int, Dict] = {}
+    first_index: Dict[str, int] = {}
+    pending_by_item: Dict[str, List[int]] = {}
+    for index, entry in enumerate(entries):
+        if not entry.key:
+            results[index] = _result(entry.key, "error", detail="key: la clave de idempotencia es obligatoria")
+        elif entry.key in stored:
+            results[index] = _result(entry.key, "duplicate", stored[entry.key])
+        elif entry.key not in first_index:
+            first_index[entry.key] = index
+            pending_by_item.setdefault(entry.item_id, []).append(index)
+
+    touched: Set[str] = set()
+    for item_id, indexes in pending_by_item.items():
+        access = item_row(db, item_id, user_id)
+        if access is None or not access.is_member:
+            detail = "Item not found" if access is None else "Not authorized to access this item"
+            for index in indexes:
+                results[index] = _result(entries[index].key, "error", detail=detail)
+            continue
+
+        item = db.get(Item, item_id)
+        members = item_member_ids(item)
+        valid, errors = validate_expense_rows([entries[index].expense for index in indexes], members, user_id)
+        for error in errors:
+            index = indexes[error["index"]]
+            results[index] = _result(entries[index].key, "error", detail=error["detail"])
+        if not valid:
+            continue
+
+        # Las claves van antes que los gastos: si otro pedido ya las tomó, falla acá
+        ids = [generate_uuid() for _ in valid]
+        now = datetime.utcnow()
+        db.execute(insert(SyncedExpenseKey), [
+            {"user_id": user_id, "client_key": entries[indexes[local]].key, "item_id": item_id,
+             "expense_id": expense_id, "created_at": now}
+            for (local, _, _), expense_id in zip(valid, ids)
+        ])
+        insert_expenses(db, item, members, user_id, [(expense, date) for _, expense, date in valid], ids=ids)
+        for (local, _, _), expense_id in zip(valid, ids):
+            results[indexes[local]] = _result(entries[indexes[local]].key, "created", expense_id)
+        touched.update(members)
+
+    # Claves repetidas dentro del mismo pedido: el resultado de la primera aparición
+    for index, entry in enumerate(entries):
+        if index not in results:
+            first = results[first_index[entry.key]]
+            status = "duplicate" if first["status"] == "created" else first["status"]
+            results[index] = _result(entry.key, status, first["expense_id"], first["detail"])
+    return [results[index] for index in range(len(entries))], touched
+
+
+def delete_item_sync_keys(db: Session, item_id: str):
+    db.execute(delete(SyncedExpenseKey).where(SyncedExpenseKey.item_id == item_id))
+
+
+def prune_sync_keys(db: Session) -> int:
+    """Borra las claves más viejas que la retención. Devuelve cuántas; no hace commit."""
+    cutoff = datetime.utcnow() - SYNC_KEY_RETENTION
+    return db.execute(delete(SyncedExpenseKey).where(SyncedExpenseKey.created_at < cutoff)).rowcount
@@ -0,0 +1,185 @@
+"""Modelos de lectura para los endpoints de consulta más usados.
+
+Filas inmutables con `__slots__` cargadas con `select()` de Core sobre las columnas que
+cada endpoint devuelve: sin identity map, sin estado de sesión por objeto ni carga
+perezosa de relaciones (p. ej. `item.owner` o `item.participants`, una consulta más por
+fila). Son solo lectura; los endpoints que escriben siguen usando los modelos ORM.
+Pydantic las valida igual que a los objetos ORM (`from_attributes`).
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import bindparam, literal, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from models import Item, ItemSummary, PendingInvitation, User, UserBalance, UserIncome, item_participants
+
+
+def _member_of(user_id: str):
+    """Condición "el usuario es owner o participante de Item"."""
+    return or_(
+        Item.owner_id == user_id,
+        Item.id.in_(select(item_participants.c.item_id).where(item_participants.c.user_id == user_id)),
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class ItemRow:
+    id: str
+    name: str
+    item_type: str
+    owner_id: str
+    owner_email: Optional[str]
+    is_archived: bool
+    is_recurring: bool
+    previous_item_id: Optional[str]
+    next_item_id: Optional[str]
+    created_at: datetime
+    data_version: int
+    is_member: bool
+
+
+def _item_select(user_id: str):
+    return select(
+        Item.id, Item.name, Item.item_type, Item.owner_id, User.email,
+        Item.is_archived, Item.is_recurring, Item.previous_item_id, Item.next_item_id, Item.created_at,
+        Item.data_version, _member_of(user_id),
+    ).outerjoin(User, User.id == Item.owner_id)
+
+
+def user_items(db: Session, user_id: str) -> List[ItemRow]:
+    """Items donde el usuario es owner o participante, los más nuevos primero."""
+    rows = db.execute(_item_select(user_id).where(_member_of(user_id)).order_by(Item.created_at.desc()))
+    return [ItemRow(*row) for row in rows]
+
+
+def item_row(db: Session, item_id: str, user_id: str) -> Optional[ItemRow]:
+    """El item con `is_member` para `user_id`, o None si no existe."""
+    row = db.execute(_item_select(user_id).where(Item.id == item_id)).first()
+    return ItemRow(*row) if row is not None else None
+
+
+@dataclass(frozen=True, slots=True)
+class ParticipantRow:
+    id: str
+    email: str
+    name: Optional[str]
+    is_pending: bool
+
+
+def _participants_select():
+    item_id = bindparam("item_id")
+    owner = (
+        select(User.id, User.email, User.name, literal(False).label("is_pending"), literal(0).label("rank"))
+        .join(Item, Item.owner_id == User.id)
+        .where(Item.id == item_id)
+    )
+    participants = (
+        select(User.id, User.email, User.name, literal(False), literal(1))
+        .join(item_participants, item_participants.c.user_id == User.id)
+        .join(Item, Item.id == item_participants.c.item_id)
+        .where(item_participants.c.item_id == item_id, User.id != Item.owner_id)
+    )
+    pending = (
+        select(PendingInvitation.id, PendingInvitation.email, literal(None), literal(True), literal(2))
+        .where(PendingInvitation.item_id == item_id)
+    )
+    rows = union_all(owner, participants, pending).subquery()
+    return select(rows.c.id, rows.c.email, rows.c.name, rows.c.is_pending).order_by(rows.c.rank)
+
+
+# Se arma una sola vez: la consulta solo cambia en el parámetro item_id
+_PARTICIPANTS = _participants_select()
+
+
+def item_participant_rows(db: Session, item_id: str) -> List[ParticipantRow]:
+    """Owner, participantes (sin repetir al owner) e invitaciones pendientes, en ese orden,
+    con una sola consulta."""
+    return [
+        ParticipantRow(participant_id, email, name, bool(is_pending))
+        for participant_id, email, name, is_pending in db.execute(_PARTICIPANTS, {"item_id": item_id})
+    ]
+
+
+@dataclass(frozen=True, slots=True)
+class IncomeRow:
+    id: str
+    user_id: str
+    income_type: str
+    amount: float
+    currency: str
+    description: Optional[str]
+    date: datetime
+    day_of_month: Optional[int]
+    end_date: Optional[datetime]
+    created_at: datetime
+
+
+def user_incomes(db: Session, user_id: str) -> List[IncomeRow]:
+    """Ingresos del usuario, los más nuevos primero."""
+    rows = db.execute(
+        select(
+            UserIncome.id, UserIncome.user_id, UserIncome.income_type, UserIncome.amount, UserIncome.currency,
+            UserIncome.description, UserIncome.date, UserIncome.day_of_month, UserIncome.end_date,
+            UserIncome.created_at,
+        )
+        .where(UserIncome.user_id == user_id)
+        .order_by(UserIncome.created_at.desc())
+    )
+    return [IncomeRow(*row) for row in rows]
+
+
+@dataclass(frozen=True, slots=True)
+class BalanceRow:
+    item_id: str
+    currency: str
+    share: float
+    owed_to_me: float
+    i_owe: float
+    share_pen: float
+    owed_to_me_pen: float
+    i_owe_pen: float
+    expense_count: int
+    owed_count: int
+    owe_count: int
+    item_name: str
+    item_type: str
+    owner_id: str
+
+
+def user_balance_rows(db: Session, user_id: str) -> List[BalanceRow]:
+    """Saldos del usuario en items no archivados, en el orden del detalle del capital."""
+    rows = db.execute(
+        select(
+            UserBalance.item_id, UserBalance.currency, UserBalance.share, UserBalance.owed_to_me,
+            UserBalance.i_owe, UserBalance.share_pen, UserBalance.owed_to_me_pen, UserBalance.i_owe_pen,
+            UserBalance.expense_count, UserBalance.owed_count, UserBalance.owe_count,
+            Item.name, Item.item_type, Item.owner_id,
+        )
+        .join(Item, Item.id == UserBalance.item_id)
+        .where(UserBalance.user_id == user_id, Item.is_archived.is_(False))
+        .order_by(Item.created_at, Item.id, UserBalance.currency)
+    )
+    return [BalanceRow(*row) for row in rows]
+
+
+@dataclass(frozen=True, slots=True)
+class SummaryRow:
+    item_id: str
+    generated_at: datetime
+    ai_model: Optional[str]
+    expenses_processed: int
+    categories_json: str
+    source_version: Optional[int]
+    categories_version: Optional[int]
+
+
+def item_summary_row(db: Session, item_id: str) -> Optional[SummaryRow]:
+    row = db.execute(
+        select(
+            ItemSummary.item_id, ItemSummary.generated_at, ItemSummary.ai_model, ItemSummary.expenses_processed,
+            ItemSummary.categories_json, ItemSummary.source_version, ItemSummary.categories_version,
+        ).where(ItemSummary.item_id == item_id)
+    ).first()
+    return SummaryRow(*row) if row is not None else None
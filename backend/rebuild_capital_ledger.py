@@ -0,0 +1,26 @@
+"""
+Regenera user_balances (saldos materializados del capital) desde expenses.
+
+Los endpoints mantienen user_balances con deltas; este script lo reconstruye
+completo, por ejemplo tras cargar gastos directamente en la base o si se
+sospecha que quedó desincronizado. Es idempotente.
+"""
+
+from database import SessionLocal, Base, engine
+from capital import rebuild_ledger
+
+def rebuild():
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        try:
+            print("Regenerando user_balances desde expenses...")
+            rows = rebuild_ledger(db)
+            db.commit()
+            print(f"✅ {rows} saldos escritos.")
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Error regenerando user_balances: {e}")
+            raise
+
+if __name__ == "__main__":
+    rebuild()
@@ -0,0 +1,49 @@
+"""
+Reclasifica con las palabras clave vigentes los gastos clasificados por reglas.
+
+Cambiar las palabras clave de una categoría no toca los gastos ya guardados; este
+script vuelve a aplicar las reglas a los gastos con ai_model = "rules-v1" (los
+manuales y los de IA se respetan), leyendo y escribiendo por lotes. Es idempotente.
+
+Uso: python reclassify_expenses.py [--item ITEM_ID | --user EMAIL_O_ID] [--chunk-size 1000]
+"""
+
+import argparse
+
+from database import SessionLocal, Base, engine
+from classification import reclassify_rules_expenses
+from models import User
+
+def reclassify(item_id=None, user=None, chunk_size=1000):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        try:
+            user_id = None
+            if user:
+                found = db.query(User).filter((User.id == user) | (User.email == user)).first()
+                if not found:
+                    raise ValueError(f"Usuario no encontrado: {user}")
+                user_id = found.id
+
+            def progress(stats):
+                print(f"  {stats['scanned']} gastos revisados, {stats['updated']} reclasificados "
+                      f"({stats['rows_per_second']:.0f} gastos/s)")
+
+            print("Reclasificando gastos rules-v1...")
+            stats = reclassify_rules_expenses(db, item_id=item_id, user_id=user_id,
+                                              chunk_size=chunk_size, progress=progress)
+            db.commit()
+            print(f"✅ {stats['updated']} de {stats['scanned']} gastos reclasificados en {stats['elapsed_ms']:.0f} ms.")
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Error reclasificando gastos: {e}")
+            raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--item", help="solo los gastos de este item")
+    scope.add_argument("--user", help="solo los gastos de los items de este usuario (email o id)")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+    reclassify(args.item, args.user, args.chunk_size)
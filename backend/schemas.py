@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
-from datetime import datetime
-from typing import Optional, List, Dict
+from datetime import datetime, date
+from typing import Any, Optional, List, Dict
 
 # User Schemas
 class UserCreate(BaseModel):
@@ -122,6 +122,7 @@ class ExpenseResponse(BaseModel):
     ai_confidence: Optional[float] = None
     ai_model: Optional[str] = None
     ai_classified_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -129,6 +130,86 @@ class ExpenseResponse(BaseModel):
             datetime: lambda v: v.strftime('%Y-%m-%dT%H:%M:%S') if v else None
         }
 
+class ExpenseBulkCreate(BaseModel):
+    # Sin validar acá: cada fila se valida con ExpenseCreate y las inválidas se informan por índice
+    expenses: List[Dict[str, Any]]
+
+class ExpenseBulkError(BaseModel):
+    index: int  # posición en `expenses` del pedido
+    detail: str
+
+class ExpenseBulkCreateResponse(BaseModel):
+    created: int
+    ids: List[str]  # de los gastos creados, en el orden del pedido
+    errors: List[ExpenseBulkError]
+
+class ExpenseSelection(BaseModel):
+    # Gastos del item sobre los que opera un cambio masivo: los de `ids` y/o los que
+    # cumplen todos los filtros indicados. Sin ids ni filtros no se selecciona nada.
+    ids: Optional[List[str]] = None
+    between: Optional[List[str]] = None  # dos user ids: gastos con deuda entre ellos (uno pagó, al otro le toca parte)
+    paid_by: Optional[str] = None
+    is_settled: Optional[bool] = None
+    category: Optional[str] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None  # inclusive
+
+class ExpenseBulkChanges(BaseModel):
+    payment_method: Optional[str] = None
+    split_type: Optional[str] = None
+    assigned_to: Optional[str] = None
+    selected_participants: Optional[List[str]] = None
+    is_settled: Optional[bool] = None
+
+class ExpenseBulkUpdate(BaseModel):
+    selection: ExpenseSelection
+    changes: ExpenseBulkChanges
+
+class ItemCurrencyTotal(BaseModel):
+    total_amount: float
+    expense_count: int
+
+class ItemCurrencyBalance(BaseModel):
+    share: float
+    owed_to_me: float
+    i_owe: float
+
+class ExpenseBulkResult(BaseModel):
+    affected: int
+    totals: Dict[str, ItemCurrencyTotal]  # del item, por moneda, después del cambio
+    balance: Dict[str, ItemCurrencyBalance]  # del usuario en el item, por moneda
+
+class OfflineSyncEntry(BaseModel):
+    key: str  # clave de idempotencia generada por el cliente al encolar el gasto
+    item_id: str
+    expense: Dict[str, Any]  # como ExpenseCreate; se valida por entrada
+
+class OfflineSyncRequest(BaseModel):
+    entries: List[OfflineSyncEntry]
+
+class OfflineSyncResult(BaseModel):
+    key: str
+    status: str  # "created", "duplicate" (la clave ya se había aplicado) o "error"
+    expense_id: Optional[str] = None
+    detail: Optional[str] = None
+
+class OfflineSyncResponse(BaseModel):
+    results: List[OfflineSyncResult]  # en el orden de `entries`
+
+class ExpenseChangesResponse(BaseModel):
+    expenses: List[ExpenseResponse]  # creados o modificados desde `since`
+    deleted: List[str]  # ids de gastos borrados desde `since`
+    item_changed: bool  # el item o sus participantes cambiaron: volver a pedirlos
+    full_resync: bool  # `since` es anterior a la retención: volver a pedir el listado completo
+    watermark: str  # `since` del próximo pedido
+
+class DuplicateExpenseGroup(BaseModel):
+    description_normalized: str
+    amount: float
+    currency: str
+    date: str  # YYYY-MM-DD
+    expenses: List[ExpenseResponse]
+
 # Category Schemas
 class CategoryCreate(BaseModel):
     name: str
@@ -149,6 +230,13 @@ class CategoryResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ReclassifyResponse(BaseModel):
+    scanned: int
+    updated: int
+    chunks: int
+    elapsed_ms: float
+    rows_per_second: float
+
 # User Item Budget Schemas
 class UserItemBudgetBase(BaseModel):
     budget_soles: float = 0.0
@@ -183,6 +271,34 @@ class ItemSummaryResponse(BaseModel):
     categories_by_currency: Dict[str, List[ItemSummaryCategoryStat]]
 
 
+class ItemTrendMonth(BaseModel):
+    item_id: str
+    name: str
+    created_at: Optional[datetime] = None
+
+
+class ItemTrendCategory(BaseModel):
+    category: str
+    totals: List[float]  # un valor por mes, en el orden de `months`
+    expense_counts: List[int]
+    total_amount: float
+
+
+class ItemTrendResponse(BaseModel):
+    item_id: str
+    months: List[ItemTrendMonth]  # del más antiguo al más reciente
+    categories_by_currency: Dict[str, List[ItemTrendCategory]]
+
+
+class ItemTotalsResponse(BaseModel):
+    item_id: str
+    currency: str  # moneda destino ("soles" o "dolares")
+    total: float
+    expense_count: int
+    unpriced_count: int = 0  # gastos sin tipo de cambio conocido, fuera de los montos
+    by_category: List[ItemSummaryCategoryStat]
+
+
 # Personal Capital Schemas
 class UserIncomeCreate(BaseModel):
     income_type: str  # "periodic" o "one_time"
@@ -244,3 +360,12 @@ class CapitalResponse(BaseModel):
     i_owe: Dict[str, float] = {}
     incomes: List[UserIncomeResponse]
     detail: CapitalDetail
+
+class CapitalPoint(BaseModel):
+    date: date
+    by_currency: Dict[str, float]
+
+class CapitalSeriesResponse(BaseModel):
+    start: date
+    end: date
+    points: List[CapitalPoint]
@@ -0,0 +1,100 @@
+"""Serialización rápida de los listados grandes (gastos, items, categorías).
+
+Los endpoints de listado leen tuplas de columnas con Core (sin objetos ORM) y arman
+los dicts de salida a mano, con los mismos campos y formatos que sus schemas de
+respuesta, en vez de validar cada fila con Pydantic (`from_attributes`). El JSON se
+codifica con orjson (dependencia en requirements.txt); el `json` de la biblioteca
+estándar queda solo como respaldo para entornos de desarrollo sin él. La respuesta se comprime con gzip a partir de
+GZIP_MIN_BYTES (ver el middleware en main.py).
+
+Fechas: los gastos usan '%Y-%m-%dT%H:%M:%S' (como `ExpenseResponse.json_encoders`);
+items y categorías el isoformat completo, con microsegundos, igual que Pydantic.
+"""
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import Response
+
+from models import Category, Expense
+from schemas import CategoryResponse, ExpenseResponse
+
+try:
+    import orjson
+except ImportError:  # solo en desarrollo: requirements.txt lo instala
+    orjson = None
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(payload, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=dumps(payload), media_type="application/json", headers=headers)
+
+
+def _seconds(value: Optional[datetime]) -> Optional[str]:
+    # Las columnas son DateTime sin zona: isoformat en segundos == '%Y-%m-%dT%H:%M:%S'
+    return value.isoformat(timespec="seconds") if value is not None else None
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _defaults(schema, fields) -> List:
+    """(posición, default) de los campos con default distinto de None en el schema (p. ej.
+    los booleanos en False), para reemplazar NULLs igual que lo haría el schema."""
+    return [
+        (index, schema.model_fields[name].default) for index, name in enumerate(fields)
+        if not schema.model_fields[name].is_required() and schema.model_fields[name].default is not None
+    ]
+
+
+EXPENSE_FIELDS = tuple(ExpenseResponse.model_fields)
+EXPENSE_COLUMNS = tuple(getattr(Expense, name) for name in EXPENSE_FIELDS)
+_EXPENSE_DATETIMES = tuple(
+    index for index, name in enumerate(EXPENSE_FIELDS) if name in ("date", "created_at", "ai_classified_at", "updated_at")
+)
+_EXPENSE_DEFAULTS = _defaults(ExpenseResponse, EXPENSE_FIELDS)
+
+
+def expense_dicts(rows: Iterable[tuple]) -> List[Dict]:
+    """Filas de `EXPENSE_COLUMNS` con la forma de `ExpenseResponse`."""
+    fields, datetimes, defaults = EXPENSE_FIELDS, _EXPENSE_DATETIMES, _EXPENSE_DEFAULTS
+    result = []
+    for row in rows:
+        values = list(row)
+        for index in datetimes:
+            values[index] = _seconds(values[index])
+        for index, default in defaults:
+            if values[index] is None:
+                values[index] = default
+        result.append(dict(zip(fields, values)))
+    return result
+
+
+CATEGORY_FIELDS = tuple(CategoryResponse.model_fields)
+CATEGORY_COLUMNS = tuple(getattr(Category, name) for name in CATEGORY_FIELDS)
+
+
+def category_dicts(rows: Iterable[tuple]) -> List[Dict]:
+    return [{**dict(zip(CATEGORY_FIELDS, row)), "created_at": _iso(row.created_at)} for row in rows]
+
+
+def item_dict(row) -> Dict:
+    """Fila con las columnas de `ItemResponse` (incluido owner_email) como dict."""
+    return {
+        "id": row.id,
+        "name": row.name,
+        "item_type": row.item_type,
+        "owner_id": row.owner_id,
+        "owner_email": row.owner_email,
+        "is_archived": row.is_archived,
+        "is_recurring": bool(row.is_recurring),
+        "previous_item_id": row.previous_item_id,
+        "next_item_id": row.next_item_id,
+        "created_at": _iso(row.created_at),
+    }
@@ -0,0 +1,284 @@
+"""Resumen por item: contadores incrementales y frescura del snapshot (`item_summaries`).
+
+`item_category_totals` guarda total y cantidad de gastos por item/moneda/categoría. Las
+escrituras de gastos restan la contribución anterior del gasto y suman la nueva
+(`update_summary_for_expense`), así que el resumen se arma leyendo unas pocas filas, sin
+recorrer `expenses`. `item_totals_query` lo recalcula desde cero con un GROUP BY:
+`rebuild_item_totals` lo usa cuando cambian muchos gastos a la vez y
+`verify_item_totals` para detectar diferencias.
+
+Cada item tiene un `data_version` que incrementan, dentro de su transacción, todas las
+escrituras que cambian lo que el resumen cuenta (gastos creados, editados, borrados o
+recategorizados). El resumen guarda la versión del item y la de las categorías con las
+que se generó: mientras coincidan, GET /summary lo sirve tal cual, sin escribir nada.
+
+Cuando está vencido se regenera una sola vez por item aunque haya varios lectores a la
+vez: un lock por item dentro del proceso y, en PostgreSQL, `SELECT ... FOR UPDATE` sobre
+la fila del item entre workers. Quien espera vuelve a mirar las versiones antes de
+regenerar y, si otro ya lo hizo, usa ese resultado."""
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, true, union_all, update
+from sqlalchemy.orm import Session
+
+from capital import item_members_subquery
+from models import Expense, Item, ItemCategoryTotal, ItemSummary
+
+
+def bump_item_versions(db: Session, item_ids: Iterable[str]):
+    """Marca los items como modificados; se confirma con la transacción de `db`."""
+    ids = list(set(item_ids))
+    for start in range(0, len(ids), 1000):
+        db.execute(
+            update(Item)
+            .where(Item.id.in_(ids[start:start + 1000]))
+            # Solo cambian sus gastos: Item.updated_at queda para el item y sus participantes
+            .values(data_version=Item.data_version + 1, updated_at=Item.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def summary_is_fresh(summary: Optional[ItemSummary], item_version: int, categories_version: int) -> bool:
+    return (
+        summary is not None
+        and summary.source_version == item_version
+        and summary.categories_version == categories_version
+    )
+
+
+class SummaryLocks:
+    """Un lock por item para que la regeneración sea single-flight dentro del proceso."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._users = {}
+
+    @contextmanager
+    def hold(self, item_id: str):
+        with self._lock:
+            lock = self._locks.setdefault(item_id, threading.Lock())
+            self._users[item_id] = self._users.get(item_id, 0) + 1
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                self._users[item_id] -= 1
+                if not self._users[item_id]:
+                    del self._users[item_id]
+                    del self._locks[item_id]
+
+
+summary_locks = SummaryLocks()
+
+
+def lock_item_for_summary(db: Session, item_id: str) -> int:
+    """Versión actual del item, leída con la fila bloqueada hasta el commit (PostgreSQL;
+    en SQLite `FOR UPDATE` no aplica y alcanza con el lock del proceso)."""
+    return db.query(Item.data_version).filter(Item.id == item_id).with_for_update().scalar() or 0
+
+
+# ============= CONTADORES =============
+
+# Copia de los campos de un gasto que cuentan en el resumen, tomada antes de modificarlo
+# para poder restar su contribución anterior.
+ExpenseSummaryState = namedtuple("ExpenseSummaryState", ["currency", "category", "amount"])
+
+
+def expense_summary_state(expense) -> ExpenseSummaryState:
+    return ExpenseSummaryState(expense.currency or "soles", expense.ai_category or "", float(expense.amount or 0.0))
+
+
+def add_summary_delta(deltas: Dict, item_id: str, state: ExpenseSummaryState, sign: int = 1) -> Dict:
+    """Acumula en `deltas[(item_id, currency, category)]` la contribución de un gasto.
+    `sign=-1` la resta."""
+    row = deltas.setdefault((item_id, state.currency, state.category), [0.0, 0])
+    row[0] += sign * state.amount
+    row[1] += sign
+    return deltas
+
+
+def apply_summary_deltas(db: Session, deltas: Dict):
+    """Suma los deltas con UPDATE ... SET x = x + :delta (atómico frente a escrituras
+    concurrentes); inserta la fila si todavía no existía. Incrementa la versión de los
+    items tocados para que su snapshot en `item_summaries` se regenere."""
+    now = datetime.utcnow()
+    for (item_id, currency, category), (amount, count) in deltas.items():
+        if not amount and not count:
+            continue
+        result = db.execute(
+            update(ItemCategoryTotal)
+            .where(
+                ItemCategoryTotal.item_id == item_id,
+                ItemCategoryTotal.currency == currency,
+                ItemCategoryTotal.category == category,
+            )
+            .values(
+                total_amount=ItemCategoryTotal.total_amount + amount,
+                expense_count=ItemCategoryTotal.expense_count + count,
+                updated_at=now,
+            )
+        )
+        if result.rowcount == 0:
+            db.execute(insert(ItemCategoryTotal).values(
+                item_id=item_id, currency=currency, category=category,
+                total_amount=amount, expense_count=count, updated_at=now,
+            ))
+    bump_item_versions(db, (item_id for item_id, _, _ in deltas))
+
+
+def update_summary_for_expense(db: Session, item_id: str, before: Optional[ExpenseSummaryState] = None,
+                               after: Optional[Expense] = None):
+    """Resta la contribución anterior del gasto (`before`) y suma la nueva (`after`).
+    Crear: solo `after`; borrar: solo `before`; editar/recategorizar: ambos."""
+    deltas: Dict = {}
+    if before is not None:
+        add_summary_delta(deltas, item_id, before, sign=-1)
+    if after is not None:
+        add_summary_delta(deltas, item_id, expense_summary_state(after))
+    apply_summary_deltas(db, deltas)
+
+
+def move_category_totals(db: Session, old: str, new: str):
+    """Pasa los contadores de la categoría `old` a `new` en todos los items (renombrar o
+    borrar una categoría, después de reasignar los gastos)."""
+    rows = db.execute(
+        select(ItemCategoryTotal.item_id, ItemCategoryTotal.currency,
+               ItemCategoryTotal.total_amount, ItemCategoryTotal.expense_count)
+        .where(ItemCategoryTotal.category == old)
+    ).all()
+    db.execute(delete(ItemCategoryTotal).where(ItemCategoryTotal.category == old))
+    apply_summary_deltas(db, {(item_id, currency, new): [amount, count] for item_id, currency, amount, count in rows})
+
+
+def item_totals_query(item_ids: Optional[List[str]] = None):
+    """Contadores calculados desde `expenses`: (item_id, currency, category, total, count)."""
+    currency = func.coalesce(Expense.currency, "soles")
+    category = func.coalesce(Expense.ai_category, "")
+    query = select(
+        Expense.item_id, currency.label("currency"), category.label("category"),
+        func.coalesce(func.sum(Expense.amount), 0.0).label("total_amount"),
+        func.count(Expense.id).label("expense_count"),
+    ).group_by(Expense.item_id, currency, category)
+    if item_ids is not None:
+        query = query.where(Expense.item_id.in_(item_ids))
+    return query
+
+
+def rebuild_item_totals(db: Session, item_ids: Optional[Iterable[str]] = None) -> int:
+    """Regenera los contadores de los items indicados (o de todos) desde `expenses`.
+    Devuelve las filas escritas; no hace commit."""
+    db.flush()
+    ids = None if item_ids is None else list(set(item_ids))
+    if ids == []:
+        return 0
+    stmt = delete(ItemCategoryTotal)
+    if ids is not None:
+        stmt = stmt.where(ItemCategoryTotal.item_id.in_(ids))
+    db.execute(stmt)
+    rows = item_totals_query(ids).subquery()
+    db.execute(insert(ItemCategoryTotal).from_select(
+        ["item_id", "currency", "category", "total_amount", "expense_count", "updated_at"],
+        select(rows.c.item_id, rows.c.currency, rows.c.category, rows.c.total_amount,
+               rows.c.expense_count, literal(datetime.utcnow())),
+    ))
+    written = db.query(ItemCategoryTotal)
+    if ids is not None:
+        bump_item_versions(db, ids)
+        written = written.filter(ItemCategoryTotal.item_id.in_(ids))
+    else:
+        db.execute(update(Item).values(data_version=Item.data_version + 1, updated_at=Item.updated_at))
+    return written.count()
+
+
+def delete_item_totals(db: Session, item_id: str):
+    db.execute(delete(ItemCategoryTotal).where(ItemCategoryTotal.item_id == item_id))
+
+
+def verify_item_totals(db: Session, tolerance: float = 0.005) -> List[Dict]:
+    """Compara los contadores guardados contra los recalculados desde `expenses` y
+    devuelve una fila por item/moneda/categoría que difiere (las filas en cero no cuentan)."""
+    stored = {
+        (item_id, currency, category): (amount, count)
+        for item_id, currency, category, amount, count in db.execute(select(
+            ItemCategoryTotal.item_id, ItemCategoryTotal.currency, ItemCategoryTotal.category,
+            ItemCategoryTotal.total_amount, ItemCategoryTotal.expense_count,
+        ))
+        if count or abs(amount) > tolerance
+    }
+    actual = {
+        (item_id, currency, category): (amount, count)
+        for item_id, currency, category, amount, count in db.execute(item_totals_query())
+    }
+    drift = []
+    for key in sorted(stored.keys() | actual.keys()):
+        stored_amount, stored_count = stored.get(key, (0.0, 0))
+        actual_amount, actual_count = actual.get(key, (0.0, 0))
+        if stored_count != actual_count or abs(stored_amount - actual_amount) > tolerance:
+            drift.append({
+                "item_id": key[0], "currency": key[1], "category": key[2],
+                "stored_amount": round(stored_amount, 2), "actual_amount": round(actual_amount, 2),
+                "stored_count": stored_count, "actual_count": actual_count,
+            })
+    return drift
+
+
+# ============= TENDENCIA MENSUAL =============
+
+def item_chain_cte(item_id: str, max_depth: int = 600):
+    """Items de la cadena mensual de `item_id` con su posición relativa (0 el propio,
+    negativos los meses anteriores, positivos los siguientes), en un solo WITH RECURSIVE.
+
+    Arranca dos veces desde el item, una hacia atrás (por `previous_item_id` del actual,
+    clave primaria) y otra hacia adelante (items cuyo `previous_item_id` es el actual,
+    índice `ix_items_previous_item_id`). `max_depth` corta cadenas mal enlazadas (ciclos)."""
+    directions = union_all(
+        select(literal(-1).label("direction")), select(literal(1).label("direction")),
+    ).subquery("directions")
+    anchor = (
+        select(Item.id, Item.previous_item_id, literal(0).label("position"), directions.c.direction)
+        .join(directions, true())
+        .where(Item.id == item_id)
+        .cte("item_chain", recursive=True)
+    )
+    step = select(
+        Item.id, Item.previous_item_id, anchor.c.position + anchor.c.direction, anchor.c.direction,
+    ).join(anchor, or_(
+        and_(anchor.c.direction == -1, Item.id == anchor.c.previous_item_id),
+        and_(anchor.c.direction == 1, Item.previous_item_id == anchor.c.id),
+    )).where(func.abs(anchor.c.position) < max_depth)
+    return anchor.union_all(step)
+
+
+def item_chain_trend(db: Session, item_id: str, user_id: str):
+    """(months, rows) de la cadena de `item_id` visibles para `user_id`: months son
+    (item_id, nombre, created_at) del más antiguo al más reciente y rows
+    (item_id, currency, category, total, count) sumados en SQL desde `item_category_totals`."""
+    chain = item_chain_cte(item_id)
+    members = item_members_subquery()
+    visible = (
+        select(chain.c.id, chain.c.position)
+        .join(members, and_(members.c.item_id == chain.c.id, members.c.user_id == user_id))
+        .distinct()
+        .subquery("visible_chain")
+    )
+    months = db.execute(
+        select(Item.id, Item.name, Item.created_at)
+        .join(visible, visible.c.id == Item.id)
+        .order_by(visible.c.position)
+    ).all()
+    rows = db.execute(
+        select(
+            ItemCategoryTotal.item_id, ItemCategoryTotal.currency, ItemCategoryTotal.category,
+            func.sum(ItemCategoryTotal.total_amount), func.sum(ItemCategoryTotal.expense_count),
+        )
+        .join(visible, visible.c.id == ItemCategoryTotal.item_id)
+        .where(ItemCategoryTotal.expense_count > 0)
+        .group_by(ItemCategoryTotal.item_id, ItemCategoryTotal.currency, ItemCategoryTotal.category)
+    ).all()
+    return months, rows
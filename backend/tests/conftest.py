@@ -11,18 +11,28 @@ os.environ["DATABASE_URL"] = f"sqlite:///{_TEST_DB_PATH}"
 os.environ["SECRET_KEY"] = "test-secret-key"
 os.environ["ENVIRONMENT"] = "development"
 os.environ.setdefault("OPENAI_API_KEY", "")
+os.environ["EXCHANGE_RATE_REFRESH"] = "false"
+os.environ["LOCAL_CLASSIFIER_PATH"] = _TEST_DB_PATH + ".classifier.json.gz"
 
 import pytest  # noqa: E402
 from fastapi.testclient import TestClient  # noqa: E402
 
 from main import app, engine, seed_categories  # noqa: E402
 from database import Base, SessionLocal  # noqa: E402
+from exchange_rates import rate_store  # noqa: E402
+from local_classifier import local_classifier  # noqa: E402
+from llm_classifier import llm_classifier  # noqa: E402
 
 
 @pytest.fixture(autouse=True)
 def _reset_db():
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    rate_store.clear()
+    local_classifier.set_model(None)
+    local_classifier.reset_stats()
+    llm_classifier.cache.clear()
+    llm_classifier.reset_stats()
     with SessionLocal() as db:
         seed_categories(db)
     yield
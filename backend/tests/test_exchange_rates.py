@@ -0,0 +1,293 @@
+import json
+import threading
+import time
+from datetime import date, datetime
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+
+from database import SessionLocal
+from exchange_rates import (
+    ExchangeRateRefresher, FileRateProvider, HttpRateProvider, RateProvider,
+    backfill_expense_rates, exchange_rate_refresher, fetch_metrics, get_exchange_rates_to_pen,
+    rate_on, rate_store,
+)
+from main import reprice_after_rates_saved
+from models import ExchangeRate, Expense, Item, User
+
+
+class _FailingProvider(RateProvider):
+    name = "failing"
+
+    def fetch(self):
+        raise ConnectionError("sin red")
+
+
+class _SlowProvider(RateProvider):
+    name = "slow"
+
+    def __init__(self):
+        self.calls = 0
+
+    def fetch(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return {date.today(): {"dolares": 3.9, "reales": 0.7}}
+
+
+def _write_rates(tmp_path, data):
+    path = tmp_path / "rates.json"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return str(path)
+
+
+# ---- Proveedores ----
+
+def test_file_provider_reads_today_rates(tmp_path):
+    provider = FileRateProvider(_write_rates(tmp_path, {"dolares": 3.7, "reales": 0.65}))
+    assert provider.fetch() == {date.today(): {"dolares": 3.7, "reales": 0.65}}
+
+
+def test_file_provider_reads_historical_rates(tmp_path):
+    provider = FileRateProvider(_write_rates(tmp_path, {
+        "2026-08-01": {"dolares": 3.6, "reales": 0.66},
+        "2026-08-02": {"dolares": 3.61, "reales": 0.67},
+    }))
+    rates = provider.fetch()
+    assert rates[date(2026, 8, 2)] == {"dolares": 3.61, "reales": 0.67}
+
+
+# ---- Lectura sin red ----
+
+def test_handler_never_calls_network(client, auth_headers):
+    headers = auth_headers()
+    with patch.object(HttpRateProvider, "fetch", side_effect=AssertionError("no debe salir a la red")):
+        r = client.get("/api/exchange-rates", headers=headers)
+    assert r.status_code == 503
+
+
+def test_handler_reads_rates_stored_by_another_worker(client, auth_headers, db):
+    headers = auth_headers()
+    db.add_all([
+        ExchangeRate(rate_date=date(2026, 8, 1), currency="dolares", rate_to_pen=3.5, source="file"),
+        ExchangeRate(rate_date=date(2026, 8, 1), currency="reales", rate_to_pen=0.6, source="file"),
+    ])
+    db.commit()
+
+    r = client.get("/api/exchange-rates", headers=headers)
+    assert r.status_code == 200
+    assert r.json() == {"dolares": 3.5, "reales": 0.6}
+
+
+def test_refresher_persists_provider_rates(tmp_path):
+    refresher = ExchangeRateRefresher(SessionLocal, FileRateProvider(_write_rates(tmp_path, {"dolares": 3.8, "reales": 0.7})))
+    assert refresher.refresh_once() is True
+
+    rate_store.clear()
+    with SessionLocal() as db:
+        assert db.query(ExchangeRate).count() == 2
+        assert get_exchange_rates_to_pen(db) == {"dolares": 3.8, "reales": 0.7}
+
+
+def test_refresher_failure_keeps_last_known_rates(tmp_path):
+    ExchangeRateRefresher(SessionLocal, FileRateProvider(_write_rates(tmp_path, {
+        "2026-08-01": {"dolares": 3.5, "reales": 0.6},
+    }))).refresh_once()
+
+    assert ExchangeRateRefresher(SessionLocal, _FailingProvider()).refresh_once() is False
+    assert get_exchange_rates_to_pen() == {"dolares": 3.5, "reales": 0.6}
+
+
+def test_no_rates_anywhere_returns_503(db):
+    with pytest.raises(HTTPException) as exc_info:
+        get_exchange_rates_to_pen(db)
+    assert exc_info.value.status_code == 503
+
+
+def test_capital_convert_uses_stored_rates(client, auth_headers, tmp_path):
+    headers = auth_headers()
+    ExchangeRateRefresher(SessionLocal, FileRateProvider(_write_rates(tmp_path, {"dolares": 4.0, "reales": 0.5}))).refresh_once()
+    client.post("/api/capital/incomes", json={"income_type": "one_time", "amount": 100, "currency": "dolares"}, headers=headers)
+    client.post("/api/capital/incomes", json={"income_type": "one_time", "amount": 100, "currency": "soles"}, headers=headers)
+
+    r = client.get("/api/capital?convert=soles", headers=headers)
+    assert r.json()["by_currency"] == {"soles": 500.0}
+
+
+# ---- Tipo histórico por gasto ----
+
+_HISTORY = {
+    "2026-01-15": {"dolares": 3.5, "reales": 0.6},
+    "2026-06-01": {"dolares": 4.0, "reales": 0.8},
+}
+
+
+def _save_history(db):
+    rate_store.save(db, {date.fromisoformat(d): r for d, r in _HISTORY.items()}, "file")
+
+
+def _create_item(client, headers, name="Viaje"):
+    return client.post("/api/items", json={"name": name, "item_type": "personal"}, headers=headers).json()["id"]
+
+
+def test_rate_on_uses_latest_rate_on_or_before_the_day(db):
+    _save_history(db)
+    assert rate_on(db, "soles", date(2020, 1, 1)) == 1.0
+    assert rate_on(db, "dolares", date(2026, 3, 10)) == 3.5
+    assert rate_on(db, "dolares", date(2026, 6, 1)) == 4.0
+    # Más antiguo que la historia: el primer tipo conocido
+    assert rate_on(db, "dolares", date(2025, 12, 31)) == 3.5
+
+
+def test_expense_records_rate_of_its_date(client, auth_headers, db):
+    headers = auth_headers()
+    _save_history(db)
+    item_id = _create_item(client, headers)
+    r = client.post(f"/api/items/{item_id}/expenses", json={
+        "amount": 10, "description": "hotel", "payment_method": "banco", "currency": "dolares",
+        "date": "2026-03-10T12:00",
+    }, headers=headers)
+    expense_id = r.json()["id"]
+    assert db.get(Expense, expense_id).pen_rate == 3.5
+
+    client.put(f"/api/items/{item_id}/expenses/{expense_id}", json={"date": "2026-07-01T09:00"}, headers=headers)
+    db.expire_all()
+    assert db.get(Expense, expense_id).pen_rate == 4.0
+
+
+def test_item_totals_and_capital_convert_at_historical_rates(client, auth_headers, db):
+    headers = auth_headers()
+    _save_history(db)
+    item_id = _create_item(client, headers)
+    for amount, currency, day, description in [
+        (10, "dolares", "2026-02-01T10:00", "hotel"),      # 35 soles
+        (10, "dolares", "2026-06-15T10:00", "hotel"),      # 40 soles
+        (20, "soles", "2026-06-15T10:00", "supermercado"),
+    ]:
+        client.post(f"/api/items/{item_id}/expenses", json={
+            "amount": amount, "description": description, "payment_method": "banco",
+            "currency": currency, "date": day,
+        }, headers=headers)
+
+    totals = client.get(f"/api/items/{item_id}/totals?convert=soles", headers=headers).json()
+    assert totals["total"] == 95.0
+    assert totals["expense_count"] == 3
+    assert {row["category"]: row["total_amount"] for row in totals["by_category"]} == {
+        "viajes": 75.0, "supermercado": 20.0,
+    }
+    # Dólares: el total en soles al tipo del día (el último guardado)
+    totals_usd = client.get(f"/api/items/{item_id}/totals?convert=dolares", headers=headers).json()
+    assert totals_usd["total"] == round(95.0 / 4.0, 2)
+
+    client.post("/api/capital/incomes", json={"income_type": "one_time", "amount": 100, "currency": "dolares"}, headers=headers)
+    capital = client.get("/api/capital?convert=soles", headers=headers).json()
+    assert capital["by_currency"] == {"soles": 400.0 - 95.0}
+
+
+def test_backfill_fills_missing_rates(db):
+    _save_history(db)
+    user = User(email="b@test.com", name="B", hashed_password="x")
+    db.add(user)
+    db.flush()
+    item = Item(name="Viejo", item_type="personal", owner_id=user.id)
+    db.add(item)
+    db.flush()
+    def expense(currency, day):
+        return Expense(item_id=item.id, amount=10, description="x", payment_method="banco",
+                       currency=currency, paid_by=user.id, date=day)
+
+    old = expense("dolares", datetime(2026, 3, 1, 12, 0))
+    ancient = expense("reales", datetime(2024, 1, 1, 12, 0))
+    local = expense("soles", datetime(2026, 3, 1, 12, 0))
+    db.add_all([old, ancient, local])
+    db.commit()
+
+    assert backfill_expense_rates(db) == 3
+    db.commit()
+    db.expire_all()
+    assert (old.pen_rate, ancient.pen_rate, local.pen_rate) == (3.5, 0.6, 1.0)
+    assert backfill_expense_rates(db) == 0
+
+
+# ---- Single-flight y stale-while-revalidate ----
+
+def test_concurrent_refreshes_make_a_single_fetch():
+    fetch_metrics.reset()
+    provider = _SlowProvider()
+    refresher = ExchangeRateRefresher(SessionLocal, provider)
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(refresher.refresh_once())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert provider.calls == 1
+    assert results == [True] * 8
+    stats = fetch_metrics.stats()
+    assert stats["fetches"] == 1
+    assert stats["coalesced"] >= 1
+    assert stats["last_latency_ms"] >= 200
+
+
+def test_stale_rates_are_served_and_trigger_a_refresh(tmp_path):
+    fetch_metrics.reset()
+    ExchangeRateRefresher(SessionLocal, FileRateProvider(_write_rates(tmp_path, {
+        "2020-01-01": {"dolares": 3.3, "reales": 0.8},
+    }))).refresh_once()
+
+    with patch.object(exchange_rate_refresher, "wake") as wake:
+        assert get_exchange_rates_to_pen() == {"dolares": 3.3, "reales": 0.8}
+    wake.assert_called_once()
+    assert fetch_metrics.stats()["stale_served"] == 1
+
+
+def test_failed_fetch_is_counted_in_metrics(client, auth_headers):
+    fetch_metrics.reset()
+    ExchangeRateRefresher(SessionLocal, _FailingProvider()).refresh_once()
+
+    metrics = client.get("/api/metrics", headers=auth_headers()).json()["exchange_rates"]
+    assert metrics["failures"] == 1
+    assert metrics["last_error"] == "sin red"
+
+
+# ---- Gastos sin tipo conocido ----
+
+def test_expense_created_without_rates_is_repriced_after_first_save(client, auth_headers, db, tmp_path):
+    headers = auth_headers()
+    item_id = _create_item(client, headers)
+    r = client.post(f"/api/items/{item_id}/expenses", json={
+        "amount": 10, "description": "hotel", "payment_method": "banco", "currency": "dolares",
+    }, headers=headers)
+    expense_id = r.json()["id"]
+    assert db.get(Expense, expense_id).pen_rate is None
+
+    refresher = ExchangeRateRefresher(
+        SessionLocal, FileRateProvider(_write_rates(tmp_path, {"dolares": 4.0, "reales": 0.7})),
+        after_save=reprice_after_rates_saved,
+    )
+    assert refresher.refresh_once() is True
+    db.expire_all()
+    assert db.get(Expense, expense_id).pen_rate == 4.0
+
+    capital = client.get("/api/capital?convert=soles", headers=headers).json()
+    totals = client.get(f"/api/items/{item_id}/totals?convert=soles", headers=headers).json()
+    assert capital["by_currency"] == {"soles": -40.0}
+    assert totals["total"] == 40.0
+
+
+def test_currency_without_rate_is_flagged_not_priced_at_par(client, auth_headers, db):
+    headers = auth_headers()
+    rate_store.save(db, {date(2026, 6, 1): {"dolares": 4.0}}, "file")
+    item_id = _create_item(client, headers)
+    for amount, currency in [(10, "reales"), (20, "soles")]:
+        client.post(f"/api/items/{item_id}/expenses", json={
+            "amount": amount, "description": "compra", "payment_method": "banco", "currency": currency,
+        }, headers=headers)
+
+    totals = client.get(f"/api/items/{item_id}/totals?convert=soles", headers=headers).json()
+    assert (totals["total"], totals["expense_count"], totals["unpriced_count"]) == (20.0, 2, 1)
+    capital = client.get("/api/capital?convert=soles", headers=headers).json()
+    assert capital["by_currency"] == {"soles": -20.0}
@@ -1,3 +1,8 @@
+from classification import reclassify_rules_expenses
+from models import Expense
+from summaries import rebuild_item_totals, verify_item_totals
+
+
 def _expense_payload(**overrides):
     payload = {
         "amount": 50.0,
@@ -193,6 +198,28 @@ def test_next_month_carries_recurring_expense_indefinitely(client, auth_headers)
     assert third_expenses[0]["description"] == "Netflix"
 
 
+def test_trend_covers_the_whole_monthly_chain_from_any_item(client, auth_headers):
+    headers = auth_headers()
+    first = client.post("/api/items", json={"name": "Agosto 2026", "item_type": "personal", "is_recurring": True}, headers=headers).json()["id"]
+    client.post(f"/api/items/{first}/expenses", json=_expense_payload(description="Netflix", amount=45, is_recurring=True), headers=headers)
+    client.post(f"/api/items/{first}/expenses", json=_expense_payload(description="Uber", amount=10), headers=headers)
+    second = client.post(f"/api/items/{first}/next-month", headers=headers).json()["id"]
+    client.post(f"/api/items/{second}/expenses", json=_expense_payload(description="Uber", amount=20, currency="dolares"), headers=headers)
+    third = client.post(f"/api/items/{second}/next-month", headers=headers).json()["id"]
+
+    body = client.get(f"/api/items/{second}/trend", headers=headers).json()
+    assert [m["item_id"] for m in body["months"]] == [first, second, third]
+    assert [m["name"] for m in body["months"]] == ["Agosto 2026", "Setiembre 2026", "Octubre 2026"]
+    soles = {row["category"]: row for row in body["categories_by_currency"]["soles"]}
+    netflix = next(row for row in soles.values() if row["totals"] == [45.0, 45.0, 45.0])
+    assert netflix["total_amount"] == 135.0 and netflix["expense_counts"] == [1, 1, 1]
+    assert soles["transporte"]["totals"] == [10.0, 0.0, 0.0]
+    assert body["categories_by_currency"]["dolares"][0]["totals"] == [0.0, 20.0, 0.0]
+
+    other = auth_headers(email="otro@test.com")
+    assert client.get(f"/api/items/{second}/trend", headers=other).status_code == 403
+
+
 def test_next_month_blocks_second_call(client, auth_headers):
     headers = auth_headers()
     item_id = client.post("/api/items", json={"name": "Agosto 2026", "item_type": "personal", "is_recurring": True}, headers=headers).json()["id"]
@@ -273,6 +300,70 @@ def test_default_category_cannot_be_renamed_or_deleted(client, auth_headers):
     assert client.delete(f"/api/categories/{otros['id']}", headers=headers).status_code == 400
 
 
+def test_expense_search_and_duplicates_use_normalized_description(client, auth_headers, db):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    day = "2026-05-04T10:00"
+    first = client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="Clínica  San Pablo", date=day), headers=headers).json()
+    second = client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="clinica san pablo", date=day), headers=headers).json()
+    client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="Café", date=day), headers=headers)
+    client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="clinica san pablo", amount=10, date=day), headers=headers)
+
+    assert first["ai_category"] == "salud"
+    found = client.get(f"/api/items/{item_id}/expenses", params={"q": "CLINICA"}, headers=headers).json()
+    assert len(found) == 3
+    assert [e["description"] for e in client.get(f"/api/items/{item_id}/expenses", params={"q": "cafe"}, headers=headers).json()] == ["Café"]
+    assert client.get(f"/api/items/{item_id}/expenses", params={"q": "100%"}, headers=headers).json() == []
+
+    groups = client.get(f"/api/items/{item_id}/expenses/duplicates", headers=headers).json()
+    assert len(groups) == 1
+    assert groups[0]["description_normalized"] == "clinica san pablo" and groups[0]["date"] == "2026-05-04"
+    assert {e["id"] for e in groups[0]["expenses"]} == {first["id"], second["id"]}
+    assert groups[0]["expenses"][0]["date"] == "2026-05-04T10:00:00"
+
+
+def test_reclassify_applies_new_keywords_to_rules_expenses_only(client, auth_headers):
+    headers = auth_headers()
+    other = auth_headers("other@test.com")
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    other_item = client.post("/api/items", json={"name": "Ajeno", "item_type": "personal"}, headers=other).json()["id"]
+    rules_ids = [
+        client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description=f"tamal {i}"), headers=headers).json()["id"]
+        for i in range(5)
+    ]
+    manual_id = client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="tamal"), headers=headers).json()["id"]
+    client.patch(f"/api/items/{item_id}/expenses/{manual_id}/category", json={"category": "salud"}, headers=headers)
+    other_id = client.post(f"/api/items/{other_item}/expenses", json=_expense_payload(description="tamal"), headers=other).json()["id"]
+
+    client.post("/api/categories", json={"name": "antojos", "keywords": "tamal"}, headers=headers)
+    r = client.post("/api/categories/reclassify", headers=headers)
+    assert r.status_code == 200
+    assert r.json()["scanned"] == 5 and r.json()["updated"] == 5
+
+    categories = {e["id"]: e["ai_category"] for e in client.get(f"/api/items/{item_id}/expenses", headers=headers).json()}
+    assert all(categories[expense_id] == "antojos" for expense_id in rules_ids)
+    assert categories[manual_id] == "salud"
+    # Solo los items del usuario
+    other_expenses = client.get(f"/api/items/{other_item}/expenses", headers=other).json()
+    assert other_expenses[0]["id"] == other_id and other_expenses[0]["ai_category"] == "otros"
+
+    # Sin cambios en las reglas no se reescribe nada
+    assert client.post(f"/api/categories/reclassify?item_id={item_id}", headers=headers).json()["updated"] == 0
+    assert client.post(f"/api/categories/reclassify?item_id={other_item}", headers=headers).status_code == 403
+
+
+def test_reclassify_streams_in_chunks(db, client, auth_headers):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    for i in range(7):
+        client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description=f"uber {i}"), headers=headers)
+
+    seen = []
+    stats = reclassify_rules_expenses(db, item_id=item_id, chunk_size=3, progress=lambda s: seen.append(s["scanned"]))
+    assert seen == [3, 6, 7]
+    assert stats["chunks"] == 3 and stats["updated"] == 0
+
+
 # ---- Resumen (sin OPENAI_API_KEY -> usa reglas) ----
 
 def test_generate_summary_without_openai_uses_rules(client, auth_headers):
@@ -285,3 +376,306 @@ def test_generate_summary_without_openai_uses_rules(client, auth_headers):
     assert r.json()["ai_model"] == "rules-v1"
 
 
+
+
+def test_summary_groups_by_currency_and_folds_unknown_categories(client, auth_headers, db):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    for description, amount, currency in [("Uber", 10, "soles"), ("Uber", 5, "soles"), ("Taxi", 3, "dolares"), ("cine", 7, "soles")]:
+        client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description=description, amount=amount, currency=currency), headers=headers)
+    # Cambio directo en la base (fuera de la API): hay que regenerar los contadores
+    db.query(Expense).filter(Expense.description == "cine").update({"ai_category": "categoria-borrada"})
+    rebuild_item_totals(db, [item_id])
+    db.commit()
+
+    r = client.get(f"/api/items/{item_id}/summary", headers=headers)
+    assert r.status_code == 200
+    body = r.json()
+    assert body["expenses_processed"] == 4
+    soles = {s["category"]: (s["total_amount"], s["expense_count"]) for s in body["categories_by_currency"]["soles"]}
+    assert soles == {"transporte": (15.0, 2), "otros": (7.0, 1)}
+    assert body["categories_by_currency"]["dolares"][0]["expense_count"] == 1
+
+
+def test_summary_get_serves_snapshot_until_item_or_categories_change(client, auth_headers, db):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    assert client.get(f"/api/items/{item_id}/summary", headers=headers).status_code == 404
+    client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="Uber"), headers=headers)
+
+    first = client.get(f"/api/items/{item_id}/summary", headers=headers).json()
+    assert client.get(f"/api/items/{item_id}/summary", headers=headers).json()["generated_at"] == first["generated_at"]
+
+    client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="Taxi"), headers=headers)
+    second = client.get(f"/api/items/{item_id}/summary", headers=headers).json()
+    assert second["expenses_processed"] == 2 and second["generated_at"] != first["generated_at"]
+
+    categories = client.get("/api/categories", headers=headers).json()
+    transporte = next(c for c in categories if c["name"] == "transporte")
+    client.put(f"/api/categories/{transporte['id']}", json={"name": "movilidad"}, headers=headers)
+    third = client.get(f"/api/items/{item_id}/summary", headers=headers).json()
+    assert third["categories_by_currency"]["soles"][0]["category"] == "movilidad"
+
+
+def test_stale_summary_is_regenerated_once_for_concurrent_readers(client, auth_headers, monkeypatch):
+    import threading
+    import time
+    import main
+
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="Uber"), headers=headers)
+
+    calls = []
+    build = main.build_summary_payload
+
+    def slow_build(*args):
+        calls.append(1)
+        time.sleep(0.1)
+        return build(*args)
+
+    monkeypatch.setattr(main, "build_summary_payload", slow_build)
+    responses = []
+    threads = [
+        threading.Thread(target=lambda: responses.append(client.get(f"/api/items/{item_id}/summary", headers=headers)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [r.status_code for r in responses] == [200] * 4
+    assert len(calls) == 1
+
+
+def test_summary_counters_follow_every_expense_write(client, auth_headers, db):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    ids = [
+        client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description=d, amount=a), headers=headers).json()["id"]
+        for d, a in [("Uber", 10), ("Netflix", 20), ("cine", 5), ("Taxi", 8)]
+    ]
+    client.put(f"/api/items/{item_id}/expenses/{ids[0]}", json={"amount": 12, "currency": "dolares"}, headers=headers)
+    client.patch(f"/api/items/{item_id}/expenses/{ids[2]}/category", json={"category": "salud"}, headers=headers)
+    client.delete(f"/api/items/{item_id}/expenses/{ids[3]}", headers=headers)
+    categories = {c["name"]: c["id"] for c in client.get("/api/categories", headers=headers).json()}
+    client.put(f"/api/categories/{categories['salud']}", json={"name": "bienestar"}, headers=headers)
+    client.delete(f"/api/categories/{categories['servicios']}", headers=headers)
+    client.post(f"/api/items/{item_id}/next-month", headers=headers)
+    client.post("/api/categories/reclassify", headers=headers)
+
+    assert verify_item_totals(db) == []
+    body = client.get(f"/api/items/{item_id}/summary", headers=headers).json()
+    assert body["expenses_processed"] == 3
+    soles = {s["category"]: s["total_amount"] for s in body["categories_by_currency"]["soles"]}
+    assert soles["bienestar"] == 5.0 and sum(soles.values()) == 25.0
+    assert body["categories_by_currency"]["dolares"][0]["total_amount"] == 12.0
+
+
+def test_verify_reports_counter_drift(client, auth_headers, db):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="Uber", amount=10), headers=headers)
+    db.query(Expense).update({"amount": 15})
+    db.commit()
+
+    drift = verify_item_totals(db)
+    assert [(d["category"], d["stored_amount"], d["actual_amount"]) for d in drift] == [("transporte", 10.0, 15.0)]
+    rebuild_item_totals(db)
+    assert verify_item_totals(db) == []
+
+
+def test_expenses_keyset_pagination(client, auth_headers):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    for day in [1, 2, 2, 2, 3, 4, 5]:
+        client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(date=f"2026-08-0{day}T10:00"), headers=headers)
+    everything = client.get(f"/api/items/{item_id}/expenses", headers=headers)
+    assert "x-next-cursor" not in everything.headers and len(everything.json()) == 7
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        r = client.get(f"/api/items/{item_id}/expenses", params=params, headers=headers)
+        pages.append([e["id"] for e in r.json()])
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert [len(p) for p in pages] == [3, 3, 1]
+    assert [i for page in pages for i in page] == [e["id"] for e in everything.json()]
+    assert client.get(f"/api/items/{item_id}/expenses", params={"cursor": "basura"}, headers=headers).status_code == 400
+
+
+def test_list_endpoints_match_their_response_schemas(client, auth_headers, db):
+    from models import Category, Item
+    from schemas import CategoryResponse, ExpenseResponse, ItemResponse
+
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "shared"}, headers=headers).json()["id"]
+    for i in range(3):
+        client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description=f"Uber {i}", date=f"2026-08-0{i + 1}T10:30"), headers=headers)
+
+    expected = [
+        ExpenseResponse.model_validate(e).model_dump(mode="json")
+        for e in db.query(Expense).order_by(Expense.date.desc(), Expense.created_at.desc(), Expense.id.desc())
+    ]
+    assert client.get(f"/api/items/{item_id}/expenses", headers=headers).json() == expected
+    assert expected[0]["date"] == "2026-08-03T10:30:00"
+
+    item = db.get(Item, item_id)
+    expected_item = ItemResponse.model_validate(item).model_dump(mode="json") | {"owner_email": "user@test.com"}
+    assert client.get("/api/items", headers=headers).json() == [expected_item]
+
+    categories = [CategoryResponse.model_validate(c).model_dump(mode="json") for c in db.query(Category).order_by(Category.position)]
+    assert client.get("/api/categories", headers=headers).json() == categories
+
+
+def test_large_list_responses_are_gzipped(client, auth_headers):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    for i in range(15):
+        client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description=f"gasto {i}"), headers=headers)
+
+    r = client.get(f"/api/items/{item_id}/expenses", headers={**headers, "Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip" and len(r.json()) == 15
+    small = client.get(f"/api/items/{item_id}/expenses", params={"limit": 1}, headers={**headers, "Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+
+def test_participants_read_model_lists_owner_members_and_pending(client, auth_headers):
+    owner = auth_headers("owner@test.com")
+    partner = auth_headers("partner@test.com")
+    outsider = auth_headers("outsider@test.com")
+    item_id = client.post("/api/items", json={"name": "Compartido", "item_type": "shared"}, headers=owner).json()["id"]
+    client.post(f"/api/items/{item_id}/participants", json={"email": "partner@test.com"}, headers=owner)
+    client.post(f"/api/items/{item_id}/participants", json={"email": "nuevo@test.com"}, headers=owner)
+
+    participants = client.get(f"/api/items/{item_id}/participants", headers=partner).json()
+    assert [(p["email"], p["is_pending"]) for p in participants] == [
+        ("owner@test.com", False), ("partner@test.com", False), ("nuevo@test.com", True)
+    ]
+    assert participants[2]["name"] is None
+    assert client.get(f"/api/items/{item_id}/participants", headers=outsider).status_code == 403
+    assert client.get("/api/items/no-existe/participants", headers=owner).status_code == 404
+    assert client.get(f"/api/items/{item_id}/summary", headers=outsider).status_code == 403
+    assert [i["id"] for i in client.get("/api/items", headers=partner).json()] == [item_id]
+
+
+def test_expense_changes_since_watermark(client, auth_headers, monkeypatch):
+    import expense_sync
+    monkeypatch.setattr(expense_sync, "SYNC_WATERMARK_LAG", expense_sync.timedelta(0))
+    headers = auth_headers("owner@test.com")
+    auth_headers("partner@test.com")
+    item_id = client.post("/api/items", json={"name": "Compartido", "item_type": "shared"}, headers=headers).json()["id"]
+    ids = [
+        client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description=f"gasto {i}"), headers=headers).json()["id"]
+        for i in range(3)
+    ]
+
+    initial = client.get(f"/api/items/{item_id}/expenses/changes", headers=headers).json()
+    assert sorted(e["id"] for e in initial["expenses"]) == sorted(ids)
+    assert initial["deleted"] == [] and not initial["full_resync"]
+
+    watermark = initial["watermark"]
+    client.patch(f"/api/items/{item_id}/expenses/{ids[0]}/settled", headers=headers)
+    client.delete(f"/api/items/{item_id}/expenses/{ids[1]}", headers=headers)
+    changes = client.get(f"/api/items/{item_id}/expenses/changes", params={"since": watermark}, headers=headers).json()
+    assert [e["id"] for e in changes["expenses"]] == [ids[0]] and changes["expenses"][0]["is_settled"]
+    assert changes["deleted"] == [ids[1]]
+    assert changes["item_changed"] is False
+
+    watermark = changes["watermark"]
+    client.post(f"/api/items/{item_id}/participants", json={"email": "partner@test.com"}, headers=headers)
+    changes = client.get(f"/api/items/{item_id}/expenses/changes", params={"since": watermark}, headers=headers).json()
+    assert changes["expenses"] == [] and changes["deleted"] == [] and changes["item_changed"] is True
+
+    stale = client.get(f"/api/items/{item_id}/expenses/changes", params={"since": "2000-01-01T00:00:00"}, headers=headers)
+    assert stale.json()["full_resync"] is True
+    assert client.get(f"/api/items/{item_id}/expenses/changes", params={"since": "ayer"}, headers=headers).status_code == 400
+
+
+def test_bulk_create_reports_row_errors_and_creates_the_rest(client, auth_headers, db):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    rows = [
+        _expense_payload(description="Uber al aeropuerto", amount=30, date="2026-08-01T10:30"),
+        {"description": "sin monto", "payment_method": "banco"},
+        _expense_payload(description="Netflix", amount=45, currency="dolares"),
+        _expense_payload(date="ayer"),
+        _expense_payload(paid_by="otro-usuario"),
+    ]
+    r = client.post(f"/api/items/{item_id}/expenses/bulk", json={"expenses": rows}, headers=headers)
+    assert r.status_code == 201
+    body = r.json()
+    assert body["created"] == 2
+    assert [e["index"] for e in body["errors"]] == [1, 3, 4]
+    assert body["errors"][0]["detail"].startswith("amount")
+
+    expenses = {e["id"]: e for e in client.get(f"/api/items/{item_id}/expenses", headers=headers).json()}
+    assert set(expenses) == set(body["ids"])
+    first = expenses[body["ids"][0]]
+    assert first["ai_category"] == "transporte" and first["date"] == "2026-08-01T10:30:00"
+    assert db.get(Expense, body["ids"][0]).description_normalized == "uber al aeropuerto"
+    assert verify_item_totals(db) == []
+    assert client.get("/api/capital", headers=headers).json()["by_currency"] == {"soles": -30.0, "dolares": -45.0}
+
+
+def test_offline_sync_is_idempotent_per_entry(client, auth_headers, db, monkeypatch):
+    import offline_sync
+    headers = auth_headers("owner@test.com")
+    other = auth_headers("other@test.com")
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    foreign_id = client.post("/api/items", json={"name": "Ajeno", "item_type": "personal"}, headers=other).json()["id"]
+    entries = [
+        {"key": "k1", "item_id": item_id, "expense": _expense_payload(description="Uber", amount=10)},
+        {"key": "k2", "item_id": item_id, "expense": _expense_payload(description="Wong", amount=20)},
+        {"key": "k1", "item_id": item_id, "expense": _expense_payload(description="Uber", amount=10)},
+        {"key": "k3", "item_id": foreign_id, "expense": _expense_payload()},
+        {"key": "k4", "item_id": item_id, "expense": {"description": "sin monto"}},
+    ]
+
+    first = client.post("/api/sync/expenses", json={"entries": entries}, headers=headers).json()["results"]
+    assert [r["status"] for r in first] == ["created", "created", "duplicate", "error", "error"]
+    assert first[2]["expense_id"] == first[0]["expense_id"]
+    assert first[3]["detail"] == "Not authorized to access this item"
+
+    # Reintento de la misma cola, incluso si otro pedido confirmó las claves en paralelo
+    real_stored_keys = offline_sync._stored_keys
+    calls = []
+
+    def racing_stored_keys(*args):
+        calls.append(args)
+        return {} if len(calls) == 1 else real_stored_keys(*args)
+
+    monkeypatch.setattr(offline_sync, "_stored_keys", racing_stored_keys)
+    retry = client.post("/api/sync/expenses", json={"entries": entries[:2]}, headers=headers).json()["results"]
+    assert len(calls) == 2
+    assert [(r["status"], r["expense_id"]) for r in retry] == [("duplicate", first[0]["expense_id"]), ("duplicate", first[1]["expense_id"])]
+
+    assert db.query(Expense).filter(Expense.item_id == item_id).count() == 2
+    assert verify_item_totals(db) == []
+    assert client.get("/api/capital", headers=headers).json()["by_currency"] == {"soles": -30.0}
+
+
+def test_bulk_delete_leaves_tombstones_and_counters_in_sync(client, auth_headers, db):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    ids = client.post(f"/api/items/{item_id}/expenses/bulk", json={"expenses": [
+        _expense_payload(description="Uber", amount=10, date="2026-08-01T10:00"),
+        _expense_payload(description="Taxi", amount=15, date="2026-08-20T10:00"),
+        _expense_payload(description="Netflix", amount=40, date="2026-08-21T10:00"),
+    ]}, headers=headers).json()["ids"]
+    watermark = client.get(f"/api/items/{item_id}/expenses/changes", headers=headers).json()["watermark"]
+
+    r = client.post(f"/api/items/{item_id}/expenses/bulk-delete", json={
+        "category": "transporte", "date_from": "2026-08-15", "date_to": "2026-08-31",
+    }, headers=headers)
+    assert r.json()["affected"] == 1
+    assert client.post(f"/api/items/{item_id}/expenses/bulk-delete", json={}, headers=headers).status_code == 400
+
+    changes = client.get(f"/api/items/{item_id}/expenses/changes", params={"since": "2000-01-01"}, headers=headers).json()
+    assert changes["full_resync"] is True
+    changes = client.get(f"/api/items/{item_id}/expenses/changes", params={"since": watermark}, headers=headers).json()
+    assert ids[1] in changes["deleted"]
+    assert verify_item_totals(db) == []
+    assert sorted(e["id"] for e in client.get(f"/api/items/{item_id}/expenses", headers=headers).json()) == sorted([ids[0], ids[2]])
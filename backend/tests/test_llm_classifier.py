@@ -0,0 +1,190 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from classification import category_registry
+from llm_classifier import LLMCache, LLMClassifier, classify_expenses_with_llm, llm_classifier
+from models import Expense
+
+KEYWORDS = {"netflix": "servicios", "uber": "transporte", "pollo": "alimentacion"}
+
+
+class _StubLLM(BaseHTTPRequestHandler):
+    """Endpoint /v1/chat/completions mínimo: clasifica por palabra clave, puede fallar las
+    primeras `fail_first` llamadas con 429 o responder una página HTML con 200 (`html`,
+    como un proxy) y registra la concurrencia máxima."""
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append(payload)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            fail = len(server.requests) <= server.fail_first
+        try:
+            time.sleep(server.delay)
+            if self.path != "/v1/chat/completions" or self.headers.get("Authorization") != "Bearer test-key":
+                return self._reply(404, {"error": "not found"})
+            if fail:
+                return self._reply(429, {"error": "rate limited"}, {"Retry-After": server.retry_after})
+            if server.html:
+                return self._send(200, b"<html><body>Bad gateway</body></html>", "text/html")
+            descriptions = json.loads(payload["messages"][1]["content"])["descripciones"]
+            labels = [next((c for k, c in KEYWORDS.items() if k in d), "otros") for d in descriptions]
+            content = json.dumps({"categories": labels})
+            self._reply(200, {"choices": [{"message": {"role": "assistant", "content": content}}]})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _reply(self, status, body, headers=None):
+        self._send(status, json.dumps(body).encode(), "application/json", headers)
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubLLM)
+    server.lock = threading.Lock()
+    server.requests, server.in_flight, server.max_in_flight = [], 0, 0
+    server.fail_first, server.delay, server.retry_after, server.html = 0, 0.0, "0", False
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _classifier(stub, **overrides):
+    options = {"concurrency": 2, "batch_size": 3, "max_retries": 2, "backoff_seconds": 0.01, "cache": LLMCache()}
+    options.update(overrides)
+    return LLMClassifier(f"http://127.0.0.1:{stub.server_port}/v1", "test-key", "gpt-test", **options)
+
+
+def _seed_expenses(client, auth_headers, descriptions):
+    headers = auth_headers()
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    for description in descriptions:
+        client.post(f"/api/items/{item_id}/expenses", json={
+            "amount": 10, "description": description, "payment_method": "banco",
+        }, headers=headers)
+    return item_id, headers
+
+
+def test_batches_concurrently_and_sends_each_description_once(stub, client, auth_headers, db):
+    stub.delay = 0.05
+    descriptions = ["Netflix", "netflix ", "Uber", "UBER", "Pollo a la brasa", "cine", "cafe", "libro", "Netflix"]
+    item_id, _ = _seed_expenses(client, auth_headers, descriptions)
+    classifier = _classifier(stub)
+
+    stats = classify_expenses_with_llm(db, category_registry.get(db).names, item_id=item_id, classifier=classifier)
+    db.commit()
+
+    assert stats["expenses"] == 9 and stats["unique_descriptions"] == 6 and stats["updated"] == 9
+    sent = [d for r in stub.requests for d in json.loads(r["messages"][1]["content"])["descripciones"]]
+    assert sorted(sent) == sorted(["netflix", "uber", "pollo a la brasa", "cine", "cafe", "libro"])
+    assert len(stub.requests) == 2 and stub.max_in_flight == 2
+
+    rows = {e.description: (e.ai_category, e.ai_model) for e in db.query(Expense)}
+    assert rows["Netflix"] == ("servicios", "gpt-test")
+    assert rows["UBER"] == ("transporte", "gpt-test")
+    assert rows["cine"] == ("otros", "gpt-test")
+
+
+def test_concurrency_is_bounded_by_the_semaphore(stub):
+    stub.delay = 0.05
+    classifier = _classifier(stub, batch_size=1, concurrency=3)
+    labels = asyncio.run(classifier.classify([f"gasto {i}" for i in range(9)], ["otros"]))
+    assert len(labels) == 9
+    assert stub.max_in_flight == 3
+
+
+def test_retries_rate_limited_batches(stub):
+    stub.fail_first = 2
+    classifier = _classifier(stub)
+    labels = asyncio.run(classifier.classify(["uber"], ["transporte", "otros"]))
+    assert labels == {"uber": "transporte"}
+    assert classifier.stats()["retries"] == 2 and len(stub.requests) == 3
+
+
+def test_gives_up_after_max_retries_without_writing(stub, client, auth_headers, db):
+    stub.fail_first = 100
+    item_id, _ = _seed_expenses(client, auth_headers, ["uber"])
+    classifier = _classifier(stub, max_retries=1)
+    stats = classify_expenses_with_llm(db, category_registry.get(db).names, item_id=item_id, classifier=classifier)
+    assert stats["updated"] == 0 and classifier.stats()["failed_batches"] == 1
+    assert db.query(Expense).one().ai_model == "rules-v1"
+
+
+def test_reuses_llm_labels_already_in_the_database(stub, client, auth_headers, db):
+    item_id, headers = _seed_expenses(client, auth_headers, ["Netflix"])
+    classify_expenses_with_llm(db, category_registry.get(db).names, item_id=item_id, classifier=_classifier(stub))
+    db.commit()
+    client.post(f"/api/items/{item_id}/expenses", json={"amount": 5, "description": "netflix", "payment_method": "banco"}, headers=headers)
+
+    fresh = _classifier(stub)  # otro proceso: cache en memoria vacía
+    stats = classify_expenses_with_llm(db, category_registry.get(db).names, item_id=item_id, classifier=fresh)
+    assert stats["updated"] == 1 and len(stub.requests) == 1
+
+
+def test_llm_labels_survive_description_edits_and_manual_labels_are_skipped(stub, client, auth_headers, db):
+    item_id, headers = _seed_expenses(client, auth_headers, ["uber", "pollo"])
+    manual = db.query(Expense).filter(Expense.description == "pollo").one()
+    client.patch(f"/api/items/{item_id}/expenses/{manual.id}/category", json={"category": "salud"}, headers=headers)
+    stats = classify_expenses_with_llm(db, category_registry.get(db).names, item_id=item_id, classifier=_classifier(stub))
+    db.commit()
+    assert stats["expenses"] == 1
+
+    uber = db.query(Expense).filter(Expense.description == "uber").one()
+    r = client.put(f"/api/items/{item_id}/expenses/{uber.id}", json={"description": "uber al aeropuerto"}, headers=headers)
+    assert r.json()["ai_model"] == "gpt-test"
+
+
+def test_generate_summary_uses_llm_when_configured(stub, client, auth_headers, monkeypatch):
+    configured = _classifier(stub)
+    for attr in ("base_url", "api_key", "model", "cache"):
+        monkeypatch.setattr(llm_classifier, attr, getattr(configured, attr))
+    item_id, headers = _seed_expenses(client, auth_headers, ["Netflix"])
+
+    r = client.post(f"/api/items/{item_id}/summary/generate", headers=headers)
+    assert r.json()["ai_model"] == "gpt-test"
+    assert r.json()["categories_by_currency"]["soles"][0]["category"] == "servicios"
+
+
+def test_non_json_200_falls_back_to_rules(stub, client, auth_headers, monkeypatch):
+    stub.html = True
+    configured = _classifier(stub)
+    for attr in ("base_url", "api_key", "model", "cache"):
+        monkeypatch.setattr(llm_classifier, attr, getattr(configured, attr))
+    item_id, headers = _seed_expenses(client, auth_headers, ["Netflix"])
+
+    r = client.post(f"/api/items/{item_id}/summary/generate", headers=headers)
+    assert r.status_code == 200
+    assert r.json()["ai_model"] == "rules-v1"
+    assert llm_classifier.stats()["failed_batches"] >= 1
+
+
+def test_retries_stop_at_the_time_budget(stub):
+    stub.fail_first, stub.retry_after = 100, "5"
+    classifier = _classifier(stub, max_retries=5, max_seconds=0.5)
+    started = time.perf_counter()
+    labels = asyncio.run(classifier.classify(["uber"], ["transporte", "otros"]))
+    assert labels == {}
+    assert time.perf_counter() - started < 1.0
+    assert len(stub.requests) == 1 and classifier.stats()["failed_batches"] == 1
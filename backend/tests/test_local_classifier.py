@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from classification import classify_normalized_batch
+from local_classifier import LOCAL_MODEL, LocalClassifier, NaiveBayesModel, char_ngrams, local_classifier
+from train_local_classifier import train
+
+SAMPLES = [
+    ("pollo a la brasa", "alimentacion"), ("menu del dia", "alimentacion"), ("cevicheria", "alimentacion"),
+    ("pollo broaster", "alimentacion"), ("menu ejecutivo", "alimentacion"), ("chifa", "alimentacion"),
+    ("vet mascota", "mascotas"), ("croquetas perro", "mascotas"), ("arena gato", "mascotas"),
+    ("vet vacuna perro", "mascotas"), ("bano perro", "mascotas"), ("croquetas gato", "mascotas"),
+]
+
+
+@pytest.fixture
+def model():
+    return NaiveBayesModel.train(SAMPLES, min_count=1)
+
+
+def _expense_payload(**overrides):
+    payload = {"amount": 20.0, "description": "gasto", "payment_method": "banco", "currency": "soles"}
+    payload.update(overrides)
+    return payload
+
+
+def test_char_ngrams_pad_each_word():
+    assert char_ngrams("ab", 2, 3) == [" a", "ab", "b ", " ab", "ab "]
+
+
+def test_model_predicts_learned_categories(model):
+    predictions = model.predict_batch(["pollo broaster familiar", "croquetas para perro", "zzzz"])
+    assert predictions[0][0] == "alimentacion"
+    assert predictions[1][0] == "mascotas" and predictions[1][1] > 0.5
+    assert predictions[2] is None
+
+
+def test_artifact_roundtrip(model, tmp_path):
+    path = str(tmp_path / "model.json.gz")
+    model.save(path)
+    loaded = NaiveBayesModel.load(path)
+    assert loaded.predict_batch(["menu del dia"]) == model.predict_batch(["menu del dia"])
+
+
+def test_create_uses_local_model_and_falls_back_to_rules(client, auth_headers, model, db):
+    headers = auth_headers()
+    client.post("/api/categories", json={"name": "mascotas"}, headers=headers)
+    local_classifier.set_model(model)
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+
+    learned = client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="Croquetas gato"), headers=headers).json()
+    assert learned["ai_category"] == "mascotas" and learned["ai_model"] == LOCAL_MODEL
+    assert learned["ai_confidence"] >= local_classifier.min_confidence
+
+    unknown = client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description="Uber"), headers=headers).json()
+    assert unknown["ai_category"] == "transporte" and unknown["ai_model"] == "rules-v1"
+
+
+def test_prediction_for_deleted_category_falls_back_to_rules(db, model):
+    local_classifier.set_model(model)
+    # "mascotas" no existe como categoría: no se acepta la predicción
+    assert classify_normalized_batch(["croquetas gato"], db)[0].model == "rules-v1"
+
+
+def test_latency_budget_falls_back_to_rules(db, model, client, auth_headers):
+    client.post("/api/categories", json={"name": "mascotas"}, headers=auth_headers())
+    local_classifier.set_model(model)
+    budget = local_classifier.budget_ms
+    local_classifier.budget_ms = 0
+    try:
+        results = classify_normalized_batch(["croquetas gato", "menu del dia"], db)
+    finally:
+        local_classifier.budget_ms = budget
+    assert [r.model for r in results] == ["rules-v1", "rules-v1"]
+    assert local_classifier.stats()["over_budget"] == 2
+
+
+def test_train_from_manual_corrections(client, auth_headers, db, tmp_path):
+    headers = auth_headers()
+    client.post("/api/categories", json={"name": "mascotas"}, headers=headers)
+    item_id = client.post("/api/items", json={"name": "Item", "item_type": "personal"}, headers=headers).json()["id"]
+    for description, category in SAMPLES:
+        expense_id = client.post(f"/api/items/{item_id}/expenses", json=_expense_payload(description=description), headers=headers).json()["id"]
+        client.patch(f"/api/items/{item_id}/expenses/{expense_id}/category", json={"category": category}, headers=headers)
+
+    assert train(str(tmp_path / "few.json.gz"), min_samples=50) is None
+    model = train(str(tmp_path / "model.json.gz"), min_samples=10, min_count=1)
+    assert set(model.classes) == {"alimentacion", "mascotas"}
+    assert model.samples == len(SAMPLES)
+
+
+def test_artifact_mtime_is_checked_at_most_once_per_interval(model, tmp_path, monkeypatch):
+    path = tmp_path / "model.json.gz"
+    model.save(str(path))
+    classifier = LocalClassifier(str(path), check_interval=60)
+    stats = []
+    real_getmtime = os.path.getmtime
+    monkeypatch.setattr(os.path, "getmtime", lambda p: stats.append(p) or real_getmtime(p))
+
+    for _ in range(5):
+        assert classifier.predict_batch(["pollo a la brasa"])[0][0] == "alimentacion"
+    assert len(stats) == 1
+
+    classifier.check_interval = 0
+    os.remove(path)
+    assert classifier.model() is None
+
+
+def test_repeated_descriptions_in_a_batch_share_one_prediction(model):
+    predictions = model.predict_batch(["arena gato", "menu del dia", "arena gato"])
+    assert predictions[0] == predictions[2] and predictions[0][0] == "mascotas"
@@ -1,7 +1,13 @@
+import random
+
 import pytest
 from fastapi import HTTPException
 
+from classification import (
+    CategoryRegistry, KeywordMatcher, backfill_normalized_descriptions, category_registry, normalize_description,
+)
 from main import classify_expense_with_rules, validate_category, next_month_name
+from models import Category, Expense, Item, User
 
 
 # ---- classify_expense_with_rules ----
@@ -23,6 +29,71 @@ def test_classify_no_match_falls_back_to_otros(db):
     assert classify_expense_with_rules("xyzxyz sin sentido", db) == "otros"
 
 
+def test_classify_ignores_accents(db):
+    assert classify_expense_with_rules("Clínica San Pablo", db) == "salud"
+    assert KeywordMatcher([("alimentacion", ["alimentación"])]).classify("ALIMENTACION semanal") == "alimentacion"
+
+
+def test_normalize_description_folds_accents_case_and_spaces():
+    assert normalize_description("  Clínica   SAN\tPablo ") == "clinica san pablo"
+    assert normalize_description("Año nuevo, café") == "ano nuevo, cafe"
+    assert normalize_description(None) == ""
+
+
+def test_backfill_normalized_descriptions_in_chunks(db):
+    user = User(email="n@test.com", name="N", hashed_password="x")
+    db.add(user)
+    db.flush()
+    item = Item(name="Viejo", item_type="personal", owner_id=user.id)
+    db.add(item)
+    db.flush()
+    for i in range(5):
+        db.add(Expense(item_id=item.id, amount=1, description=f"Clínica {i}", payment_method="banco", paid_by=user.id))
+    db.commit()
+
+    assert backfill_normalized_descriptions(db, chunk_size=2) == 5
+    db.commit()
+    assert sorted(n for (n,) in db.query(Expense.description_normalized)) == [f"clinica {i}" for i in range(5)]
+    assert backfill_normalized_descriptions(db) == 0
+
+
+def test_matcher_first_category_by_position_wins():
+    # "bar" aparece antes en el texto, pero "barco" pertenece a una categoría anterior
+    matcher = KeywordMatcher([("viajes", ["barco"]), ("entretenimiento", ["bar"])])
+    assert matcher.classify("bar del barco") == "viajes"
+    assert matcher.classify("un bar") == "entretenimiento"
+
+
+def test_matcher_agrees_with_linear_scan():
+    rng = random.Random(3)
+    for _ in range(500):
+        categories = [
+            (f"c{i}", ["".join(rng.choice("abc") for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(0, 3))])
+            for i in range(rng.randint(1, 6))
+        ]
+        matcher = KeywordMatcher(categories)
+        for _ in range(20):
+            text_value = "".join(rng.choice("abcd ") for _ in range(rng.randint(1, 15))).strip()
+            expected = next((name for name, keywords in categories if any(k in text_value for k in keywords)), "otros")
+            assert matcher.classify(text_value) == expected
+
+
+def test_matcher_is_built_once_and_rebuilt_on_category_change(client, auth_headers, db):
+    headers = auth_headers()
+    classify_expense_with_rules("uber", db)
+    loads = category_registry.loads
+    for _ in range(10):
+        classify_expense_with_rules("uber", db)
+    assert category_registry.loads == loads
+
+    category_id = client.post("/api/categories", json={"name": "mascotas", "keywords": "ornitorrinco"}, headers=headers).json()["id"]
+    assert classify_expense_with_rules("ornitorrinco", db) == "mascotas"
+    client.put(f"/api/categories/{category_id}", json={"keywords": "quirquincho"}, headers=headers)
+    assert classify_expense_with_rules("ornitorrinco", db) == "otros"
+    assert classify_expense_with_rules("quirquincho lima", db) == "mascotas"
+    assert category_registry.loads == loads + 2
+
+
 # ---- validate_category ----
 
 def test_validate_category_normalizes(db):
@@ -38,6 +109,27 @@ def test_validate_category_empty_falls_back_to_otros(db):
     assert validate_category(None, db) == "otros"
 
 
+def test_registry_snapshot_has_ordered_names_and_default(db):
+    snapshot = category_registry.get(db)
+    assert snapshot.names[:2] == ("alimentacion", "supermercado") and "otros" in snapshot.name_set
+    assert snapshot.default == "otros"
+    assert snapshot is category_registry.get(db)
+
+
+def test_registry_reloads_when_another_worker_bumps_the_version(db):
+    # Otro worker: registro propio que revisa la fila de versión en cada llamada
+    other_worker = CategoryRegistry(check_interval=0)
+    assert validate_category("mascotas", db) == "otros"
+    assert other_worker.get(db).validate("mascotas") == "otros"
+
+    db.add(Category(name="mascotas", position=99))
+    category_registry.bump(db)
+    db.commit()
+
+    assert other_worker.get(db).validate("mascotas") == "mascotas"
+    assert other_worker.loads == 2
+
+
 # ---- next_month_name ----
 
 def test_next_month_name_basic():
@@ -0,0 +1,59 @@
+"""
+Entrena el clasificador local (Naive Bayes sobre n-gramas de caracteres) con las
+correcciones manuales de categoría (ai_model = "manual") y guarda el artefacto.
+
+Antes de guardar mide la exactitud sobre un 20% de los ejemplos apartado para
+validación, junto a la de las reglas sobre los mismos gastos. La API recarga el
+artefacto sola cuando el archivo cambia.
+
+Uso: python train_local_classifier.py [--output local_classifier.json.gz] [--min-samples 30]
+"""
+
+import argparse
+import os
+import zlib
+
+from database import SessionLocal, Base, engine
+from classification import category_registry
+from local_classifier import NaiveBayesModel, local_classifier, manual_training_samples
+
+def _is_holdout(text_value):
+    return zlib.crc32(text_value.encode("utf-8")) % 5 == 0
+
+def train(output=None, min_samples=30, alpha=0.5, min_count=2):
+    output = output or local_classifier.path
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        samples = manual_training_samples(db)
+        categories = {category for _, category in samples}
+        if len(samples) < min_samples or len(categories) < 2:
+            print(f"❌ Hacen falta al menos {min_samples} correcciones manuales de 2 o más categorías "
+                  f"(hay {len(samples)} de {len(categories)}).")
+            return None
+
+        train_set = [s for s in samples if not _is_holdout(s[0])]
+        holdout = [s for s in samples if _is_holdout(s[0])]
+        if holdout and train_set:
+            model = NaiveBayesModel.train(train_set, alpha=alpha, min_count=min_count)
+            predictions = model.predict_batch([text_value for text_value, _ in holdout])
+            matcher = category_registry.get(db).matcher
+            model_hits = sum(1 for p, (_, c) in zip(predictions, holdout) if p and p[0] == c)
+            rules_hits = sum(1 for text_value, c in holdout if matcher.classify_normalized(text_value) == c)
+            print(f"Validación ({len(holdout)} gastos): modelo {model_hits / len(holdout):.1%}, "
+                  f"reglas {rules_hits / len(holdout):.1%}")
+
+        model = NaiveBayesModel.train(samples, alpha=alpha, min_count=min_count)
+        model.save(output)
+        size_kb = os.path.getsize(output) / 1024
+        print(f"✅ Modelo entrenado con {len(samples)} gastos, {len(model.classes)} categorías y "
+              f"{len(model.features)} n-gramas -> {output} ({size_kb:.0f} KB).")
+        return model
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="ruta del artefacto (por defecto LOCAL_CLASSIFIER_PATH)")
+    parser.add_argument("--min-samples", type=int, default=30)
+    parser.add_argument("--alpha", type=float, default=0.5, help="suavizado de Laplace")
+    parser.add_argument("--min-count", type=int, default=2, help="apariciones mínimas de un n-grama")
+    args = parser.parse_args()
+    train(args.output, args.min_samples, args.alpha, args.min_count)
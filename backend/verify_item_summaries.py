@@ -0,0 +1,48 @@
+"""
+Verifica los contadores del resumen (item_category_totals) contra expenses.
+
+Los endpoints mantienen los contadores con deltas; este script los recalcula desde
+cero con un GROUP BY y lista cada item/moneda/categoría que no coincide. Con --fix
+además los regenera (solo los items con diferencias). Sale con código 1 si encontró
+diferencias y no se pidió --fix.
+
+Uso: python verify_item_summaries.py [--fix]
+"""
+
+import argparse
+import sys
+
+from database import SessionLocal, Base, engine
+from summaries import rebuild_item_totals, verify_item_totals
+
+def verify(fix=False):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        try:
+            print("Comparando item_category_totals con expenses...")
+            drift = verify_item_totals(db)
+            for row in drift:
+                print(f"  {row['item_id']} {row['currency']} {row['category'] or '(sin categoría)'}: "
+                      f"guardado {row['stored_amount']} ({row['stored_count']} gastos), "
+                      f"real {row['actual_amount']} ({row['actual_count']} gastos)")
+            if not drift:
+                print("✅ Sin diferencias.")
+                return drift
+            if fix:
+                rebuild_item_totals(db, {row["item_id"] for row in drift})
+                db.commit()
+                print(f"✅ {len(drift)} diferencias corregidas.")
+            else:
+                print(f"❌ {len(drift)} diferencias (usar --fix para regenerar).")
+            return drift
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Error verificando item_category_totals: {e}")
+            raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fix", action="store_true", help="regenerar los items con diferencias")
+    args = parser.parse_args()
+    if verify(args.fix) and not args.fix:
+        sys.exit(1)
@@ -1,6 +1,6 @@
 import { createContext, useState, useEffect, useCallback, useContext } from 'react';
-import { getPendingExpenses, deletePendingExpense } from '../utils/offlineDB';
-import { createExpense } from '../services/api';
+import { getPendingExpenses, applySyncResults, pendingExpenseKey } from '../utils/offlineDB';
+import { syncOfflineExpenses } from '../services/api';
 
 export const OfflineContext = createContext();
 
@@ -58,27 +58,34 @@ export const OfflineProvider = ({ children }) => {
 
       console.log(`Syncing ${pending.length} pending expenses...`);
 
-      for (const expense of pending) {
-        try {
-          // Intentar crear el gasto en el servidor
-          await createExpense(expense.itemId, {
-            amount: expense.amount,
-            description: expense.description,
-            payment_method: expense.payment_method,
-            currency: expense.currency,
-            date: expense.date,
-            paid_by: expense.paid_by,
-            split_type: expense.split_type,
-            assigned_to: expense.assigned_to
-          });
-
-          // Si se sincronizó correctamente, eliminar de IndexedDB
-          await deletePendingExpense(expense.id);
-          console.log(`Synced expense #${expense.id}`);
-        } catch (error) {
-          console.error(`Error syncing expense #${expense.id}:`, error);
-          // Si falla, lo dejamos en la cola para reintentar después
+      // Toda la cola en un pedido; cada entrada lleva su clave de idempotencia, así que si
+      // la respuesta se pierde, reenviarla no duplica gastos
+      const entries = pending.map((expense) => ({
+        key: pendingExpenseKey(expense),
+        item_id: expense.itemId,
+        expense: {
+          amount: expense.amount,
+          description: expense.description,
+          payment_method: expense.payment_method,
+          currency: expense.currency,
+          date: expense.date,
+          paid_by: expense.paid_by,
+          split_type: expense.split_type,
+          assigned_to: expense.assigned_to
         }
+      }));
+
+      try {
+        const response = await syncOfflineExpenses(entries);
+        const { results } = response.data;
+        // Borra de IndexedDB los creados y duplicados; los que fallaron quedan en la cola
+        await applySyncResults(pending, results);
+        results
+          .filter((result) => result.status === 'error')
+          .forEach((result) => console.error(`Error syncing expense ${result.key}:`, result.detail));
+      } catch (error) {
+        console.error('Error syncing pending expenses:', error);
+        // Si falla el pedido, la cola queda intacta para reintentar después
       }
 
       await updatePendingCount();
@@ -119,10 +119,33 @@ export const getExpenses = (itemId) => {
   return api.get(`/items/${itemId}/expenses`);
 };
 
+// Una página del listado (más recientes primero). nextCursor es null en la última.
+export const getExpensesPage = async (itemId, { limit = 100, cursor = null } = {}) => {
+  const params = cursor ? { limit, cursor } : { limit };
+  const response = await api.get(`/items/${itemId}/expenses`, { params });
+  return { expenses: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+};
+
+// Cambios desde la watermark anterior: { expenses, deleted, item_changed, full_resync, watermark }.
+// Sin since devuelve todos los gastos.
+export const getExpenseChanges = (itemId, since = null) => {
+  return api.get(`/items/${itemId}/expenses/changes`, { params: since ? { since } : {} });
+};
+
 export const createExpense = (itemId, data) => {
   return api.post(`/items/${itemId}/expenses`, data);
 };
 
+// Hasta 5000 gastos en un pedido: { created, ids, errors: [{ index, detail }] }
+export const createExpensesBulk = (itemId, expenses) => {
+  return api.post(`/items/${itemId}/expenses/bulk`, { expenses });
+};
+
+// Cola offline completa en un pedido: entries [{ key, item_id, expense }] -> results en el mismo orden
+export const syncOfflineExpenses = (entries) => {
+  return api.post('/sync/expenses', { entries });
+};
+
 export const updateExpense = (itemId, expenseId, data) => {
   return api.put(`/items/${itemId}/expenses/${expenseId}`, data);
 };
@@ -131,6 +154,20 @@ export const deleteExpense = (itemId, expenseId) => {
   return api.delete(`/items/${itemId}/expenses/${expenseId}`);
 };
 
+// Cambios masivos sobre una selección ({ ids } y/o filtros: between, paid_by, is_settled, category,
+// date_from, date_to). Devuelven { affected, totals, balance } con los nuevos totales del item.
+export const updateExpensesBulk = (itemId, selection, changes) => {
+  return api.patch(`/items/${itemId}/expenses`, { selection, changes });
+};
+
+export const settleExpensesBulk = (itemId, selection) => {
+  return api.post(`/items/${itemId}/expenses/settle`, selection);
+};
+
+export const deleteExpensesBulk = (itemId, selection) => {
+  return api.post(`/items/${itemId}/expenses/bulk-delete`, selection);
+};
+
 export const toggleExpenseSettled = (itemId, expenseId) => {
   return api.patch(`/items/${itemId}/expenses/${expenseId}/settled`);
 };
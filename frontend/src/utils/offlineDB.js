@@ -35,6 +35,8 @@ export const savePendingExpense = async (itemId, expenseData) => {
   const expense = {
     ...expenseData,
     itemId,
+    // Clave de idempotencia: el servidor no crea dos veces el mismo gasto aunque la cola se reenvíe
+    clientKey: crypto.randomUUID(),
     createdAt: new Date().toISOString(),
     synced: false
   };
@@ -86,6 +88,32 @@ export const deletePendingExpense = async (id) => {
   });
 };
 
+// Clave de idempotencia de un gasto encolado (los encolados antes de existir clientKey usan su id local)
+export const pendingExpenseKey = (expense) => expense.clientKey || `local-${expense.createdAt}-${expense.id}`;
+
+// Aplicar en una sola transacción los resultados de POST /sync/expenses (en el orden de `pending`):
+// se borran los creados y los duplicados; los que fallaron quedan con syncError para reintentar o revisar
+export const applySyncResults = async (pending, results) => {
+  const db = await openDB();
+  const transaction = db.transaction([STORE_NAME], 'readwrite');
+  const store = transaction.objectStore(STORE_NAME);
+
+  pending.forEach((expense, index) => {
+    const result = results[index];
+    if (!result) return;
+    if (result.status === 'created' || result.status === 'duplicate') {
+      store.delete(expense.id);
+    } else {
+      store.put({ ...expense, syncError: result.detail });
+    }
+  });
+
+  return new Promise((resolve, reject) => {
+    transaction.oncomplete = () => resolve();
+    transaction.onerror = () => reject(transaction.error);
+  });
+};
+
 // Limpiar todos los gastos sincronizados
 export const clearSyncedExpenses = async () => {
   const db = await openDB();